@@ -1,8 +1,13 @@
 import os
-import pandas as pd
-from sqlalchemy import create_engine, text
-from sklearn.cluster import KMeans
-from sklearn.preprocessing import StandardScaler
+import numpy as np
+from sqlalchemy import create_engine
+import grid_status
+import profiles
+import querylog
+import snapshots
+import telemetry
+from loader import anomaly_filter, load_frame, report_peak_rss, write_rows
+from model_selection import cluster_label, feature_sets_from_env, select_model
 
 # --- CẤU HÌNH ENVIRONMENT ---
 DB_HOST = os.getenv("DB_HOST")
@@ -14,112 +19,131 @@ DB_PASS = os.getenv("DB_PASS")
 DB_URL = f"postgresql://{DB_USER}:{DB_PASS}@{DB_HOST}:5432/{DB_NAME}"
 
 def get_db_engine():
-    return create_engine(DB_URL)
+    return create_engine(DB_URL, connect_args={"connection_factory": querylog.LoggedConnection})
 
-def bulk_update_db(engine, df, table_name, key_column, target_column='cluster_id'):
+def bulk_update_db(conn, table_name, key_column, keys, values, target_column='cluster_id', key_type='TIMESTAMP',
+                   touch_column=None, before_commit=None):
     """
     Kỹ thuật Bulk Update: Tạo bảng tạm -> Insert -> Update -> Drop.
     Nhanh gấp 100 lần so với Update từng dòng.
+    Chỉ update dòng có giá trị thực sự đổi; touch_column (vd updated_at) được set NOW() cho các dòng đó.
+    before_commit(cur): ghi thêm trong cùng transaction với lệnh UPDATE (vd snapshot trạng thái).
     """
-    if df.empty: return 0
+    if len(keys) == 0: return 0
     
     temp_table = f"temp_{table_name}_clusters"
-    
-    # Chuẩn bị dữ liệu update
-    update_df = df[[key_column, target_column]].copy()
-    if 'datetime' in key_column:
-        update_df[key_column] = update_df[key_column].astype(str)
 
-    with engine.connect() as conn:
-        trans = conn.begin()
-        try:
-            # 1. Tạo bảng tạm & Insert
-            update_df.to_sql(temp_table, conn, if_exists='replace', index=False)
-            
-            # 2. Update từ bảng tạm sang bảng chính
-            if key_column == 'datetime':
-                where_clause = f"main.{key_column}::text = temp.{key_column}"
-            else:
-                where_clause = f"main.{key_column} = temp.{key_column}"
-
-            # Cần đảm bảo cột cluster_id tồn tại trong bảng chính trước
-            # (Thường DB Admin phải alter table add column cluster_id int trước)
-            
-            sql = text(f"""
+    try:
+        with conn.cursor() as cur:
+            # 1. Tạo bảng tạm (tự drop khi commit) & Insert theo từng đoạn
+            cur.execute(f"""
+                CREATE TEMP TABLE {temp_table} ({key_column} {key_type} PRIMARY KEY, {target_column} INTEGER)
+                ON COMMIT DROP
+            """)
+        with telemetry.span("to_sql", table=temp_table):
+            write_rows(conn, f"INSERT INTO {temp_table} ({key_column}, {target_column}) VALUES %s", keys, [values])
+
+        # 2. Update từ bảng tạm sang bảng chính
+        # Cần đảm bảo cột cluster_id tồn tại trong bảng chính trước
+        # (Thường DB Admin phải alter table add column cluster_id int trước)
+        touch_sql = f", {touch_column} = NOW()" if touch_column else ""
+        with conn.cursor() as cur, telemetry.span("bulk_update", table=table_name):
+            cur.execute(f"""
                 UPDATE {table_name} AS main
-                SET {target_column} = temp.{target_column}
+                SET {target_column} = temp.{target_column}{touch_sql}
                 FROM {temp_table} AS temp
-                WHERE {where_clause};
+                WHERE main.{key_column} = temp.{key_column}
+                  AND main.{target_column} IS DISTINCT FROM temp.{target_column};
             """)
-            
-            result = conn.execute(sql)
-            
-            # 3. Dọn dẹp
-            conn.execute(text(f"DROP TABLE IF EXISTS {temp_table}"))
-            trans.commit()
-            return result.rowcount
-        except Exception as e:
-            trans.rollback()
-            print(f"❌ Bulk Update Error: {e}")
-            raise e
-
-def process_measurements_clustering(engine):
+            rowcount = cur.rowcount
+            if before_commit is not None:
+                before_commit(cur)
+        conn.commit()
+        telemetry.incr("rows_out", rowcount, table=table_name)
+        return rowcount
+    except Exception as e:
+        conn.rollback()
+        print(f"❌ Bulk Update Error: {e}")
+        raise e
+
+def process_measurements_clustering(conn):
     print("🔹 Running Measurements Clustering...")
     try:
-        # 1. Load Data
-        query = "SELECT datetime, solar_mw, wind_mw, gas_mw, carbon_intensity FROM electricity_measurements"
-        df = pd.read_sql(query, engine)
+        # 1. Load Data (float32, server-side cursor)
+        features = ['solar_mw', 'wind_mw', 'gas_mw', 'carbon_intensity']
+        candidate_sets = feature_sets_from_env(features)
+        # Đọc thêm các nguồn còn lại để tính profile (mean/std) của từng cụm
+        columns = list(dict.fromkeys([f for fs in candidate_sets for f in fs] + profiles.PROFILE_COLUMNS))
+        frame = load_frame(conn, "electricity_measurements", columns, where=anomaly_filter(conn))
         
-        if df.empty:
+        if len(frame.keys) == 0:
             print("⚠️ No measurements data found.")
             return
             
-        # 2. Preprocessing
-        features = ['solar_mw', 'wind_mw', 'gas_mw', 'carbon_intensity']
-        X = df[features].fillna(0)
-        
-        scaler = StandardScaler()
-        X_scaled = scaler.fit_transform(X)
+        # 2 + 3. Chọn k / feature set tốt nhất, nhãn sắp theo solar (0 = đêm)
+        data = {name: frame.values[:, j] for j, name in enumerate(frame.columns)}
+        with telemetry.span("kmeans", table="electricity_measurements"):
+            best = select_model(data, candidate_sets, order_feature='solar_mw')
+        for rank, center in enumerate(best['centers']):
+            print(f"   Cluster {rank} ({cluster_label(rank, best['k'])}): "
+                  + ", ".join(f"{f}={v:.1f}" for f, v in zip(best['features'], center)))
 
-        # 3. K-Means
-        kmeans = KMeans(n_clusters=3, random_state=42, n_init='auto')
-        df['cluster_id'] = kmeans.fit_predict(X_scaled)
+        # 4. Save to DB (updated_at đổi theo cluster_id -> API delta fetch thấy thay đổi)
+        with conn.cursor() as cur:
+            cur.execute("ALTER TABLE electricity_measurements ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT NOW()")
+            cur.execute(grid_status.DDL)
+            cur.execute(profiles.DDL)
+        conn.commit()
+        labels = {rank: cluster_label(rank, best['k']) for rank in range(best['k'])}
+        with telemetry.span("cluster_profiles"):
+            cluster_profiles = profiles.compute_profiles(frame, best, cluster_label)
 
-        # 4. Save to DB
-        updated = bulk_update_db(engine, df, 'electricity_measurements', 'datetime')
+        def before_commit(cur):
+            grid_status.refresh_all(cur, labels)
+            profiles.write_profiles(cur, 'electricity_measurements', cluster_profiles)
+
+        updated = bulk_update_db(conn, 'electricity_measurements', 'datetime', frame.keys, best['labels'],
+                                 touch_column='updated_at', before_commit=before_commit)
         print(f"✅ Measurements: Updated {updated} rows.")
+        # cluster_id mới -> snapshot measurements mới cho /clustering của API
+        snapshots.publish_measurements(conn)
         return True
     except Exception as e:
         print(f"❌ Error in Measurements Clustering: {e}")
         return False
 
-def process_predictions_clustering(engine):
+def process_predictions_clustering(conn):
     print("🔹 Running Predictions Clustering...")
     try:
         # 1. Load Data
         # Cần check xem bảng có tồn tại không để tránh lỗi crash
         try:
-            query = "SELECT id, predicted_solar_mw FROM solar_predictions"
-            df = pd.read_sql(query, engine)
+            frame = load_frame(conn, "solar_predictions", ['predicted_solar_mw'], key_column='id', key_dtype=np.int64)
         except Exception:
+            conn.rollback()
             print("⚠️ Table 'solar_predictions' does not exist yet.")
             return
 
-        if df.empty:
+        if len(frame.keys) == 0:
             print("⚠️ No prediction data found.")
             return
 
-        # 2. Preprocessing
-        X = df[['predicted_solar_mw']].fillna(0)
-        scaler = StandardScaler()
-        X_scaled = scaler.fit_transform(X)
+        # 2 + 3. Chọn k theo điểm, nhãn sắp theo predicted solar tăng dần
+        with telemetry.span("kmeans", table="solar_predictions"):
+            best = select_model({'predicted_solar_mw': frame.values[:, 0]}, [['predicted_solar_mw']],
+                                order_feature='predicted_solar_mw')
+
+        # 4. Save to DB (tên cụm ghi cùng transaction để API không phải tự suy ra k)
+        with conn.cursor() as cur:
+            cur.execute(profiles.DDL)
+        conn.commit()
+        label_profiles = profiles.label_profiles(best, cluster_label)
 
-        # 3. K-Means
-        kmeans = KMeans(n_clusters=3, random_state=42, n_init='auto')
-        df['cluster_id'] = kmeans.fit_predict(X_scaled)
+        def before_commit(cur):
+            profiles.write_profiles(cur, 'solar_predictions', label_profiles)
 
-        # 4. Save to DB
-        updated = bulk_update_db(engine, df, 'solar_predictions', 'id')
+        updated = bulk_update_db(conn, 'solar_predictions', 'id', frame.keys, best['labels'], key_type='BIGINT',
+                                 before_commit=before_commit)
         print(f"✅ Predictions: Updated {updated} rows.")
         return True
     except Exception as e:
@@ -130,12 +154,17 @@ def run_clustering_job():
     print("--- Starting Clustering Job ---")
     try:
         engine = get_db_engine()
+        conn = engine.raw_connection()
         
         # Chạy tuần tự 2 task
-        task1 = process_measurements_clustering(engine)
-        task2 = process_predictions_clustering(engine)
-        
-        engine.dispose()
+        try:
+            task1 = process_measurements_clustering(conn)
+            task2 = process_predictions_clustering(conn)
+        finally:
+            querylog.flush(conn)
+            conn.close()
+            engine.dispose()
+            report_peak_rss("clustering")
         
         if task1 or task2:
             return True
@@ -144,4 +173,4 @@ def run_clustering_job():
             
     except Exception as e:
         print(f"❌ Critical Job Error: {e}")
-        return False
\ No newline at end of file
+        return False
@@ -0,0 +1,113 @@
+"""
+Snapshot trạng thái lưới hiện tại: bảng grid_status_snapshot, 1 dòng / zone.
+
+Được làm mới trong cùng transaction với lệnh ghi measurements (ingestion) và
+cluster_id (clustering), nên /status/latest chỉ cần đọc 1 dòng theo primary key
+thay vì sort cả bảng measurements mỗi lần poll.
+
+Lưu ý: file này có bản sao y hệt ở ingestion/grid_status.py (mỗi service
+build image riêng) — sửa ở đây thì sửa cả bên kia.
+"""
+import json
+
+import telemetry
+
+SOURCE_COLUMNS = [
+    "solar_mw", "wind_mw", "gas_mw", "unknown_mw",
+    "hydro_mw", "biomass_mw", "nuclear_mw", "geothermal_mw",
+]
+
+
+def _total(alias):
+    return " + ".join(f"COALESCE({alias}.{c}, 0)" for c in SOURCE_COLUMNS)
+
+
+DDL = f"""
+    CREATE TABLE IF NOT EXISTS grid_status_snapshot (
+        zone VARCHAR(50) PRIMARY KEY,
+        measured_at TIMESTAMP NOT NULL,
+        carbon_intensity FLOAT,
+        {', '.join(f'{c} FLOAT' for c in SOURCE_COLUMNS)},
+        total_mw FLOAT,
+        delta_1h_mw FLOAT,
+        delta_24h_mw FLOAT,
+        cluster_id INTEGER,
+        cluster_label VARCHAR(50),
+        refreshed_at TIMESTAMP DEFAULT NOW()
+    );
+"""
+
+# Dòng mới nhất của zone + tổng tải + chênh lệch so với 1h / 24h trước (NULL nếu thiếu giờ đó).
+# cluster_labels: JSON {cluster_id: label} do clustering truyền vào; ingestion truyền NULL
+# -> giữ label cũ nếu cluster_id không đổi, ngược lại NULL (giờ mới chưa được phân cụm).
+REFRESH_SQL = f"""
+    INSERT INTO grid_status_snapshot AS snap
+        (zone, measured_at, carbon_intensity, {', '.join(SOURCE_COLUMNS)},
+         total_mw, delta_1h_mw, delta_24h_mw, cluster_id, cluster_label, refreshed_at)
+    SELECT
+        l.zone, l.datetime, l.carbon_intensity, {', '.join(f'l.{c}' for c in SOURCE_COLUMNS)},
+        t.total_mw,
+        t.total_mw - (SELECT {_total('m')} FROM electricity_measurements m
+                      WHERE m.datetime = l.datetime - INTERVAL '1 hour' AND m.zone = l.zone),
+        t.total_mw - (SELECT {_total('m')} FROM electricity_measurements m
+                      WHERE m.datetime = l.datetime - INTERVAL '24 hours' AND m.zone = l.zone),
+        NULLIF(l.cluster_id, -1),
+        %(cluster_labels)s::jsonb ->> NULLIF(l.cluster_id, -1)::text,
+        NOW()
+    FROM (
+        SELECT * FROM electricity_measurements
+        WHERE zone = %(zone)s
+        ORDER BY datetime DESC
+        LIMIT 1
+    ) AS l
+    CROSS JOIN LATERAL (SELECT {_total('l')} AS total_mw) AS t
+    ON CONFLICT (zone) DO UPDATE SET
+        measured_at = EXCLUDED.measured_at,
+        carbon_intensity = EXCLUDED.carbon_intensity,
+        {', '.join(f'{c} = EXCLUDED.{c}' for c in SOURCE_COLUMNS)},
+        total_mw = EXCLUDED.total_mw,
+        delta_1h_mw = EXCLUDED.delta_1h_mw,
+        delta_24h_mw = EXCLUDED.delta_24h_mw,
+        cluster_id = EXCLUDED.cluster_id,
+        cluster_label = CASE
+            WHEN EXCLUDED.cluster_label IS NOT NULL THEN EXCLUDED.cluster_label
+            WHEN snap.cluster_id IS NOT DISTINCT FROM EXCLUDED.cluster_id THEN snap.cluster_label
+        END,
+        refreshed_at = EXCLUDED.refreshed_at;
+"""
+
+# Zone cần làm mới khi không biết trước (clustering): các zone đã có snapshot + zone mới nhất
+ZONES_SQL = """
+    SELECT zone FROM grid_status_snapshot
+    UNION
+    SELECT zone FROM (SELECT zone FROM electricity_measurements ORDER BY datetime DESC LIMIT 1) AS latest
+"""
+
+
+def refresh(cur, zone, cluster_labels=None):
+    """
+    Làm mới snapshot của `zone` trên cursor của transaction đang ghi (caller commit).
+    Chạy trong SAVEPOINT: lỗi ở đây (vd bảng measurements chưa có cột cluster_id) chỉ bỏ
+    lần làm mới snapshot, không làm mất dòng measurement / cluster_id của caller.
+    Trả về True nếu snapshot đã được làm mới.
+    """
+    labels = json.dumps({str(k): v for k, v in cluster_labels.items()}) if cluster_labels else None
+    cur.execute("SAVEPOINT grid_status_refresh")
+    try:
+        cur.execute(REFRESH_SQL, {"zone": zone, "cluster_labels": labels})
+    except Exception as e:
+        cur.execute("ROLLBACK TO SAVEPOINT grid_status_refresh")
+        telemetry.incr("errors", stage="grid_status_refresh")
+        print(f"[WARN] Grid status snapshot not refreshed for {zone}: {e}")
+        return False
+    cur.execute("RELEASE SAVEPOINT grid_status_refresh")
+    return True
+
+
+def refresh_all(cur, cluster_labels=None):
+    """Làm mới snapshot của mọi zone (dùng sau khi ghi cluster_id cho cả bảng)."""
+    cur.execute(ZONES_SQL)
+    zones = [row[0] for row in cur.fetchall() if row[0]]
+    for zone in zones:
+        refresh(cur, zone, cluster_labels)
+    return zones
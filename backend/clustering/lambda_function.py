@@ -1,19 +1,23 @@
 import json
+import querylog
+import telemetry
 from app import run_clustering_job
 
 def lambda_handler(event, context):
     print("🚀 Lambda Clustering Triggered")
+    telemetry.reset()
     
     # Chạy hàm logic
-    success = run_clustering_job()
+    with querylog.tag("clustering_job"):
+        success = run_clustering_job()
     
     if success:
         return {
             'statusCode': 200,
-            'body': json.dumps({'message': 'Clustering tasks completed successfully'})
+            'body': json.dumps({'message': 'Clustering tasks completed successfully', 'metrics': telemetry.snapshot()})
         }
     else:
         return {
             'statusCode': 200,
-            'body': json.dumps({'message': 'Clustering finished with no updates (check logs)'})
+            'body': json.dumps({'message': 'Clustering finished with no updates (check logs)', 'metrics': telemetry.snapshot()})
         }
\ No newline at end of file
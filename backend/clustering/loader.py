@@ -0,0 +1,175 @@
+"""
+Loader tiết kiệm bộ nhớ cho các job batch (dùng chung cho analysis và clustering).
+
+Thay cho pd.read_sql (float64 + datetime dạng object + nhiều bản copy):
+- Đọc bằng server-side cursor (named cursor của psycopg2), mỗi lần FETCH_SIZE dòng,
+  ghi thẳng vào mảng NumPy float32 đã cấp phát trước (COUNT(*) trước để biết kích thước).
+- Timestamp là datetime64[us], không phải object.
+- Resample theo giờ + nội suy tuyến tính bằng NumPy (bincount/np.interp), không qua DataFrame.
+- Ghi kết quả bằng execute_values theo từng đoạn, không dựng toàn bộ list tuple một lúc.
+- report_peak_rss() đặt gauge peak_rss_mb để chọn memory size Lambda cho sát.
+
+Nhận connection DB-API (psycopg2); với SQLAlchemy dùng engine.raw_connection().
+ANALYTICS_BACKEND=duckdb: bảng có mirror Parquet được đọc qua DuckDB (xem storage.py).
+"""
+import os
+import resource
+from collections import namedtuple
+
+import numpy as np
+from psycopg2.extras import execute_values
+
+import storage
+import telemetry
+
+FETCH_SIZE = int(os.getenv("LOADER_FETCH_SIZE", 10000))
+WRITE_PAGE_SIZE = int(os.getenv("LOADER_WRITE_PAGE_SIZE", 5000))
+
+HOUR = np.timedelta64(1, "h")
+
+# Bỏ các giờ bị ingestion gắn cờ bất thường (bảng measurement_anomalies, xem ingestion/anomaly.py)
+EXCLUDE_ANOMALIES = os.getenv("EXCLUDE_ANOMALIES", "true").lower() == "true"
+
+# keys: mảng key (datetime64[us] hoặc int64); values: ma trận (n, k) float32; columns: tên k cột
+Frame = namedtuple("Frame", ["keys", "values", "columns"])
+
+
+def load_frame(conn, table, columns, key_column="datetime", where="", params=None,
+               key_dtype="datetime64[us]", dtype=np.float32, fetch_size=None):
+    """
+    Đọc `key_column` + `columns` của `table` (sắp theo key) vào Frame.
+    NULL -> NaN. `where` là mệnh đề SQL (có thể chứa %s, giá trị đưa qua `params`).
+    """
+    if storage.use_duckdb(table):
+        with telemetry.span("read_sql", table=table, backend="duckdb"):
+            keys, values = storage.load_arrays(conn, table, columns, key_column, where, params, key_dtype, dtype)
+        telemetry.incr("rows_in", len(keys), table=table)
+        return Frame(keys, values, list(columns))
+
+    fetch_size = fetch_size or FETCH_SIZE
+    where_sql = f"WHERE {where}" if where else ""
+    select_cols = ", ".join([key_column] + list(columns))
+
+    with telemetry.span("read_sql", table=table):
+        with conn.cursor() as cur:
+            cur.execute(f"SELECT COUNT(*) FROM {table} {where_sql}", params)
+            capacity = cur.fetchone()[0]
+
+        keys = np.empty(capacity, dtype=key_dtype)
+        values = np.empty((capacity, len(columns)), dtype=dtype)
+        n = 0
+        # Named cursor -> server-side, client chỉ giữ tối đa fetch_size dòng mỗi lần
+        with conn.cursor(name=f"loader_{table}") as cur:
+            cur.itersize = fetch_size
+            cur.execute(f"SELECT {select_cols} FROM {table} {where_sql} ORDER BY {key_column}", params)
+            while True:
+                rows = cur.fetchmany(fetch_size)
+                if not rows:
+                    break
+                end = n + len(rows)
+                if end > capacity:
+                    # Có dòng mới được insert giữa COUNT và SELECT
+                    capacity = max(end, capacity * 2)
+                    keys = np.resize(keys, capacity)
+                    values = np.resize(values, (capacity, len(columns)))
+                keys[n:end] = [r[0] for r in rows]
+                # float(None) không hợp lệ nhưng np.array(..., dtype=float) đổi None -> NaN
+                values[n:end] = np.array([r[1:] for r in rows], dtype=np.float64)
+                n = end
+        conn.commit()
+
+    telemetry.incr("rows_in", n, table=table)
+    return Frame(keys[:n], values[:n], list(columns))
+
+
+def anomaly_filter(conn, table="electricity_measurements"):
+    """
+    Mệnh đề WHERE (dùng cho load_frame) loại các dòng của `table` có cờ trong
+    measurement_anomalies. Rỗng khi tắt EXCLUDE_ANOMALIES hoặc bảng cờ chưa tồn tại.
+    """
+    if not EXCLUDE_ANOMALIES or conn is None:
+        return ""
+    with conn.cursor() as cur:
+        cur.execute("SELECT to_regclass('measurement_anomalies') IS NOT NULL")
+        exists = cur.fetchone()[0]
+    if not exists:
+        return ""
+    return (f"NOT EXISTS (SELECT 1 FROM measurement_anomalies a "
+            f"WHERE a.datetime = {table}.datetime AND a.zone = {table}.zone)")
+
+
+def resample_hourly(keys, values):
+    """
+    Trung bình theo giờ (giống DataFrame.resample('h').mean(), bỏ qua NaN).
+    Trả về (hourly_keys, hourly_values float32, missing_mask) với missing_mask = giờ
+    không có giá trị nào ở mọi cột (cần nội suy).
+    """
+    if len(keys) == 0:
+        return keys.astype("datetime64[h]"), values, np.zeros(0, dtype=bool)
+    hours = keys.astype("datetime64[h]")
+    start = hours[0]
+    slot = ((hours - start) // HOUR).astype(np.int64)
+    size = int(slot[-1]) + 1
+
+    out = np.empty((size, values.shape[1]), dtype=values.dtype)
+    for j in range(values.shape[1]):
+        column = values[:, j]
+        valid = ~np.isnan(column)
+        counts = np.bincount(slot[valid], minlength=size)
+        sums = np.bincount(slot[valid], weights=column[valid], minlength=size)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            out[:, j] = sums / counts
+    missing = np.isnan(out).all(axis=1)
+    return start + np.arange(size) * HOUR, out, missing
+
+
+def interpolate_linear(values):
+    """
+    Nội suy tuyến tính NaN theo từng cột, tại chỗ (giống interpolate('linear').fillna(0)):
+    NaN ở cuối lấy giá trị hợp lệ cuối cùng, NaN ở đầu -> 0, cột toàn NaN -> 0.
+    """
+    index = np.arange(values.shape[0])
+    for j in range(values.shape[1]):
+        column = values[:, j]
+        valid = ~np.isnan(column)
+        if valid.all():
+            continue
+        if not valid.any():
+            column[:] = 0
+            continue
+        column[~valid] = np.interp(index[~valid], index[valid], column[valid])
+        column[:np.argmax(valid)] = 0
+    return values
+
+
+def write_rows(conn, sql, keys, columns, page_size=None, template=None):
+    """
+    execute_values theo đoạn: mỗi đoạn chỉ đổi page_size dòng sang tuple Python.
+    `columns` là list mảng 1-D cùng độ dài với keys; NaN được ghi thành NULL.
+    """
+    page_size = page_size or WRITE_PAGE_SIZE
+    if keys.dtype.kind == "M":
+        keys = keys.astype("datetime64[us]")
+    written = 0
+    with conn.cursor() as cur:
+        for start in range(0, len(keys), page_size):
+            end = start + page_size
+            parts = [keys[start:end].tolist()]
+            for column in columns:
+                chunk = column[start:end]
+                if chunk.dtype.kind == "f" and np.isnan(chunk).any():
+                    parts.append([None if v != v else v for v in chunk.tolist()])
+                else:
+                    parts.append(chunk.tolist())
+            rows = list(zip(*parts))
+            execute_values(cur, sql, rows, template=template, page_size=page_size)
+            written += len(rows)
+    return written
+
+
+def report_peak_rss(job):
+    """Đặt gauge peak_rss_mb (ru_maxrss của process, Linux trả về KB)."""
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    telemetry.set_gauge("peak_rss_mb", round(peak_mb, 1), job=job)
+    print(f"[MEM] {job}: peak RSS {peak_mb:.1f} MB")
+    return peak_mb
@@ -0,0 +1,158 @@
+"""
+Chọn mô hình K-Means (số cụm k + tập feature) thay cho n_clusters=3 cố định.
+
+- Mỗi ứng viên (feature set, k) được fit trong process pool của joblib. Trên Lambda
+  (không có /dev/shm) joblib tự chạy tuần tự, local/EC2 thì chạy song song.
+- Chấm điểm bằng silhouette trên mẫu ngẫu nhiên (silhouette đầy đủ là O(n²)) hoặc
+  Davies–Bouldin (O(n·k), không cần lấy mẫu).
+- Nhãn được đánh lại theo centroid solar tăng dần: cụm 0 luôn là cụm ít solar nhất
+  (đêm), cụm k-1 là cụm nhiều solar nhất -> ID mang cùng ý nghĩa ở mọi lần chạy.
+
+Lưu ý: silhouette của các feature set khác nhau được tính trên các không gian khác
+nhau nên chỉ so sánh tương đối; mặc định chỉ có 1 feature set.
+"""
+import os
+
+import numpy as np
+
+import telemetry
+
+K_MIN = int(os.getenv("CLUSTER_K_MIN", 2))
+K_MAX = int(os.getenv("CLUSTER_K_MAX", 6))
+# "silhouette" (lấy mẫu) hoặc "davies_bouldin"
+SCORE = os.getenv("CLUSTER_SCORE", "silhouette")
+SILHOUETTE_SAMPLE = int(os.getenv("CLUSTER_SILHOUETTE_SAMPLE", 5000))
+N_JOBS = int(os.getenv("CLUSTER_N_JOBS", -1))
+RANDOM_STATE = 42
+
+# Các tập feature thử thêm, dạng "a,b,c;a,c" (rỗng -> chỉ dùng tập mặc định của caller)
+FEATURE_SETS_ENV = os.getenv("CLUSTER_FEATURE_SETS", "")
+
+# Tên cụm theo thứ hạng solar (0 = thấp nhất)
+_NAMED_LEVELS = {
+    2: ["Low Solar / Night", "High Solar / Peak"],
+    3: ["Low Solar / Night", "Moderate / Transition", "High Solar / Peak"],
+    4: ["Low Solar / Night", "Ramp", "High Solar", "Peak Solar"],
+}
+
+
+def cluster_label(rank, k):
+    """Tên hiển thị của cụm có thứ hạng `rank` (theo solar tăng dần) trong mô hình k cụm."""
+    if k in _NAMED_LEVELS:
+        return _NAMED_LEVELS[k][rank]
+    if rank == 0:
+        return "Low Solar / Night"
+    if rank == k - 1:
+        return "Peak Solar"
+    return f"Solar Level {rank + 1}/{k}"
+
+
+def feature_sets_from_env(default):
+    """Tập feature mặc định + các tập khai báo trong CLUSTER_FEATURE_SETS (bỏ trùng)."""
+    sets = [list(default)]
+    for chunk in FEATURE_SETS_ENV.split(";"):
+        features = [f.strip() for f in chunk.split(",") if f.strip()]
+        if features and features not in sets:
+            sets.append(features)
+    return sets
+
+
+def _score(X, labels, metric, sample_size):
+    from sklearn.metrics import davies_bouldin_score, silhouette_score
+
+    if metric == "davies_bouldin":
+        # Càng nhỏ càng tốt -> đổi dấu để mọi metric đều "càng lớn càng tốt"
+        return -davies_bouldin_score(X, labels)
+    sample = sample_size if sample_size and sample_size < len(X) else None
+    return silhouette_score(X, labels, sample_size=sample, random_state=RANDOM_STATE)
+
+
+def _fit_candidate(X, set_index, k, metric, sample_size):
+    """Chạy trong worker: fit 1 ứng viên, trả về (score, set_index, k, model)."""
+    from sklearn.cluster import KMeans
+
+    model = KMeans(n_clusters=k, random_state=RANDOM_STATE, n_init="auto")
+    labels = model.fit_predict(X)
+    if len(np.unique(labels)) < 2:
+        return None, set_index, k, model
+    return float(_score(X, labels, metric, sample_size)), set_index, k, model
+
+
+def relabel_by_centroid(labels, centers, order_column):
+    """
+    Đánh lại nhãn theo centroid[:, order_column] tăng dần.
+    Trả về (labels mới, centers đã sắp xếp).
+    """
+    order = np.argsort(centers[:, order_column], kind="stable")
+    rank_of = np.empty_like(order)
+    rank_of[order] = np.arange(len(order))
+    return rank_of[labels], centers[order]
+
+
+def select_model(data, feature_sets, order_feature, k_min=None, k_max=None,
+                 metric=None, sample_size=None, n_jobs=None):
+    """
+    Thử mọi (feature set, k) và chọn ứng viên điểm cao nhất (hoà -> k nhỏ hơn).
+    `data`: mapping tên cột -> mảng 1-D (dict các cột float32 của loader, hoặc DataFrame).
+
+    Trả về dict: labels (đã relabel), k, features, score, metric, centers (đơn vị gốc,
+    đã sắp theo solar), candidates (bảng điểm của mọi ứng viên).
+    """
+    from joblib import Parallel, delayed
+    from sklearn.preprocessing import StandardScaler
+
+    k_min = k_min or K_MIN
+    k_max = k_max or K_MAX
+    metric = metric or SCORE
+    sample_size = SILHOUETTE_SAMPLE if sample_size is None else sample_size
+    n_jobs = n_jobs or N_JOBS
+
+    matrices, scalers = [], []
+    with telemetry.span("scale"):
+        for features in feature_sets:
+            scaler = StandardScaler()
+            X = np.column_stack([np.nan_to_num(np.asarray(data[f], dtype=np.float64)) for f in features])
+            matrices.append(scaler.fit_transform(X))
+            scalers.append(scaler)
+
+    n = len(matrices[0])
+    ks = [k for k in range(max(k_min, 2), k_max + 1) if k < n]
+    if not ks:
+        raise ValueError(f"Not enough rows ({n}) to cluster with k in [{k_min}, {k_max}]")
+    tasks = [(i, k) for i in range(len(feature_sets)) for k in ks]
+
+    with telemetry.span("model_selection", candidates=len(tasks)):
+        results = Parallel(n_jobs=n_jobs, prefer="processes")(
+            delayed(_fit_candidate)(matrices[i], i, k, metric, sample_size) for i, k in tasks
+        )
+
+    candidates = [
+        {"features": feature_sets[i], "k": k, "score": score}
+        for score, i, k, _ in results
+    ]
+    scored = [r for r in results if r[0] is not None]
+    if scored:
+        best = max(scored, key=lambda r: (r[0], -r[2]))
+    else:
+        # Dữ liệu suy biến (mọi điểm trùng nhau) -> lấy ứng viên nhỏ nhất
+        best = results[0]
+    score, set_index, k, model = best
+
+    features = feature_sets[set_index]
+    centers = scalers[set_index].inverse_transform(model.cluster_centers_)
+    order_column = features.index(order_feature) if order_feature in features else 0
+    labels, centers = relabel_by_centroid(model.labels_, centers, order_column)
+
+    telemetry.set_gauge("cluster_k", k)
+    if score is not None:
+        telemetry.set_gauge("cluster_score", round(score, 4), metric=metric)
+    print(f"🔎 Model selection ({metric}): best k={k} features={features} score={score}")
+    return {
+        "labels": labels,
+        "k": k,
+        "features": features,
+        "score": score,
+        "metric": metric,
+        "centers": centers,
+        "candidates": candidates,
+    }
@@ -0,0 +1,133 @@
+"""
+Profile của từng cụm (bảng cluster_profiles) để API/frontend hiểu ý nghĩa cụm
+mà không phải tải mọi dòng đã gán nhãn:
+- centroid theo đơn vị gốc (MW, gCO2/kWh) trên các feature của mô hình đã chọn,
+- mean/std của từng nguồn, số dòng và tỉ lệ,
+- occupancy theo giờ trong ngày (24 giá trị: số dòng của cụm ở mỗi giờ UTC).
+
+Ghi lại toàn bộ profile của bảng nguồn mỗi lần chạy, trong cùng transaction với
+lệnh cập nhật cluster_id (profile luôn khớp với nhãn đang có trong DB). API lấy k và
+tên cụm từ bảng này (kể cả solar_predictions, chỉ có profile tối thiểu) thay vì tự suy ra.
+"""
+import json
+import warnings
+
+import numpy as np
+
+PROFILE_COLUMNS = [
+    "solar_mw", "wind_mw", "gas_mw", "unknown_mw", "hydro_mw",
+    "biomass_mw", "nuclear_mw", "geothermal_mw", "carbon_intensity",
+]
+
+DDL = """
+    CREATE TABLE IF NOT EXISTS cluster_profiles (
+        source_table VARCHAR(50) NOT NULL,
+        cluster_id INTEGER NOT NULL,
+        cluster_label VARCHAR(50),
+        k INTEGER NOT NULL,
+        features JSONB,
+        centroid JSONB,
+        mean JSONB,
+        std JSONB,
+        hour_counts INTEGER[],
+        count INTEGER NOT NULL,
+        share FLOAT,
+        score FLOAT,
+        metric VARCHAR(20),
+        updated_at TIMESTAMP DEFAULT NOW(),
+        PRIMARY KEY (source_table, cluster_id)
+    );
+"""
+
+
+def _clean(value):
+    """NaN (cụm không có giá trị hợp lệ ở cột đó) -> None để ghi JSON hợp lệ."""
+    value = float(value)
+    return None if np.isnan(value) else round(value, 4)
+
+
+def compute_profiles(frame, best, label_of):
+    """
+    frame: Frame của loader (keys datetime64, values (n, m), columns); best: kết quả
+    select_model (labels đã relabel, centers đã sắp). Trả về list dict, 1 phần tử / cụm.
+    """
+    labels = np.asarray(best["labels"], dtype=np.int64)
+    k = best["k"]
+    n = len(labels)
+    counts = np.bincount(labels, minlength=k)
+
+    # Occupancy theo giờ: bincount trên (cụm * 24 + giờ) trong một lượt
+    hours = (frame.keys.astype("datetime64[h]").astype(np.int64) % 24)
+    hour_counts = np.bincount(labels * 24 + hours, minlength=k * 24).reshape(k, 24)
+
+    columns = [c for c in PROFILE_COLUMNS if c in frame.columns]
+    index = [frame.columns.index(c) for c in columns]
+    values = frame.values[:, index].astype(np.float64)
+
+    profiles = []
+    with warnings.catch_warnings():
+        # Cột toàn NaN trong một cụm (vd nuclear = NULL) -> nanmean cảnh báo "Mean of empty slice"
+        warnings.simplefilter("ignore", RuntimeWarning)
+        for cid in range(k):
+            member = values[labels == cid]
+            mean = np.nanmean(member, axis=0) if len(member) else np.full(len(columns), np.nan)
+            std = np.nanstd(member, axis=0) if len(member) else np.full(len(columns), np.nan)
+            profiles.append({
+                "cluster_id": cid,
+                "cluster_label": label_of(cid, k),
+                "k": k,
+                "features": best["features"],
+                "centroid": {f: _clean(v) for f, v in zip(best["features"], best["centers"][cid])},
+                "mean": {c: _clean(v) for c, v in zip(columns, mean)},
+                "std": {c: _clean(v) for c, v in zip(columns, std)},
+                "hour_counts": hour_counts[cid].tolist(),
+                "count": int(counts[cid]),
+                "share": round(float(counts[cid]) / n, 4) if n else 0.0,
+                "score": best["score"],
+                "metric": best["metric"],
+            })
+    return profiles
+
+
+def label_profiles(best, label_of):
+    """
+    Profile tối thiểu (tên cụm, k, centroid, count) cho bảng không có cột nguồn / datetime
+    (solar_predictions): đủ để API gắn đúng tên cụm.
+    """
+    labels = np.asarray(best["labels"], dtype=np.int64)
+    k = best["k"]
+    n = len(labels)
+    counts = np.bincount(labels, minlength=k)
+    return [
+        {
+            "cluster_id": cid,
+            "cluster_label": label_of(cid, k),
+            "k": k,
+            "features": best["features"],
+            "centroid": {f: _clean(v) for f, v in zip(best["features"], best["centers"][cid])},
+            "mean": {},
+            "std": {},
+            "hour_counts": None,
+            "count": int(counts[cid]),
+            "share": round(float(counts[cid]) / n, 4) if n else 0.0,
+            "score": best["score"],
+            "metric": best["metric"],
+        }
+        for cid in range(k)
+    ]
+
+
+def write_profiles(cur, source_table, profiles):
+    """Thay toàn bộ profile của source_table (k có thể đổi giữa các lần chạy)."""
+    cur.execute("DELETE FROM cluster_profiles WHERE source_table = %s", (source_table,))
+    for p in profiles:
+        cur.execute("""
+            INSERT INTO cluster_profiles
+                (source_table, cluster_id, cluster_label, k, features, centroid, mean, std,
+                 hour_counts, count, share, score, metric, updated_at)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, NOW())
+        """, (
+            source_table, p["cluster_id"], p["cluster_label"], p["k"], json.dumps(p["features"]),
+            json.dumps(p["centroid"]), json.dumps(p["mean"]), json.dumps(p["std"]),
+            p["hour_counts"], p["count"], p["share"], p["score"], p["metric"],
+        ))
@@ -1,9 +1,12 @@
 import os
-import pandas as pd
 import numpy as np
+from psycopg2.extras import execute_values
 from sqlalchemy import create_engine, text
-from sklearn.preprocessing import MinMaxScaler
-from statsmodels.tsa.seasonal import seasonal_decompose
+import querylog
+import snapshots
+import telemetry
+from decomposition import seasonal_decompose_2d
+from loader import anomaly_filter, interpolate_linear, load_frame, report_peak_rss, resample_hourly, write_rows
 
 # --- CẤU HÌNH ENVIRONMENT ---
 DB_HOST = os.getenv("DB_HOST")
@@ -13,6 +16,80 @@ DB_PASS = os.getenv("DB_PASS")
 # Connection String cho SQLAlchemy
 DB_URL = f"postgresql://{DB_USER}:{DB_PASS}@{DB_HOST}:5432/{DB_NAME}"
 
+def min_max_normalize(values):
+    """
+    Min-max scaling theo từng cột về [0, 1] (tương đương sklearn MinMaxScaler).
+    Cột hằng số (max == min) trả về 0 thay vì chia cho 0.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    col_min = values.min(axis=0)
+    col_range = values.max(axis=0) - col_min
+    col_range[col_range == 0] = 1.0
+    return (values - col_min) / col_range
+
+# Mọi cột đo trong electricity_measurements được phân tích cùng lúc như một ma trận (n giờ x k cột).
+# Kết quả lưu dạng wide: <prefix>_trend/_seasonal/_residual/_normalized, prefix = tên cột bỏ "_mw"
+SOURCE_COLUMNS = [
+    'solar_mw', 'wind_mw', 'gas_mw', 'unknown_mw', 'hydro_mw',
+    'biomass_mw', 'nuclear_mw', 'geothermal_mw', 'carbon_intensity',
+]
+COMPONENTS = ['trend', 'seasonal', 'residual', 'normalized']
+
+def source_prefix(column):
+    return column[:-3] if column.endswith('_mw') else column
+
+RESULT_COLUMNS = SOURCE_COLUMNS + [f"{source_prefix(c)}_{comp}" for c in SOURCE_COLUMNS for comp in COMPONENTS]
+
+# Seasonal (trung bình theo pha trên cả lịch sử) và normalized (min/max toàn chuỗi) trôi
+# một chút mỗi lần chạy -> chỉ ghi lại giờ có cột dẫn xuất lệch quá ngưỡng này (tỉ lệ theo
+# biên độ max - min của chuỗi nguồn) so với bản đã lưu. Cột nguồn luôn so chính xác.
+ANALYSIS_CHANGE_TOLERANCE = float(os.getenv("ANALYSIS_CHANGE_TOLERANCE", 1e-3))
+
+# Chỉ upsert các giờ mới / đổi (xem changed_rows); giờ không ghi lại giữ nguyên updated_at,
+# nên API chỉ trả về các giờ thực sự thay đổi kể từ `since`
+RESULTS_UPSERT_SQL = f"""
+    INSERT INTO electricity_analysis_results (datetime, {', '.join(RESULT_COLUMNS)}) VALUES %s
+    ON CONFLICT (datetime) DO UPDATE SET
+        {', '.join(f'{c} = EXCLUDED.{c}' for c in RESULT_COLUMNS)},
+        updated_at = NOW()
+    WHERE ({', '.join(f'electricity_analysis_results.{c}' for c in RESULT_COLUMNS)})
+          IS DISTINCT FROM ({', '.join(f'EXCLUDED.{c}' for c in RESULT_COLUMNS)})
+"""
+
+def change_limits(hourly, tolerance=None):
+    """
+    Ngưỡng lệch tuyệt đối cho từng cột của RESULT_COLUMNS: 0 cho cột nguồn (so chính xác),
+    tolerance * biên độ (max - min) của chuỗi nguồn cho trend/seasonal/residual (cùng đơn vị),
+    tolerance cho normalized (thang [0, 1]).
+    """
+    tolerance = ANALYSIS_CHANGE_TOLERANCE if tolerance is None else tolerance
+    span = np.ptp(hourly, axis=0).astype(np.float64)
+    span[~(span > 0)] = 1.0
+    derived = {'trend': span, 'seasonal': span, 'residual': span, 'normalized': np.ones_like(span)}
+    return np.concatenate([np.zeros(len(span))] + [
+        [tolerance * derived[comp][j] for comp in COMPONENTS] for j in range(len(span))
+    ])
+
+def changed_rows(hours, columns, stored, limits):
+    """
+    Mask các giờ của `hours` cần ghi: giờ chưa có trong `stored` (Frame kết quả đã lưu, cùng
+    thứ tự cột với `columns`) hoặc có cột lệch quá `limits` (xem change_limits). NaN == NaN.
+    """
+    keys = np.asarray(hours).astype(stored.keys.dtype)
+    pos = np.searchsorted(stored.keys, keys)
+    found = pos < len(stored.keys)
+    found[found] = stored.keys[pos[found]] == keys[found]
+
+    # Bản lưu đọc lại là float32 -> so cột nguồn (cũng là float32) vẫn khớp chính xác
+    new = np.column_stack(columns).astype(np.float64)[found]
+    old = stored.values[pos[found]].astype(np.float64)
+    with np.errstate(invalid="ignore"):
+        differs = (np.abs(new - old) > limits) | (np.isnan(old) != np.isnan(new))
+
+    changed = ~found
+    changed[found] = differs.any(axis=1)
+    return changed
+
 def init_analysis_db(engine):
     """Khởi tạo bảng nếu chưa tồn tại"""
     sql_analysis = """
@@ -31,96 +108,146 @@ def init_analysis_db(engine):
         updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
     );
     """
+    # Bảng cũ chỉ có cột solar/wind -> bổ sung cột cho các nguồn còn lại
+    sql_columns = "".join(
+        f"ALTER TABLE electricity_analysis_results ADD COLUMN IF NOT EXISTS {col} FLOAT;"
+        for col in RESULT_COLUMNS
+    ) + """
+        ALTER TABLE electricity_analysis_results ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT NOW();
+        CREATE INDEX IF NOT EXISTS idx_electricity_analysis_results_updated_at
+            ON electricity_analysis_results (updated_at);
+    """
     try:
         with engine.connect() as conn:
             conn.execute(text(sql_analysis))
+            conn.execute(text(sql_columns))
             conn.execute(text(sql_correlation))
             conn.commit()
         print("--> [INIT] DB Tables Checked.")
     except Exception as e:
         print(f"--> [INIT ERROR] {e}")
 
-def analyze_correlation(df, engine):
-    """Tính toán ma trận tương quan và lưu vào DB"""
+def analyze_correlation(conn, names, matrix):
+    """Tính toán ma trận tương quan (các cột của `matrix`) và lưu vào DB"""
     print("🔍 Running Correlation Analysis...")
-    cols = ['solar_mw', 'wind_mw', 'gas_mw', 'solar_trend', 'solar_seasonal', 'solar_residual']
-    existing_cols = [c for c in cols if c in df.columns]
-    
-    if not existing_cols:
+    if not names:
         return
 
-    # Tính toán
-    corr_matrix = df[existing_cols].corr()
+    # Tính toán (cột hằng số -> NaN, giống pandas .corr())
+    with telemetry.span("correlation"):
+        with np.errstate(invalid="ignore", divide="ignore"):
+            corr_matrix = np.atleast_2d(np.corrcoef(matrix, rowvar=False))
     
     # Chuyển đổi sang dạng Long Format (x, y, value)
-    corr_long = corr_matrix.stack().reset_index()
-    corr_long.columns = ['feature_x', 'feature_y', 'correlation_value']
+    corr_long = [
+        (x, y, None if np.isnan(corr_matrix[i, j]) else float(corr_matrix[i, j]))
+        for i, x in enumerate(names) for j, y in enumerate(names)
+    ]
 
     try:
-        with engine.connect() as conn:
-            conn.execute(text("TRUNCATE TABLE electricity_correlations"))
+        with telemetry.span("to_sql", table="electricity_correlations"):
+            with conn.cursor() as cur:
+                cur.execute("TRUNCATE TABLE electricity_correlations")
+                execute_values(cur, """
+                    INSERT INTO electricity_correlations (feature_x, feature_y, correlation_value) VALUES %s
+                """, corr_long)
             conn.commit()
-        
-        corr_long.to_sql('electricity_correlations', engine, if_exists='append', index=False, method='multi')
+        telemetry.incr("rows_out", len(corr_long), table="electricity_correlations")
         print(f"--> Saved {len(corr_long)} correlation records.")
     except Exception as e:
+        conn.rollback()
         print(f"❌ Error saving correlations: {e}")
 
 def run_analysis_job():
     """Hàm chính: Thực hiện Analysis Pipeline"""
     print("--- Starting Analysis Job ---")
+    conn = None
     try:
-        engine = create_engine(DB_URL)
+        engine = create_engine(DB_URL, connect_args={"connection_factory": querylog.LoggedConnection})
         init_analysis_db(engine)
+        conn = engine.raw_connection()
         
-        # 1. LOAD DATA
-        query = "SELECT datetime, solar_mw, wind_mw, gas_mw FROM electricity_measurements ORDER BY datetime ASC"
-        df = pd.read_sql(query, engine)
+        # 1. LOAD DATA (server-side cursor -> float32, timestamp datetime64)
+        # Giờ bị gắn cờ bất thường bị bỏ -> thành lỗ và được nội suy như giờ thiếu
+        frame = load_frame(conn, "electricity_measurements", SOURCE_COLUMNS, where=anomaly_filter(conn))
         
-        if df.empty or len(df) < 24:
+        if len(frame.keys) < 24:
             print("⚠️ Not enough data for analysis (< 24 records).")
             return
 
         # 2. PREPROCESSING
-        df['datetime'] = pd.to_datetime(df['datetime'])
-        df.set_index('datetime', inplace=True)
-        
         # Resample theo giờ và điền dữ liệu thiếu
-        df_clean = df.resample('h').mean().interpolate(method='linear').fillna(0)
+        with telemetry.span("resample"):
+            hours, hourly, missing = resample_hourly(frame.keys, frame.values)
+            del frame
+            # Giờ không có dữ liệu (lỗ) sẽ bị interpolate -> ghi lại để biết chuỗi "thật" đến đâu
+            interpolated = int(missing.sum())
+            interpolate_linear(hourly)
+        n, k = hourly.shape
+        telemetry.incr("rows_interpolated", interpolated)
+        telemetry.set_gauge("interpolated_pct", round(100.0 * interpolated / n, 2))
+        if interpolated:
+            print(f"⚠️ {interpolated}/{n} hourly rows were interpolated (missing in source).")
 
-        # 3. DECOMPOSITION (Seasonal)
+        # 3. DECOMPOSITION (Seasonal) cho cả k cột trong một lượt
         # Khởi tạo giá trị mặc định
-        df_clean['solar_trend'] = 0.0
-        df_clean['solar_seasonal'] = 0.0
-        df_clean['solar_residual'] = 0.0
+        trend = np.zeros((n, k))
+        seasonal = np.zeros((n, k))
+        residual = np.zeros((n, k))
 
         # Chỉ chạy decompose nếu đủ dữ liệu (2 chu kỳ = 48h)
-        if len(df_clean) >= 48:
+        if n >= 48:
             try:
-                decomposition = seasonal_decompose(df_clean['solar_mw'], model='additive', period=24)
-                df_clean['solar_trend'] = decomposition.trend.fillna(0)
-                df_clean['solar_seasonal'] = decomposition.seasonal.fillna(0)
-                df_clean['solar_residual'] = decomposition.resid.fillna(0)
+                with telemetry.span("seasonal_decompose", series=k):
+                    trend, seasonal, residual = (np.nan_to_num(part) for part in seasonal_decompose_2d(hourly, period=24))
             except Exception as e:
                 print(f"⚠️ Decompose failed: {e}")
+
+        solar = SOURCE_COLUMNS.index('solar_mw')
         
-        # Tính tương quan
-        analyze_correlation(df_clean, engine)
+        # Tính tương quan (các nguồn + thành phần của solar)
+        analyze_correlation(
+            conn,
+            SOURCE_COLUMNS + ['solar_trend', 'solar_seasonal', 'solar_residual'],
+            np.column_stack([hourly, trend[:, solar], seasonal[:, solar], residual[:, solar]]),
+        )
 
         # 4. NORMALIZATION (Cho AI Model sau này)
-        scaler = MinMaxScaler()
-        df_clean[['solar_normalized', 'wind_normalized']] = scaler.fit_transform(df_clean[['solar_mw', 'wind_mw']])
+        with telemetry.span("normalize", series=k):
+            normalized = min_max_normalize(hourly)
 
         # 5. STORE RESULTS
-        df_final = df_clean.reset_index().fillna(0)
+        parts = {'trend': trend, 'seasonal': seasonal, 'residual': residual, 'normalized': normalized}
+        columns = [hourly[:, j] for j in range(k)]
+        columns += [parts[comp][:, j] for j in range(k) for comp in COMPONENTS]
         
-        with engine.connect() as conn:
-            conn.execute(text("TRUNCATE TABLE electricity_analysis_results"))
+        with telemetry.span("diff_results"):
+            stored = load_frame(conn, "electricity_analysis_results", RESULT_COLUMNS)
+            changed = changed_rows(hours, columns, stored, change_limits(hourly))
+            del stored
+        print(f"--> {int(changed.sum())}/{n} hourly results changed.")
+
+        with telemetry.span("to_sql", table="electricity_analysis_results"):
+            written = write_rows(conn, RESULTS_UPSERT_SQL, hours[changed], [c[changed] for c in columns])
+            with conn.cursor() as cur:
+                # Giờ không còn trong chuỗi mới (measurements bị xoá) -> bỏ khỏi kết quả
+                cur.execute(
+                    "DELETE FROM electricity_analysis_results WHERE datetime < %s OR datetime > %s",
+                    (hours[0].item(), hours[-1].item())
+                )
             conn.commit()
-            
-        df_final.to_sql('electricity_analysis_results', engine, if_exists='append', index=False, method='multi')
+        telemetry.incr("rows_out", written, table="electricity_analysis_results")
+
+        # 6. SNAPSHOT cho API (mmap, không phải query DB cho các view dashboard)
+        snapshots.publish_table(conn, "analysis", "electricity_analysis_results", RESULT_COLUMNS)
+        snapshots.publish_measurements(conn)
         print("--> Analysis pipeline completed successfully.")
 
     except Exception as e:
         print(f"❌ Critical Error in Analysis Job: {e}")
-        raise e 
\ No newline at end of file
+        raise e
+    finally:
+        if conn is not None:
+            querylog.flush(conn)
+            conn.close()
+        report_peak_rss("analysis")
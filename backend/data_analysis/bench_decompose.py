@@ -0,0 +1,81 @@
+"""
+Benchmark + kiểm tra parity: decomposition.seasonal_decompose_2d vs statsmodels.
+
+Chạy local (không cần DB, không đóng gói vào image Lambda):
+    python bench_decompose.py --days 365 --series 9
+
+statsmodels là optional: nếu không cài thì chỉ đo phần NumPy.
+"""
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+
+from decomposition import seasonal_decompose_2d
+
+
+def make_series(hours, series, seed=42):
+    """Sinh dữ liệu giống công suất theo giờ: chu kỳ ngày + trend chậm + nhiễu."""
+    rng = np.random.default_rng(seed)
+    t = np.arange(hours)[:, None]
+    daily = np.maximum(np.sin((t % 24 - 6) / 12 * np.pi), 0) * rng.uniform(100, 800, series)
+    trend = t / hours * rng.uniform(-50, 50, series)
+    noise = rng.normal(0, 15, (hours, series))
+    return np.abs(daily + trend + noise + rng.uniform(0, 300, series))
+
+
+def measure(fn, repeat):
+    tracemalloc.start()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    elapsed = (time.perf_counter() - start) / repeat
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--series", type=int, default=9, help="Số cột (nguồn phát) phân rã cùng lúc")
+    parser.add_argument("--period", type=int, default=24)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--atol", type=float, default=1e-8)
+    args = parser.parse_args()
+
+    data = make_series(args.days * 24, args.series)
+    print(f"Input: {data.shape[0]} hours x {data.shape[1]} series, period={args.period}")
+
+    (trend, seasonal, resid), np_time, np_peak = measure(
+        lambda: seasonal_decompose_2d(data, period=args.period), args.repeat)
+    print(f"numpy 2-D     : {np_time * 1000:8.2f} ms   peak {np_peak / 1024 / 1024:7.2f} MiB")
+
+    try:
+        from statsmodels.tsa.seasonal import seasonal_decompose
+    except ImportError:
+        print("statsmodels not installed -> skipping parity check.")
+        return 0
+
+    def run_statsmodels():
+        return [seasonal_decompose(data[:, j], model="additive", period=args.period) for j in range(data.shape[1])]
+
+    results, sm_time, sm_peak = measure(run_statsmodels, args.repeat)
+    print(f"statsmodels   : {sm_time * 1000:8.2f} ms   peak {sm_peak / 1024 / 1024:7.2f} MiB")
+    print(f"speedup       : {sm_time / np_time:8.1f}x")
+
+    ok = True
+    for name, ours in (("trend", trend), ("seasonal", seasonal), ("resid", resid)):
+        ref = np.column_stack([np.asarray(getattr(r, name)) for r in results])
+        same_nan = np.array_equal(np.isnan(ours), np.isnan(ref))
+        max_diff = np.nanmax(np.abs(ours - ref))
+        ok &= same_nan and max_diff <= args.atol
+        print(f"parity {name:9s}: max |diff| = {max_diff:.3e}  NaN mask equal = {same_nan}")
+
+    print("PARITY OK" if ok else "PARITY FAILED")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,73 @@
+"""
+Seasonal decomposition (additive) viết bằng NumPy, thay cho statsmodels.
+
+Kết quả khớp với `statsmodels.tsa.seasonal.seasonal_decompose(x, model='additive',
+period=p)` (filt mặc định, two_sided=True, extrapolate_trend=0):
+- trend: trung bình trượt trung tâm (2xP-MA nếu P chẵn, P-MA nếu P lẻ),
+  NaN ở P//2 điểm đầu/cuối.
+- seasonal: trung bình theo pha (vị trí i % P) của chuỗi đã khử trend, trừ đi
+  trung bình chung để tổng một chu kỳ bằng 0. Với dữ liệu đã resample theo giờ,
+  liên tục, pha chính là giờ trong ngày (lệch theo giờ của điểm đầu tiên).
+- residual = x - trend - seasonal.
+
+Input là ma trận (n, k): phân rã k chuỗi cùng lúc trong một lượt vectorized.
+"""
+import numpy as np
+
+
+def _centered_moving_average(values, period):
+    """Trung bình trượt trung tâm theo trục 0 bằng cumulative sum, O(n*k)."""
+    n = values.shape[0]
+    half = period // 2
+    trend = np.full(values.shape, np.nan, dtype=np.float64)
+    if n <= 2 * half:
+        return trend
+
+    csum = np.zeros((n + 1,) + values.shape[1:], dtype=np.float64)
+    np.cumsum(values, axis=0, out=csum[1:])
+
+    if period % 2 == 0:
+        # Cửa sổ P+1 điểm, trọng số 0.5 ở hai đầu: [0.5, 1, ..., 1, 0.5] / P
+        window = csum[2 * half + 1:] - csum[:n - 2 * half]
+        window -= 0.5 * (values[:n - 2 * half] + values[2 * half:])
+    else:
+        window = csum[2 * half + 1:] - csum[:n - 2 * half]
+
+    trend[half:n - half] = window / period
+    return trend
+
+
+def seasonal_decompose_2d(values, period=24):
+    """
+    Phân rã additive cho nhiều chuỗi cùng lúc.
+
+    values: array-like shape (n,) hoặc (n, k), không chứa NaN.
+    Trả về (trend, seasonal, residual) cùng shape với input (float64).
+    """
+    x = np.asarray(values, dtype=np.float64)
+    squeeze = x.ndim == 1
+    if squeeze:
+        x = x[:, None]
+
+    n = x.shape[0]
+    if n < 2 * period:
+        raise ValueError(f"Need at least 2 full periods ({2 * period} observations), got {n}")
+    if np.isnan(x).any():
+        raise ValueError("Input contains NaN, interpolate before decomposing")
+
+    trend = _centered_moving_average(x, period)
+    detrended = x - trend
+
+    # Gom theo pha: pad NaN cho đủ bội số của period rồi reshape (cycles, period, k)
+    cycles = -(-n // period)
+    padded = np.full((cycles * period, x.shape[1]), np.nan, dtype=np.float64)
+    padded[:n] = detrended
+    period_means = np.nanmean(padded.reshape(cycles, period, -1), axis=0)
+    period_means -= period_means.mean(axis=0)
+
+    seasonal = np.tile(period_means, (cycles, 1))[:n]
+    residual = detrended - seasonal
+
+    if squeeze:
+        return trend[:, 0], seasonal[:, 0], residual[:, 0]
+    return trend, seasonal, residual
@@ -1,5 +1,7 @@
 import logging
 import json
+import querylog
+import telemetry
 from app import run_analysis_job
 
 logger = logging.getLogger()
@@ -7,17 +9,19 @@ logger.setLevel(logging.INFO)
 
 def lambda_handler(event, context):
     logger.info("🚀 Lambda Analysis Triggered!")
+    telemetry.reset()
     try:
         # Gọi hàm xử lý chính
-        run_analysis_job()
+        with querylog.tag("analysis_job"):
+            run_analysis_job()
         
         return {
             'statusCode': 200,
-            'body': json.dumps({'message': 'Analysis Job Completed Successfully'})
+            'body': json.dumps({'message': 'Analysis Job Completed Successfully', 'metrics': telemetry.snapshot()})
         }
     except Exception as e:
         logger.error(f"Error: {str(e)}")
         return {
             'statusCode': 500,
-            'body': json.dumps({'error': str(e)})
+            'body': json.dumps({'error': str(e), 'metrics': telemetry.snapshot()})
         }
\ No newline at end of file
@@ -0,0 +1,215 @@
+"""
+Snapshot bất biến của dữ liệu dashboard, đọc bằng mmap ở API (ec2/api/snapshots.py).
+
+Sau khi ghi DB xong, job publish SNAPSHOT_DAYS ngày gần nhất của một bảng thành một
+version mới:
+    <SNAPSHOT_URI>/<dataset>/<version>/manifest.json
+    <SNAPSHOT_URI>/<dataset>/<version>/<cột>.npy       (mỗi cột một file .npy)
+    <SNAPSHOT_URI>/<dataset>/LATEST                     (tên version mới nhất)
+- Version không bao giờ bị sửa: ghi thư mục mới rồi mới đổi LATEST (os.replace, atomic
+  trên cùng filesystem; với S3 LATEST được ghi sau cùng). Chỉ giữ SNAPSHOT_KEEP version.
+- Cột số -> float64 (NULL = NaN), cột nguyên -> int32 (NULL = -1), text -> mã uint8 +
+  danh sách giá trị trong manifest, datetime/updated_at -> datetime64[us] (NULL = NaT).
+- Đọc từ DB sau commit (không từ mảng trong RAM của job) để snapshot khớp đúng những gì
+  API sẽ đọc từ bảng, kể cả updated_at cho watermark. manifest["safe_until"] là mốc
+  LOCALTIMESTAMP - WATERMARK_SAFETY_SECONDS lúc đọc: API không trả watermark vượt mốc này
+  (transaction ghi còn đang chạy có thể commit dòng mang updated_at cũ hơn).
+- Snapshot measurements kèm manifest["cluster_labels"] ({cluster_id: tên}) đọc từ bảng
+  cluster_profiles mà clustering ghi cùng transaction với cluster_id.
+
+SNAPSHOT_URI là thư mục local (vd EFS mount chung với API) hoặc s3://bucket/prefix;
+rỗng -> tắt. Lỗi publish chỉ được log, không làm job thất bại (API tự đọc DB).
+"""
+import json
+import os
+import shutil
+import tempfile
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+import telemetry
+
+SNAPSHOT_URI = os.getenv("SNAPSHOT_URI", "")
+SNAPSHOT_DAYS = int(os.getenv("SNAPSHOT_DAYS", 31))
+SNAPSHOT_KEEP = int(os.getenv("SNAPSHOT_KEEP", 3))
+# Phải lớn hơn transaction ghi dài nhất (updated_at = NOW() là lúc transaction bắt đầu)
+WATERMARK_SAFETY_SECONDS = int(os.getenv("WATERMARK_SAFETY_SECONDS", 900))
+
+# Các cột mà /measurements, /clustering, trend, seasonal và correlations của API đọc
+MEASUREMENTS = {
+    "table": "electricity_measurements",
+    "float": ["solar_mw", "wind_mw", "gas_mw", "hydro_mw", "unknown_mw"],
+    "int": ["cluster_id"],
+    "text": ["zone"],
+}
+
+
+def _s3_client():
+    import boto3
+    return boto3.client("s3", endpoint_url=os.getenv("AWS_ENDPOINT_URL") or None)
+
+
+def _split_s3(uri):
+    bucket, _, prefix = uri[len("s3://"):].partition("/")
+    return bucket, prefix.strip("/")
+
+
+def _existing_columns(cur, table):
+    cur.execute("SELECT column_name FROM information_schema.columns WHERE table_name = %s", (table,))
+    return {r[0] for r in cur.fetchall()}
+
+
+def read_table(conn, table, float_columns=(), int_columns=(), text_columns=(), days=None):
+    """
+    Đọc `days` ngày gần nhất của table. Trả về (dict cột -> mảng NumPy, giá trị của các cột
+    text, covers_from = mốc bắt đầu của khoảng đã đọc, safe_until = mốc watermark an toàn).
+    Cột chưa có trong bảng -> NULL.
+    """
+    days = days or SNAPSHOT_DAYS
+    with conn.cursor() as cur:
+        existing = _existing_columns(cur, table)
+        names = ["datetime", "updated_at"] + list(float_columns) + list(int_columns) + list(text_columns)
+        select = ", ".join(n if n in existing else f"NULL AS {n}" for n in names)
+        cur.execute(f"SELECT MAX(datetime) FROM {table}")
+        latest = cur.fetchone()[0]
+        covers_from = latest - timedelta(days=days) if latest is not None else None
+        cur.execute("SELECT LOCALTIMESTAMP - make_interval(secs => %s)", (WATERMARK_SAFETY_SECONDS,))
+        safe_until = cur.fetchone()[0]
+        cur.execute(f"SELECT {select} FROM {table} WHERE datetime >= %s ORDER BY datetime", (covers_from,))
+        rows = cur.fetchall()
+    conn.commit()
+
+    columns = list(zip(*rows)) if rows else [[] for _ in names]
+    arrays, text_values = {}, {}
+    for name, values in zip(names, columns):
+        if name in ("datetime", "updated_at"):
+            arrays[name] = np.array([np.datetime64("NaT") if v is None else v for v in values],
+                                    dtype="datetime64[us]")
+        elif name in int_columns:
+            arrays[name] = np.array([-1 if v is None else v for v in values], dtype=np.int32)
+        elif name in text_columns:
+            distinct = sorted({v for v in values if v is not None})
+            code = {v: i for i, v in enumerate(distinct)}
+            # NULL -> mã cuối (len(distinct)), API đổi lại thành None
+            arrays[name] = np.array([code.get(v, len(distinct)) for v in values], dtype=np.uint8)
+            text_values[name] = distinct
+        else:
+            arrays[name] = np.array(values, dtype=np.float64)  # None -> NaN
+    return arrays, text_values, covers_from, safe_until
+
+
+def read_cluster_labels(conn, table):
+    """{cluster_id (str): tên cụm} của table trong cluster_profiles; {} nếu chưa có."""
+    with conn.cursor() as cur:
+        cur.execute("SELECT to_regclass('cluster_profiles') IS NOT NULL")
+        if not cur.fetchone()[0]:
+            labels = {}
+        else:
+            cur.execute("SELECT cluster_id, cluster_label FROM cluster_profiles WHERE source_table = %s", (table,))
+            labels = {str(cid): label for cid, label in cur.fetchall()}
+    conn.commit()
+    return labels
+
+
+def _write_version(directory, arrays, manifest):
+    os.makedirs(directory, exist_ok=True)
+    for name, array in arrays.items():
+        np.save(os.path.join(directory, f"{name}.npy"), array, allow_pickle=False)
+    with open(os.path.join(directory, "manifest.json"), "w") as f:
+        json.dump(manifest, f)
+
+
+def _publish_local(dataset, version, arrays, manifest):
+    root = os.path.join(SNAPSHOT_URI, dataset)
+    os.makedirs(root, exist_ok=True)
+    staging = os.path.join(root, f".{version}.tmp")
+    _write_version(staging, arrays, manifest)
+    os.rename(staging, os.path.join(root, version))
+    latest_tmp = os.path.join(root, ".LATEST.tmp")
+    with open(latest_tmp, "w") as f:
+        f.write(version)
+    os.replace(latest_tmp, os.path.join(root, "LATEST"))
+
+    # Bỏ version cũ (API đang mmap file cũ vẫn đọc được: inode chỉ mất khi đóng map)
+    versions = sorted(d for d in os.listdir(root) if not d.startswith(".") and d != "LATEST")
+    for old in versions[:-SNAPSHOT_KEEP]:
+        shutil.rmtree(os.path.join(root, old), ignore_errors=True)
+
+
+def _publish_s3(dataset, version, arrays, manifest):
+    bucket, prefix = _split_s3(SNAPSHOT_URI)
+    root = f"{prefix}/{dataset}" if prefix else dataset
+    client = _s3_client()
+    with tempfile.TemporaryDirectory() as staging:
+        _write_version(staging, arrays, manifest)
+        for name in sorted(os.listdir(staging)):
+            client.upload_file(os.path.join(staging, name), bucket, f"{root}/{version}/{name}")
+    client.put_object(Bucket=bucket, Key=f"{root}/LATEST", Body=version.encode())
+
+    listing = client.list_objects_v2(Bucket=bucket, Prefix=f"{root}/", Delimiter="/")
+    versions = sorted(p["Prefix"][len(root) + 1:].rstrip("/") for p in listing.get("CommonPrefixes", []))
+    for old in versions[:-SNAPSHOT_KEEP]:
+        objects = client.list_objects_v2(Bucket=bucket, Prefix=f"{root}/{old}/").get("Contents", [])
+        if objects:
+            client.delete_objects(Bucket=bucket, Delete={"Objects": [{"Key": o["Key"]} for o in objects]})
+
+
+def publish(dataset, arrays, text_values=None, source_table=None, covers_from=None, safe_until=None,
+            extra=None):
+    """Ghi một version mới của dataset (extra: khoá thêm vào manifest); trả về tên version."""
+    created = datetime.now(timezone.utc)
+    version = created.strftime("%Y%m%dT%H%M%S%fZ")
+    updated = arrays.get("updated_at")
+    watermark = None
+    if updated is not None and len(updated) and not np.isnat(updated).all():
+        watermark = str(updated[~np.isnat(updated)].max())
+    manifest = {
+        "dataset": dataset,
+        "version": version,
+        "created_at": created.isoformat(),
+        "table": source_table,
+        "rows": int(len(arrays["datetime"])),
+        # API chỉ phục vụ range bắt đầu từ mốc này trở đi, còn lại đọc DB
+        "covers_from": covers_from.isoformat() if covers_from is not None else None,
+        "columns": {name: str(array.dtype) for name, array in arrays.items()},
+        "text_values": text_values or {},
+        "watermark": watermark,
+        "safe_until": safe_until.isoformat() if safe_until is not None else None,
+        **(extra or {}),
+    }
+    if SNAPSHOT_URI.startswith("s3://"):
+        _publish_s3(dataset, version, arrays, manifest)
+    else:
+        _publish_local(dataset, version, arrays, manifest)
+    return version
+
+
+def publish_table(conn, dataset, table, float_columns=(), int_columns=(), text_columns=(), cluster_labels=False):
+    """
+    read_table + publish (cluster_labels=True: kèm tên cụm của table); tắt khi không có
+    SNAPSHOT_URI, lỗi chỉ log (trả về None).
+    """
+    if not SNAPSHOT_URI:
+        return None
+    try:
+        with telemetry.span("snapshot_publish", dataset=dataset):
+            extra = {"cluster_labels": read_cluster_labels(conn, table)} if cluster_labels else None
+            arrays, text_values, covers_from, safe_until = read_table(
+                conn, table, float_columns, int_columns, text_columns
+            )
+            version = publish(dataset, arrays, text_values, source_table=table,
+                              covers_from=covers_from, safe_until=safe_until, extra=extra)
+        telemetry.incr("snapshot_rows", len(arrays["datetime"]), dataset=dataset)
+        print(f"📦 Published snapshot {dataset}/{version} ({len(arrays['datetime'])} rows).")
+        return version
+    except Exception as e:
+        conn.rollback()
+        telemetry.incr("errors", stage="snapshot_publish")
+        print(f"[WARN] Snapshot {dataset} not published: {e}")
+        return None
+
+
+def publish_measurements(conn):
+    return publish_table(conn, "measurements", MEASUREMENTS["table"], MEASUREMENTS["float"],
+                         MEASUREMENTS["int"], MEASUREMENTS["text"], cluster_labels=True)
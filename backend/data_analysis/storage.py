@@ -0,0 +1,296 @@
+"""
+Backend đọc dữ liệu cho các job batch: Postgres (mặc định) hoặc DuckDB trên Parquet.
+
+ANALYTICS_BACKEND=duckdb:
+- electricity_measurements được mirror sang Parquet, chia partition theo tháng:
+      <PARQUET_ROOT>/electricity_measurements/month=YYYY-MM/part_<uuid>.parquet
+  Mirror là incremental theo cột updated_at (chỉ kéo các dòng đổi sau bản mirror mới
+  nhất, chồng lấn WATERMARK_SAFETY_SECONDS cho transaction commit muộn) và chạy tự động trước mỗi lần đọc khi có connection Postgres. Bản ghi mới được
+  append thành file mới; lúc đọc, bản có updated_at lớn nhất của mỗi key thắng
+  (`compact` gộp lại các file của từng tháng).
+- Scan/lọc/sắp xếp chạy trong DuckDB (vectorized, đọc cột), kết quả lấy thẳng ra
+  NumPy bằng fetchnumpy() -> load_frame của loader trả về đúng Frame như với Postgres.
+- Không có Postgres (conn=None) vẫn đọc được từ Parquet: dùng cho dev/benchmark local.
+  Kết quả của job vẫn được ghi về Postgres.
+
+DuckDB là dependency tuỳ chọn (pip install duckdb), chỉ import khi backend được bật.
+Dòng bị xoá ở Postgres không được mirror: dùng `sync --full` để dựng lại.
+
+    python storage.py sync [--full]
+    python storage.py compact
+    python storage.py bench
+"""
+import argparse
+import os
+import shutil
+import time
+from datetime import timedelta
+
+import numpy as np
+
+import telemetry
+
+ANALYTICS_BACKEND = os.getenv("ANALYTICS_BACKEND", "postgres").lower()
+PARQUET_ROOT = os.getenv("PARQUET_ROOT", "parquet")
+SYNC_BATCH_ROWS = int(os.getenv("PARQUET_SYNC_BATCH_ROWS", 50000))
+SYNC_ON_READ = os.getenv("PARQUET_SYNC_ON_READ", "true").lower() == "true"
+# updated_at = NOW() là lúc transaction ghi bắt đầu: transaction dài có thể commit dòng mang
+# updated_at nhỏ hơn watermark của mirror -> mỗi lần sync đọc lại khoảng này trước watermark
+WATERMARK_SAFETY_SECONDS = int(os.getenv("WATERMARK_SAFETY_SECONDS", 900))
+
+# Bảng được mirror: key (duy nhất), cột dữ liệu, cột version (bản mới nhất thắng)
+MIRRORS = {
+    "electricity_measurements": {
+        "key": "datetime",
+        "columns": [
+            "zone", "carbon_intensity", "solar_mw", "wind_mw", "gas_mw", "unknown_mw",
+            "hydro_mw", "biomass_mw", "nuclear_mw", "geothermal_mw",
+        ],
+        "version": "updated_at",
+    },
+}
+TEXT_COLUMNS = {"zone"}
+
+
+def use_duckdb(table=None):
+    return ANALYTICS_BACKEND == "duckdb" and (table is None or table in MIRRORS)
+
+
+def connect():
+    try:
+        import duckdb
+    except ImportError:
+        raise RuntimeError("ANALYTICS_BACKEND=duckdb requires the 'duckdb' package (pip install duckdb)")
+    con = duckdb.connect()
+    if PARQUET_ROOT.startswith("s3://"):
+        con.execute("INSTALL httpfs; LOAD httpfs;")
+    return con
+
+
+def _table_dir(table):
+    return f"{PARQUET_ROOT.rstrip('/')}/{table}"
+
+
+def _glob(table):
+    return f"{_table_dir(table)}/**/*.parquet"
+
+
+def _has_files(con, table):
+    if not PARQUET_ROOT.startswith("s3://"):
+        return any(f.endswith(".parquet") for _, _, files in os.walk(_table_dir(table)) for f in files)
+    return bool(con.execute("SELECT COUNT(*) FROM glob(?)", [_glob(table)]).fetchone()[0])
+
+
+def scan_sql(table):
+    """SELECT trên toàn bộ file Parquet của bảng, mỗi key chỉ giữ bản có version mới nhất."""
+    spec = MIRRORS[table]
+    return f"""
+        SELECT * EXCLUDE (month)
+        FROM read_parquet('{_glob(table)}', hive_partitioning = true, union_by_name = true)
+        QUALIFY row_number() OVER (PARTITION BY {spec['key']} ORDER BY {spec['version']} DESC) = 1
+    """
+
+
+def watermark(con, table):
+    """updated_at lớn nhất đã có trong mirror (None nếu chưa mirror)."""
+    if not _has_files(con, table):
+        return None
+    return con.execute(
+        f"SELECT MAX({MIRRORS[table]['version']}) FROM read_parquet('{_glob(table)}', hive_partitioning = true)"
+    ).fetchone()[0]
+
+
+def _mirrored_versions(con, table, since):
+    """Các cặp (key, version) đã có trong mirror với version > since."""
+    spec = MIRRORS[table]
+    return set(con.execute(
+        f"SELECT {spec['key']}, {spec['version']} FROM read_parquet('{_glob(table)}', hive_partitioning = true) "
+        f"WHERE {spec['version']} > ?", [since]
+    ).fetchall())
+
+
+def _write_chunk(con, table, chunk):
+    spec = MIRRORS[table]
+    if not PARQUET_ROOT.startswith("s3://"):
+        os.makedirs(_table_dir(table), exist_ok=True)
+    con.register("mirror_chunk", chunk)
+    try:
+        con.execute(f"""
+            COPY (SELECT *, strftime({spec['key']}, '%Y-%m') AS month FROM mirror_chunk)
+            TO '{_table_dir(table)}'
+            (FORMAT parquet, PARTITION_BY (month), FILENAME_PATTERN 'part_{{uuid}}', APPEND)
+        """)
+    finally:
+        con.unregister("mirror_chunk")
+
+
+def sync_table(pg_conn, table, con=None, full=False, batch_rows=None):
+    """
+    Mirror các dòng của `table` có updated_at > watermark - WATERMARK_SAFETY_SECONDS sang
+    Parquet, bỏ các dòng đã mirror cùng version (full=True: dựng lại từ đầu). Đọc Postgres
+    bằng server-side cursor theo batch. Trả về số dòng đã ghi.
+    """
+    spec = MIRRORS[table]
+    con = con or connect()
+    batch_rows = batch_rows or SYNC_BATCH_ROWS
+    if full and not PARQUET_ROOT.startswith("s3://"):
+        shutil.rmtree(_table_dir(table), ignore_errors=True)
+    since = None if full else watermark(con, table)
+    read_from, mirrored = None, set()
+    if since is not None:
+        read_from = since - timedelta(seconds=WATERMARK_SAFETY_SECONDS)
+        mirrored = _mirrored_versions(con, table, read_from)
+
+    names = [spec["key"]] + spec["columns"] + [spec["version"]]
+    where = f"WHERE {spec['version']} > %s" if read_from is not None else ""
+    written = 0
+    with telemetry.span("parquet_sync", table=table):
+        with pg_conn.cursor(name=f"mirror_{table}") as cur:
+            cur.itersize = batch_rows
+            cur.execute(f"SELECT {', '.join(names)} FROM {table} {where} ORDER BY {spec['key']}",
+                        (read_from,) if read_from is not None else None)
+            while True:
+                rows = cur.fetchmany(batch_rows)
+                if not rows:
+                    break
+                if mirrored:
+                    rows = [r for r in rows if (r[0], r[-1]) not in mirrored]
+                    if not rows:
+                        continue
+                chunk = {}
+                for j, name in enumerate(names):
+                    column = [r[j] for r in rows]
+                    if name in (spec["key"], spec["version"]):
+                        chunk[name] = np.array(column, dtype="datetime64[us]")
+                    elif name in TEXT_COLUMNS:
+                        chunk[name] = np.array(["" if v is None else v for v in column])
+                    else:
+                        chunk[name] = np.array(column, dtype=np.float64)  # None -> NaN
+                _write_chunk(con, table, chunk)
+                written += len(rows)
+        pg_conn.commit()
+    telemetry.incr("parquet_rows_synced", written, table=table)
+    if written:
+        print(f"[PARQUET] Mirrored {written} changed rows of {table} (since {since}).")
+    return written
+
+
+def compact(table, con=None):
+    """Gộp mỗi partition tháng thành 1 file đã dedupe (chỉ PARQUET_ROOT local)."""
+    if PARQUET_ROOT.startswith("s3://"):
+        raise RuntimeError("compact only supports a local PARQUET_ROOT")
+    con = con or connect()
+    if not _has_files(con, table):
+        return 0
+    spec = MIRRORS[table]
+    table_dir = _table_dir(table)
+    tmp_dir = f"{table_dir}.compact"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    con.execute(f"""
+        COPY (SELECT *, strftime({spec['key']}, '%Y-%m') AS month FROM ({scan_sql(table)}))
+        TO '{tmp_dir}' (FORMAT parquet, PARTITION_BY (month), FILENAME_PATTERN 'part_{{uuid}}')
+    """)
+    old_dir = f"{table_dir}.old"
+    os.rename(table_dir, old_dir)
+    os.rename(tmp_dir, table_dir)
+    shutil.rmtree(old_dir)
+    return sum(len(files) for _, _, files in os.walk(table_dir))
+
+
+def _register_anomalies(pg_conn, con):
+    """Bảng cờ bất thường nhỏ -> nạp từ Postgres vào DuckDB để dùng lại mệnh đề của anomaly_filter."""
+    with pg_conn.cursor() as cur:
+        cur.execute("SELECT datetime, zone FROM measurement_anomalies")
+        rows = cur.fetchall()
+    pg_conn.commit()
+    con.register("measurement_anomalies", {
+        "datetime": np.array([r[0] for r in rows], dtype="datetime64[us]"),
+        "zone": np.array([r[1] for r in rows], dtype=object),
+    })
+
+
+def load_arrays(pg_conn, table, columns, key_column="datetime", where="", params=None,
+                key_dtype="datetime64[us]", dtype=np.float32):
+    """
+    Như loader.load_frame nhưng chạy trên Parquet: trả về (keys, values (n, k)).
+    `where` viết theo cú pháp Postgres (%s) được dùng lại nguyên vẹn (DuckDB dùng ?).
+    """
+    con = connect()
+    if pg_conn is not None and SYNC_ON_READ:
+        sync_table(pg_conn, table, con)
+    if not _has_files(con, table):
+        raise RuntimeError(f"No Parquet mirror for {table} under {PARQUET_ROOT} (run: python storage.py sync)")
+
+    con.execute(f"CREATE OR REPLACE VIEW {table} AS {scan_sql(table)}")
+    if "measurement_anomalies" in where:
+        if pg_conn is None:
+            where = ""
+        else:
+            _register_anomalies(pg_conn, con)
+    where_sql = f"WHERE {where}" if where else ""
+    sql = f"SELECT {', '.join([key_column] + list(columns))} FROM {table} {where_sql} ORDER BY {key_column}"
+    result = con.execute(sql.replace("%s", "?"), list(params or [])).fetchnumpy()
+    con.close()
+
+    keys = np.asarray(result[key_column]).astype(key_dtype)
+    values = np.empty((len(keys), len(columns)), dtype=dtype)
+    for j, name in enumerate(columns):
+        # Cột có NULL được trả về dạng masked array
+        values[:, j] = np.ma.asarray(result[name]).astype(np.float64).filled(np.nan)
+    return keys, values
+
+
+def _bench(pg_conn, table, columns, repeat=3):
+    import resource
+
+    # Chạy dạng script thì module này là __main__: đổi backend trên module mà loader import
+    import storage
+    from loader import load_frame
+
+    backends = (["postgres"] if pg_conn is not None else []) + ["duckdb"]
+    for backend in backends:
+        storage.ANALYTICS_BACKEND = backend
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            frame = load_frame(pg_conn, table, columns)
+            timings.append(time.perf_counter() - started)
+        best = min(timings)
+        peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        print(f"{backend:>9}: {len(frame.keys)} rows x {len(columns)} cols in {best * 1000:.1f} ms "
+              f"({len(frame.keys) / best:,.0f} rows/s), peak RSS {peak_mb:.0f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    sync = sub.add_parser("sync", help="Mirror Postgres -> Parquet (incremental theo updated_at)")
+    sync.add_argument("--full", action="store_true", help="Dựng lại mirror từ đầu")
+    sub.add_parser("compact", help="Gộp các file Parquet của mỗi tháng")
+    bench = sub.add_parser("bench", help="So sánh thời gian load_frame giữa các backend")
+    bench.add_argument("--offline", action="store_true", help="Chỉ đọc Parquet, không kết nối Postgres")
+    args = parser.parse_args()
+
+    table = "electricity_measurements"
+    if args.command == "compact":
+        print(f"{compact(table)} files after compaction")
+        return 0
+
+    pg_conn = None
+    if not (args.command == "bench" and args.offline):
+        import psycopg2
+        pg_conn = psycopg2.connect(host=os.getenv("DB_HOST"), dbname=os.getenv("DB_NAME"),
+                                   user=os.getenv("DB_USER"), password=os.getenv("DB_PASS"))
+    try:
+        if args.command == "sync":
+            print(f"{sync_table(pg_conn, table, full=args.full)} rows mirrored")
+        else:
+            _bench(pg_conn, table, [c for c in MIRRORS[table]["columns"] if c not in TEXT_COLUMNS])
+    finally:
+        if pg_conn is not None:
+            pg_conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
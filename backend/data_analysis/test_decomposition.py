@@ -0,0 +1,67 @@
+"""
+Test cho decomposition.seasonal_decompose_2d (chạy local, không đóng gói vào image Lambda):
+    cd backend/data_analysis && python -m pytest -q test_decomposition.py
+
+Test parity cần statsmodels; không cài thì test đó được skip.
+"""
+import numpy as np
+import pytest
+
+from bench_decompose import make_series
+from decomposition import seasonal_decompose_2d
+
+PERIOD = 24
+
+
+def linear_plus_daily(hours=PERIOD * 4):
+    """Fixture giải tích: trend tuyến tính + mẫu ngày tổng bằng 0 -> biết trước kết quả."""
+    t = np.arange(hours, dtype=np.float64)
+    pattern = np.sin(np.arange(PERIOD) / PERIOD * 2 * np.pi) * 100
+    return t, 0.5 * t + 10, pattern
+
+
+def test_known_fixture_output():
+    t, linear, pattern = linear_plus_daily()
+    x = linear + np.tile(pattern, len(t) // PERIOD)
+
+    trend, seasonal, residual = seasonal_decompose_2d(x, period=PERIOD)
+
+    half = PERIOD // 2
+    assert trend.shape == seasonal.shape == residual.shape == x.shape
+    assert np.isnan(trend[:half]).all() and np.isnan(trend[-half:]).all()
+    np.testing.assert_allclose(trend[half:-half], linear[half:-half], atol=1e-9)
+    np.testing.assert_allclose(seasonal, np.tile(pattern, len(t) // PERIOD), atol=1e-9)
+    np.testing.assert_allclose(residual[half:-half], 0, atol=1e-9)
+
+
+def test_columns_decomposed_independently():
+    data = make_series(PERIOD * 14, 3)
+
+    trend, seasonal, residual = seasonal_decompose_2d(data, period=PERIOD)
+
+    for j in range(data.shape[1]):
+        for ours, single in zip((trend, seasonal, residual), seasonal_decompose_2d(data[:, j], period=PERIOD)):
+            np.testing.assert_allclose(ours[:, j], single, equal_nan=True)
+
+
+@pytest.mark.parametrize("values, message", [
+    (np.ones(PERIOD * 2 - 1), "at least 2 full periods"),
+    (np.r_[np.ones(PERIOD * 2), np.nan], "NaN"),
+])
+def test_rejects_invalid_input(values, message):
+    with pytest.raises(ValueError, match=message):
+        seasonal_decompose_2d(values, period=PERIOD)
+
+
+@pytest.mark.parametrize("period", [24, 7])
+def test_matches_statsmodels(period):
+    seasonal_decompose = pytest.importorskip("statsmodels.tsa.seasonal").seasonal_decompose
+    # Số giờ không chia hết cho period: kiểm tra cả nhánh pad NaN khi gom theo pha
+    data = make_series(PERIOD * 14 + 5, 3)
+
+    ours = seasonal_decompose_2d(data, period=period)
+
+    results = [seasonal_decompose(data[:, j], model="additive", period=period) for j in range(data.shape[1])]
+    for name, values in zip(("trend", "seasonal", "resid"), ours):
+        ref = np.column_stack([np.asarray(getattr(r, name)) for r in results])
+        np.testing.assert_allclose(values, ref, atol=1e-8, equal_nan=True, err_msg=name)
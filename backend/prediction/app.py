@@ -1,9 +1,9 @@
 import os
-import joblib
 import numpy as np
-import pandas as pd
 import psycopg2
-import tensorflow as tf
+import querylog
+import registry
+import telemetry
 from datetime import datetime, timedelta
 
 DB_HOST = os.getenv("DB_HOST")
@@ -11,25 +11,22 @@ DB_NAME = os.getenv("DB_NAME")
 DB_USER = os.getenv("DB_USER")
 DB_PASS = os.getenv("DB_PASS")
 
-BASE_DIR = os.environ.get('LAMBDA_TASK_ROOT', '')
-MODEL_PATH = os.path.join(BASE_DIR, 'models', 'solar_mlp.keras')
-SCALER_PATH = os.path.join(BASE_DIR, 'models', 'scaler.pkl')
-
-model = None
-scaler = None
-
-print("⏳ Initializing Prediction Service...")
-try:
-    # Load model Keras (chỉ load 1 lần
-    model = tf.keras.models.load_model(MODEL_PATH)
-    scaler = joblib.load(SCALER_PATH)
-    print("✅ Model & Scaler loaded successfully.")
-except Exception as e:
-    print(f"⚠️ CRITICAL: Could not load model/scaler: {e}")
+def load_model():
+    """
+    Lấy model version mới nhất từ registry (lazy, có LRU cache).
+    TensorFlow chỉ được import khi load version lần đầu, nên các nhánh không cần
+    predict (thiếu dữ liệu, lỗi DB...) không phải trả giá import TF khi cold start.
+    """
+    try:
+        return registry.load()
+    except Exception as e:
+        print(f"⚠️ CRITICAL: Could not load model/scaler: {e}")
+        return None
 
 def get_db_connection():
     return psycopg2.connect(
-        host=DB_HOST, database=DB_NAME, user=DB_USER, password=DB_PASS
+        host=DB_HOST, database=DB_NAME, user=DB_USER, password=DB_PASS,
+        connection_factory=querylog.LoggedConnection
     )
 
 def fetch_recent_data():
@@ -44,55 +41,81 @@ def fetch_recent_data():
     """
     try:
         conn = get_db_connection()
-        df = pd.read_sql(query, conn)
+        with telemetry.span("read_sql", table="electricity_analysis_results"):
+            with conn.cursor() as cur:
+                cur.execute(query)
+                rows = cur.fetchall()
         conn.close()
-        # Đảo ngược lại để có thứ tự thời gian tăng dần (Cũ -> Mới)
-        return df.iloc[::-1].reset_index(drop=True)
+        telemetry.incr("rows_in", len(rows), table="electricity_analysis_results")
     except Exception as e:
         print(f"❌ DB Error: {e}")
-        return pd.DataFrame()
+        return None
 
-def prepare_features(df):
+    if not rows:
+        return None
+    # Đảo ngược lại để có thứ tự thời gian tăng dần (Cũ -> Mới)
+    rows.reverse()
+    times = [r[0] for r in rows]
+    values = np.array([r[1:] for r in rows], dtype=np.float64)  # None -> nan
+    return {
+        'datetime': times,
+        'solar_mw': values[:, 0],
+        'solar_trend': values[:, 1],
+        'solar_seasonal': values[:, 2],
+        'solar_normalized': values[:, 3],
+    }
+
+def prepare_features(data):
     """
-    Tạo input vector (1, 7) cho Model.
-    Thứ tự feature phải KHỚP 100% với lúc train.
+    Tính các feature của dòng mới nhất hợp lệ, trả về dict {tên feature: giá trị}.
+    Việc xếp thành vector theo đúng thứ tự lúc train do to_model_input() làm.
     """
-    if len(df) < 25:
+    n = len(data['datetime'])
+    if n < 25:
         print("⚠️ Not enough data history.")
         return None, None
 
-    df['datetime'] = pd.to_datetime(df['datetime'])
-    
-    # Feature Engineering
-    df['solar_mw_lag1'] = df['solar_mw'].shift(1)
-    df['solar_mw_lag24'] = df['solar_mw'].shift(24)
-    df['hour'] = df['datetime'].dt.hour
-    df['day_of_week'] = df['datetime'].dt.dayofweek
-    
+    # Feature Engineering (vectorized): lag tính bằng dịch mảng, 24 dòng đầu không có lag24
+    solar = data['solar_mw']
+    lag1 = np.full(n, np.nan)
+    lag1[1:] = solar[:-1]
+    lag24 = np.full(n, np.nan)
+    lag24[24:] = solar[:-24]
+
     # Lấy dòng cuối cùng (Latest) hợp lệ
-    valid_df = df.dropna().tail(1)
-    
-    if valid_df.empty:
+    stacked = np.column_stack([
+        data['solar_normalized'], data['solar_trend'], data['solar_seasonal'], solar, lag1, lag24
+    ])
+    valid = np.flatnonzero(~np.isnan(stacked).any(axis=1))
+    if valid.size == 0:
         return None, None
-        
-    latest = valid_df.iloc[0]
-    current_time = latest['datetime']
+
+    i = valid[-1]
+    current_time = data['datetime'][i]
     
-    # Tạo vector input chuẩn (1, 7)
-    # Thứ tự: [Norm, Trend, Seasonal, Hour, Day, Lag1, Lag24]
-    features = np.array([
-        latest['solar_normalized'], 
-        latest['solar_trend'],      
-        latest['solar_seasonal'],   
-        latest['hour'],             
-        latest['day_of_week'],      
-        latest['solar_mw_lag1'],    
-        latest['solar_mw_lag24']    
-    ]).reshape(1, -1)
+    features = {
+        'solar_normalized': data['solar_normalized'][i],
+        'solar_trend': data['solar_trend'][i],
+        'solar_seasonal': data['solar_seasonal'][i],
+        'hour': current_time.hour,
+        'day_of_week': current_time.weekday(),
+        'solar_mw_lag1': lag1[i],
+        'solar_mw_lag24': lag24[i],
+    }
     
     return features, current_time
 
-def save_predictions(predictions, start_time):
+def to_model_input(features, bundle):
+    """
+    Tạo input vector (1, n_features) theo feature_order trong manifest của model
+    (thứ tự phải KHỚP 100% với lúc train) rồi scale bằng scaler đi kèm version đó.
+    """
+    X = np.array([[features[name] for name in bundle.feature_order]], dtype=np.float64)
+    if bundle.scaler is not None:
+        X = bundle.scaler.transform(X)
+    return X
+
+def save_predictions(predictions, start_time, model_version=None):
     """Lưu kết quả dự báo 24h vào DB"""
     try:
         conn = get_db_connection()
@@ -108,48 +131,86 @@ def save_predictions(predictions, start_time):
                 created_at TIMESTAMP DEFAULT NOW()
             )
         """)
+        cur.execute("ALTER TABLE solar_predictions ADD COLUMN IF NOT EXISTS model_version VARCHAR(64)")
+        cur.execute("ALTER TABLE solar_predictions ADD COLUMN IF NOT EXISTS horizon_h SMALLINT")
         
         values = []
         for i, val in enumerate(predictions):
             target_time = start_time + timedelta(hours=i + 1)
             val_mw = max(float(val), 0.0) # Không lấy số âm
-            values.append((target_time, val_mw))
+            values.append((target_time, val_mw, model_version, i + 1))
         
         # Batch Insert
-        args_str = ','.join(cur.mogrify("(NOW(), %s, %s)", x).decode('utf-8') for x in values)
-        cur.execute("INSERT INTO solar_predictions (prediction_time, target_time, predicted_solar_mw) VALUES " + args_str)
-        
-        conn.commit()
+        with telemetry.span("db_insert", table="solar_predictions"):
+            args_str = ','.join(cur.mogrify("(NOW(), %s, %s, %s, %s)", x).decode('utf-8') for x in values)
+            cur.execute("INSERT INTO solar_predictions (prediction_time, target_time, predicted_solar_mw, model_version, horizon_h) VALUES " + args_str)
+            
+            conn.commit()
+        telemetry.incr("rows_out", len(values), table="solar_predictions")
         cur.close()
+        querylog.flush(conn)
         conn.close()
-        print(f"✅ Saved predictions for next 24 hours.")
+        print(f"✅ Saved predictions for next {len(values)} hours (model {model_version}).")
     except Exception as e:
         print(f"❌ Save Error: {e}")
 
+def run_accuracy_job():
+    """Job đánh giá độ chính xác dự báo (xem evaluation.py). Không cần TensorFlow."""
+    from evaluation import run_evaluation_job
+    conn = get_db_connection()
+    try:
+        return run_evaluation_job(conn)
+    except Exception as e:
+        conn.rollback()
+        print(f"❌ Evaluation Error: {e}")
+        return None
+    finally:
+        querylog.flush(conn)
+        conn.close()
+
+def run_retraining_job(epochs=None, since=None):
+    """Train lại model từ lịch sử (xem train.py). TensorFlow chỉ được import trong nhánh này."""
+    from train import run_training_job
+    conn = get_db_connection()
+    try:
+        return run_training_job(conn, epochs=epochs, since=since)
+    except Exception as e:
+        conn.rollback()
+        print(f"❌ Training Error: {e}")
+        return None
+    finally:
+        querylog.flush(conn)
+        conn.close()
+
 def run_prediction_job():
     print(f"--- Starting Prediction Job: {datetime.now()} ---")
     
-    if model is None:
-        print("❌ Model is NOT loaded. Cannot predict.")
-        return False
-
     # 1. Fetch Data
-    df = fetch_recent_data()
-    if df.empty: return False
+    data = fetch_recent_data()
+    if data is None: return False
 
     # 2. Prepare Features
-    X_input, current_time = prepare_features(df)
-    if X_input is None: 
+    with telemetry.span("prepare_features"):
+        features, current_time = prepare_features(data)
+    if features is None: 
         print("⚠️ Not enough valid data for feature engineering.")
         return False
 
-    # 3. Predict using TensorFlow Model
+    # 3. Model (version mới nhất trong registry)
+    bundle = load_model()
+    if bundle is None:
+        print("❌ Model is NOT loaded. Cannot predict.")
+        return False
+
+    # 4. Predict using TensorFlow Model
     try:
-        print(f"🔮 Predicting for time > {current_time}...")
+        X_input = to_model_input(features, bundle)
+        print(f"🔮 Predicting for time > {current_time} with model {bundle.version}...")
         # Model trả về (1, 24) -> flatten thành (24,)
-        preds = model.predict(X_input, verbose=0).flatten()
+        with telemetry.span("predict"):
+            preds = bundle.model.predict(X_input, verbose=0).flatten()
         
-        save_predictions(preds, current_time)
+        save_predictions(preds, current_time, bundle.version)
         return True
     except Exception as e:
         print(f"❌ Prediction Logic Error: {e}")
@@ -0,0 +1,170 @@
+"""
+Đánh giá độ chính xác dự báo (solar_predictions vs electricity_measurements).
+
+- Incremental theo lúc actual về, không theo target_time: mỗi dự báo được chấm đúng
+  một lần, khi đã có actual, rồi được đánh dấu solar_predictions.evaluated_at trong
+  cùng transaction với metrics. Actual về muộn (backfill lấp lỗ) vẫn được chấm ở lần
+  chạy sau; partial index trên các dự báo chưa chấm giữ câu JOIN nhỏ.
+- Actual bị sửa sau khi đã chấm thì không chấm lại (metrics là tổng cộng dồn).
+- Gom nhóm bằng NumPy theo (model_version, ngày của target_time, horizon 1..24h)
+  và lưu dạng tổng cộng dồn (n, sum_error, sum_abs_error, sum_sq_error) vào
+  forecast_accuracy_metrics -> cộng được qua nhiều lần chạy; MAE/RMSE/bias tính
+  lúc đọc: MAE = sum_abs/n, RMSE = sqrt(sum_sq/n), bias = sum_error/n.
+- error = predicted - actual (bias > 0: dự báo cao hơn thực tế).
+"""
+import numpy as np
+from psycopg2.extras import execute_values
+
+import telemetry
+
+JOB_NAME = "forecast_accuracy"
+
+DDL = """
+    CREATE TABLE IF NOT EXISTS forecast_accuracy_metrics (
+        model_version VARCHAR(64) NOT NULL,
+        day DATE NOT NULL,
+        horizon_h SMALLINT NOT NULL,
+        n INTEGER NOT NULL,
+        sum_error DOUBLE PRECISION NOT NULL,
+        sum_abs_error DOUBLE PRECISION NOT NULL,
+        sum_sq_error DOUBLE PRECISION NOT NULL,
+        updated_at TIMESTAMP DEFAULT NOW(),
+        PRIMARY KEY (model_version, day, horizon_h)
+    );
+    CREATE TABLE IF NOT EXISTS forecast_eval_state (
+        job VARCHAR(64) PRIMARY KEY,
+        last_target_time TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT NOW()
+    );
+    ALTER TABLE solar_predictions ADD COLUMN IF NOT EXISTS evaluated_at TIMESTAMP;
+    CREATE INDEX IF NOT EXISTS idx_solar_predictions_unevaluated
+        ON solar_predictions (target_time) WHERE evaluated_at IS NULL;
+"""
+
+# Chuyển từ watermark theo target_time (bản cũ): các dự báo <= watermark đã có actual thì
+# đã được cộng vào metrics -> đánh dấu để không đếm lại. Chỉ chạy một lần, sau đó
+# last_target_time = NULL.
+MIGRATE_SQL = """
+    UPDATE solar_predictions sp SET evaluated_at = NOW()
+    FROM electricity_measurements m
+    WHERE m.datetime = sp.target_time AND sp.target_time <= %(since)s
+      AND sp.evaluated_at IS NULL
+      AND sp.predicted_solar_mw IS NOT NULL AND m.solar_mw IS NOT NULL
+"""
+
+# Dự báo cũ (trước khi có cột horizon_h) được suy ra horizon bằng thứ tự target_time
+# trong cùng một lần predict (cùng prediction_time).
+JOIN_SQL = """
+    WITH pending AS (
+        SELECT sp.id, sp.prediction_time
+        FROM solar_predictions sp
+        JOIN electricity_measurements m ON m.datetime = sp.target_time
+        WHERE sp.evaluated_at IS NULL
+          AND sp.predicted_solar_mw IS NOT NULL AND m.solar_mw IS NOT NULL
+    ),
+    batches AS (
+        SELECT DISTINCT prediction_time FROM pending
+    ),
+    p AS (
+        SELECT
+            sp.id,
+            COALESCE(sp.model_version, 'unknown') AS model_version,
+            sp.target_time,
+            sp.predicted_solar_mw,
+            COALESCE(sp.horizon_h, ROW_NUMBER() OVER (
+                PARTITION BY sp.prediction_time ORDER BY sp.target_time
+            )) AS horizon_h
+        FROM solar_predictions sp
+        JOIN batches b ON b.prediction_time = sp.prediction_time
+    )
+    SELECT p.id, p.model_version, p.target_time::date AS day, p.horizon_h,
+           p.predicted_solar_mw, m.solar_mw
+    FROM p
+    JOIN electricity_measurements m ON m.datetime = p.target_time
+    WHERE p.id IN (SELECT id FROM pending)
+"""
+
+UPSERT_SQL = """
+    INSERT INTO forecast_accuracy_metrics
+        (model_version, day, horizon_h, n, sum_error, sum_abs_error, sum_sq_error)
+    VALUES %s
+    ON CONFLICT (model_version, day, horizon_h) DO UPDATE SET
+        n = forecast_accuracy_metrics.n + EXCLUDED.n,
+        sum_error = forecast_accuracy_metrics.sum_error + EXCLUDED.sum_error,
+        sum_abs_error = forecast_accuracy_metrics.sum_abs_error + EXCLUDED.sum_abs_error,
+        sum_sq_error = forecast_accuracy_metrics.sum_sq_error + EXCLUDED.sum_sq_error,
+        updated_at = NOW()
+"""
+
+
+def aggregate_errors(versions, days, horizons, predicted, actual):
+    """
+    Gom nhóm vectorized theo (model_version, day, horizon).
+    Trả về list tuple (model_version, day, horizon, n, sum_err, sum_abs, sum_sq).
+    """
+    predicted = np.asarray(predicted, dtype=np.float64)
+    error = predicted - np.asarray(actual, dtype=np.float64)
+
+    v_values, v_codes = np.unique(np.asarray(versions, dtype=object).astype(str), return_inverse=True)
+    d_values, d_codes = np.unique(np.asarray(days, dtype="datetime64[D]"), return_inverse=True)
+    keys = np.column_stack([v_codes, d_codes, np.asarray(horizons, dtype=np.int64)])
+    groups, inverse = np.unique(keys, axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+
+    size = len(groups)
+    n = np.bincount(inverse, minlength=size)
+    sum_err = np.bincount(inverse, weights=error, minlength=size)
+    sum_abs = np.bincount(inverse, weights=np.abs(error), minlength=size)
+    sum_sq = np.bincount(inverse, weights=error * error, minlength=size)
+
+    return [
+        (str(v_values[v]), d_values[d].item(), int(h), int(n[i]), float(sum_err[i]), float(sum_abs[i]), float(sum_sq[i]))
+        for i, (v, d, h) in enumerate(groups)
+    ]
+
+
+def run_evaluation_job(conn):
+    """Chạy incremental: chỉ các dự báo chưa chấm đã có actual (kể cả actual về muộn)."""
+    print("--- Starting Forecast Accuracy Job ---")
+    with conn.cursor() as cur:
+        cur.execute("SELECT to_regclass('solar_predictions') IS NOT NULL")
+        if not cur.fetchone()[0]:
+            conn.commit()
+            print("[INFO] No predictions to evaluate yet.")
+            return {"evaluated": 0, "groups": 0}
+        cur.execute(DDL)
+        # Khoá dòng state -> hai lần chạy đồng thời không chấm trùng cùng dự báo
+        cur.execute("""
+            INSERT INTO forecast_eval_state (job) VALUES (%s) ON CONFLICT (job) DO NOTHING
+        """, (JOB_NAME,))
+        cur.execute("SELECT last_target_time FROM forecast_eval_state WHERE job = %s FOR UPDATE", (JOB_NAME,))
+        since = cur.fetchone()[0]
+        if since is not None:
+            cur.execute(MIGRATE_SQL, {"since": since})
+            print(f"[INFO] Marked {cur.rowcount} forecasts up to {since} as already evaluated.")
+
+        with telemetry.span("read_sql", table="solar_predictions"):
+            cur.execute(JOIN_SQL)
+            rows = cur.fetchall()
+        telemetry.incr("rows_in", len(rows), table="solar_predictions")
+
+        groups = []
+        if rows:
+            ids, versions, days, horizons, predicted, actual = zip(*rows)
+            with telemetry.span("aggregate_errors"):
+                groups = aggregate_errors(versions, days, horizons, predicted, actual)
+            with telemetry.span("db_upsert", table="forecast_accuracy_metrics"):
+                execute_values(cur, UPSERT_SQL, groups)
+                # Đánh dấu cùng transaction với metrics -> không đếm trùng khi retry
+                cur.execute("UPDATE solar_predictions SET evaluated_at = NOW() WHERE id = ANY(%s)", (list(ids),))
+            telemetry.incr("rows_out", len(groups), table="forecast_accuracy_metrics")
+
+        cur.execute("""
+            UPDATE forecast_eval_state SET last_target_time = NULL, updated_at = NOW() WHERE job = %s
+        """, (JOB_NAME,))
+    conn.commit()
+    if not rows:
+        print("[INFO] No new actuals since last evaluation.")
+    else:
+        print(f"✅ Evaluated {len(rows)} forecasts into {len(groups)} metric groups.")
+    return {"evaluated": len(rows), "groups": len(groups)}
@@ -1,18 +1,51 @@
 import json
-from app import run_prediction_job
+import querylog
+import telemetry
+from app import run_prediction_job, run_accuracy_job, run_retraining_job
 
 def lambda_handler(event, context):
     print("🚀 Lambda Prediction Triggered")
+    telemetry.reset()
+
+    # {"action": "evaluate"} -> chấm điểm các dự báo đã có actual
+    action = event.get('action') if isinstance(event, dict) else None
+    if action == 'evaluate':
+        with querylog.tag("evaluation_job"):
+            result = run_accuracy_job()
+        if result is None:
+            return {
+                'statusCode': 500,
+                'body': json.dumps({'error': 'Evaluation Failed (Check CloudWatch logs)', 'metrics': telemetry.snapshot()})
+            }
+        return {
+            'statusCode': 200,
+            'body': json.dumps({'message': 'Forecast accuracy updated', 'result': result, 'metrics': telemetry.snapshot()})
+        }
     
-    success = run_prediction_job()
+    # {"action": "train", "epochs": 2} -> train lại (warm-start) và publish version mới
+    if action == 'train':
+        with querylog.tag("training_job"):
+            result = run_retraining_job(epochs=event.get('epochs'), since=event.get('since'))
+        if result is None:
+            return {
+                'statusCode': 500,
+                'body': json.dumps({'error': 'Training Failed (Check CloudWatch logs)', 'metrics': telemetry.snapshot()})
+            }
+        return {
+            'statusCode': 200,
+            'body': json.dumps({'message': 'Model retrained', 'result': result, 'metrics': telemetry.snapshot()})
+        }
+
+    with querylog.tag("prediction_job"):
+        success = run_prediction_job()
     
     if success:
         return {
             'statusCode': 200,
-            'body': json.dumps({'message': 'Prediction 24h Success'})
+            'body': json.dumps({'message': 'Prediction 24h Success', 'metrics': telemetry.snapshot()})
         }
     else:
         return {
             'statusCode': 500,
-            'body': json.dumps({'error': 'Prediction Failed (Check CloudWatch logs)'})
+            'body': json.dumps({'error': 'Prediction Failed (Check CloudWatch logs)', 'metrics': telemetry.snapshot()})
         }
\ No newline at end of file
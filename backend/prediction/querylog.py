@@ -0,0 +1,493 @@
+"""
+Đo từng query SQL (latency, số dòng, bytes trả về) theo endpoint/job, bắt query chậm và
+lấy mẫu EXPLAIN (ANALYZE, BUFFERS) để thấy sớm khi plan đổi.
+
+- Dùng: psycopg2.connect(..., connection_factory=querylog.LoggedConnection) (hoặc
+  connect_args của SQLAlchemy). Mọi cursor của connection, kể cả cursor_factory riêng
+  (RealDictCursor) và named cursor, được bọc -> không phải sửa chỗ gọi execute.
+- Một query = từ execute tới execute kế tiếp / close của cursor: latency gồm cả thời gian
+  fetch (named cursor đọc dần từ server). Bytes là ước lượng kích thước giá trị đã fetch.
+- Query được gom theo fingerprint: SQL bỏ literal/tham số (VALUES của execute_values gom
+  thành một), query_id = 12 ký tự sha1. Endpoint lấy từ `with querylog.tag(...)`.
+- Số liệu vào telemetry (span db_query, counter db_rows/db_bytes/db_query_errors) và
+  bảng tổng hợp trong process (stats()).
+- Query >= QUERY_SLOW_MS -> bản ghi slow (recent()). Với SELECT, theo xác suất
+  QUERY_EXPLAIN_SAMPLE và tối đa một lần / query_id / QUERY_EXPLAIN_INTERVAL_SECONDS,
+  chạy lại EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) trên cùng connection trong một
+  SAVEPOINT (luôn rollback về savepoint). Query chậm hơn QUERY_EXPLAIN_MAX_MS chỉ lấy
+  EXPLAIN không ANALYZE để không chạy lại một lần quét dài.
+- plan_hash = hash hình dạng plan (loại node, bảng, index); khác lần trước của cùng
+  query_id -> plan_changed (cảnh báo trong log).
+- flush(conn) ghi các bản ghi slow chưa lưu vào bảng slow_query_log (API và các job
+  cùng ghi, /admin/queries của API đọc lại).
+
+Mỗi service giữ một bản copy giống hệt file này (như telemetry.py).
+"""
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import date, datetime, timezone
+from decimal import Decimal
+
+import psycopg2
+import psycopg2.extensions
+from psycopg2.extras import Json, execute_values
+
+import telemetry
+
+QUERY_SLOW_MS = float(os.getenv("QUERY_SLOW_MS", 200))
+QUERY_EXPLAIN_SAMPLE = float(os.getenv("QUERY_EXPLAIN_SAMPLE", 0.1))
+QUERY_EXPLAIN_INTERVAL_SECONDS = float(os.getenv("QUERY_EXPLAIN_INTERVAL_SECONDS", 600))
+QUERY_EXPLAIN_MAX_MS = float(os.getenv("QUERY_EXPLAIN_MAX_MS", 10000))
+QUERY_LOG_KEEP = int(os.getenv("QUERY_LOG_KEEP", 200))
+QUERY_LOG_RETENTION_DAYS = int(os.getenv("QUERY_LOG_RETENTION_DAYS", 14))
+
+DDL = """
+    CREATE TABLE IF NOT EXISTS slow_query_log (
+        id BIGSERIAL PRIMARY KEY,
+        captured_at TIMESTAMP NOT NULL DEFAULT NOW(),
+        endpoint VARCHAR(100),
+        query_id VARCHAR(12) NOT NULL,
+        query TEXT NOT NULL,
+        duration_ms DOUBLE PRECISION,
+        rows BIGINT,
+        bytes BIGINT,
+        analyzed BOOLEAN,
+        plan_hash VARCHAR(12),
+        plan JSONB
+    );
+    CREATE INDEX IF NOT EXISTS idx_slow_query_log_query ON slow_query_log (query_id, captured_at);
+    CREATE INDEX IF NOT EXISTS idx_slow_query_log_captured ON slow_query_log (captured_at);
+"""
+
+# Số dòng tối đa mỗi lần fetch được đo kích thước (phần còn lại ngoại suy theo trung bình)
+BYTES_SAMPLE_ROWS = 64
+MAX_QUERY_TEXT = 2000
+
+_endpoint = ContextVar("querylog_endpoint", default="-")
+
+_lock = threading.Lock()
+_stats = {}                               # (endpoint, query_id) -> dict
+_recent = deque(maxlen=QUERY_LOG_KEEP)    # bản ghi slow gần nhất (mới nhất cuối)
+_pending = deque(maxlen=QUERY_LOG_KEEP)   # bản ghi slow chưa flush vào slow_query_log
+_explained_at = {}                        # query_id -> time.monotonic() lần EXPLAIN gần nhất
+_plan_hashes = {}                         # query_id -> plan_hash lần EXPLAIN gần nhất
+_fingerprints = {}                        # SQL gốc (ngắn) -> (query_id, SQL đã chuẩn hoá)
+
+
+@contextmanager
+def tag(endpoint):
+    """Gắn các query chạy trong khối cho `endpoint` (tên hàm payload, tên job...)."""
+    token = _endpoint.set(endpoint)
+    try:
+        yield
+    finally:
+        _endpoint.reset(token)
+
+
+# --- FINGERPRINT ---
+_COMMENT = re.compile(r"--[^\n]*|/\*.*?\*/", re.DOTALL)
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_PARAM = re.compile(r"%(?:\([^)]*\))?s")
+_NUMBER = re.compile(r"(?<![\w.?])-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?")
+_LIST_NULL = re.compile(r"(?<=[(,])\s*NULL\b", re.IGNORECASE)
+_TUPLE = re.compile(r"\(\s*\?(?:::[\w\[\]]+)?(?:\s*,\s*\?(?:::[\w\[\]]+)?)*\s*\)")
+_TUPLES = re.compile(r"\(\?\)(?:\s*,\s*\(\?\))+")
+_SPACE = re.compile(r"\s+")
+
+
+def _sql_text(query, conn=None):
+    if isinstance(query, (bytes, bytearray, memoryview)):
+        return bytes(query).decode("utf-8", "replace")
+    if not isinstance(query, str) and hasattr(query, "as_string"):
+        return query.as_string(conn)  # psycopg2.sql.Composable
+    return str(query)
+
+
+def normalize(sql):
+    """SQL bỏ comment, literal và tham số; danh sách giá trị / tuple VALUES gom thành (?)."""
+    sql = _COMMENT.sub(" ", sql)
+    sql = _STRING.sub("?", sql)
+    sql = _PARAM.sub("?", sql)
+    sql = _NUMBER.sub("?", sql)
+    sql = _LIST_NULL.sub("?", sql)
+    sql = _SPACE.sub(" ", sql).strip()
+    sql = _TUPLE.sub("(?)", sql)
+    return _TUPLES.sub("(?)", sql)
+
+
+def fingerprint(sql):
+    """(query_id, SQL đã chuẩn hoá). SQL có tham số (%s) lặp lại -> lấy từ cache."""
+    cached = _fingerprints.get(sql)
+    if cached is not None:
+        return cached
+    normalized = normalize(sql)[:MAX_QUERY_TEXT]
+    result = (hashlib.sha1(normalized.encode()).hexdigest()[:12], normalized)
+    # SQL dài (execute_values đã nhúng giá trị) gần như không lặp lại -> không cache
+    if len(sql) <= 4096 and len(_fingerprints) < 2048:
+        _fingerprints[sql] = result
+    return result
+
+
+# --- ƯỚC LƯỢNG BYTES ---
+def _value_bytes(value):
+    if value is None:
+        return 0
+    if isinstance(value, (str, bytes, bytearray, memoryview)):
+        return len(value)
+    if isinstance(value, (bool, int, float, Decimal, datetime, date)):
+        return 8
+    return len(str(value))
+
+
+def _rows_bytes(rows):
+    """Tổng kích thước giá trị của rows; đo tối đa BYTES_SAMPLE_ROWS dòng rồi ngoại suy."""
+    if not rows:
+        return 0
+    sample = rows[:BYTES_SAMPLE_ROWS]
+    total = 0
+    for row in sample:
+        values = row.values() if isinstance(row, dict) else row
+        total += sum(_value_bytes(v) for v in values)
+    return int(total * len(rows) / len(sample))
+
+
+# --- CURSOR / CONNECTION ---
+class _Pending:
+    __slots__ = ("endpoint", "query", "vars", "elapsed", "rowcount", "fetched", "bytes")
+
+    def __init__(self, endpoint, query, vars, elapsed, rowcount):
+        self.endpoint = endpoint
+        self.query = query
+        self.vars = vars
+        self.elapsed = elapsed
+        self.rowcount = rowcount
+        self.fetched = 0
+        self.bytes = 0
+
+
+class LoggedCursorMixin:
+    """Trộn vào trước class cursor gốc (xem LoggedConnection.cursor)."""
+    _querylog = None
+
+    def execute(self, query, vars=None):
+        self._querylog_finish()
+        return self._querylog_run(super().execute, query, vars)
+
+    def executemany(self, query, vars_list):
+        self._querylog_finish()
+        return self._querylog_run(super().executemany, query, vars_list, explain=False)
+
+    def _querylog_run(self, method, query, vars, explain=True):
+        endpoint = _endpoint.get()
+        started = time.perf_counter()
+        try:
+            result = method(query, vars)
+        except Exception:
+            _record_error(endpoint, query, self.connection)
+            raise
+        # vars=False: executemany, không EXPLAIN
+        self._querylog = _Pending(endpoint, query, vars if explain else False,
+                                  time.perf_counter() - started, self.rowcount)
+        return result
+
+    def _querylog_fetched(self, rows, started):
+        pending = self._querylog
+        if pending is not None:
+            pending.elapsed += time.perf_counter() - started
+            pending.fetched += len(rows)
+            pending.bytes += _rows_bytes(rows)
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = super().fetchone()
+        self._querylog_fetched([row] if row is not None else [], started)
+        return row
+
+    def fetchmany(self, size=None):
+        started = time.perf_counter()
+        rows = super().fetchmany(size) if size is not None else super().fetchmany()
+        self._querylog_fetched(rows, started)
+        return rows
+
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = super().fetchall()
+        self._querylog_fetched(rows, started)
+        return rows
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            self._querylog_finish()
+
+    def _querylog_finish(self):
+        pending, self._querylog = self._querylog, None
+        if pending is not None:
+            try:
+                _record(self.connection, pending)
+            except Exception as e:
+                print(f"[WARN] Query log record failed: {e}")
+
+
+_cursor_classes = {}
+
+
+def _logged_class(factory):
+    cls = _cursor_classes.get(factory)
+    if cls is None:
+        cls = _cursor_classes[factory] = type(f"Logged{factory.__name__}", (LoggedCursorMixin, factory), {})
+    return cls
+
+
+class LoggedConnection(psycopg2.extensions.connection):
+    """Connection psycopg2 mà mọi cursor (mọi cursor_factory) đều được đo."""
+
+    def cursor(self, *args, **kwargs):
+        factory = kwargs.pop("cursor_factory", None) or self.cursor_factory or psycopg2.extensions.cursor
+        kwargs["cursor_factory"] = _logged_class(factory)
+        return super().cursor(*args, **kwargs)
+
+
+# --- GHI NHẬN ---
+def _record_error(endpoint, query, conn):
+    try:
+        query_id, _ = fingerprint(_sql_text(query, conn))
+    except Exception:
+        query_id = "unknown"
+    telemetry.incr("db_query_errors", endpoint=endpoint, query=query_id)
+    with _lock:
+        stat = _stats.get((endpoint, query_id))
+        if stat is not None:
+            stat["errors"] += 1
+
+
+def _record(conn, pending):
+    sql = _sql_text(pending.query, conn)
+    query_id, normalized = fingerprint(sql)
+    endpoint = pending.endpoint
+    seconds = pending.elapsed
+    rows = max(pending.fetched, pending.rowcount, 0)
+
+    telemetry.observe("db_query", seconds, endpoint=endpoint, query=query_id)
+    telemetry.incr("db_rows", rows, endpoint=endpoint, query=query_id)
+    telemetry.incr("db_bytes", pending.bytes, endpoint=endpoint, query=query_id)
+    slow = seconds * 1000 >= QUERY_SLOW_MS
+    with _lock:
+        stat = _stats.get((endpoint, query_id))
+        if stat is None:
+            stat = _stats[(endpoint, query_id)] = {
+                "endpoint": endpoint, "query_id": query_id, "query": normalized,
+                "count": 0, "total_ms": 0.0, "max_ms": 0.0, "rows": 0, "bytes": 0, "slow": 0, "errors": 0,
+            }
+        stat["count"] += 1
+        stat["total_ms"] += seconds * 1000
+        stat["max_ms"] = max(stat["max_ms"], seconds * 1000)
+        stat["rows"] += rows
+        stat["bytes"] += pending.bytes
+        stat["slow"] += slow
+    if not slow:
+        return
+
+    entry = {
+        "captured_at": datetime.now(timezone.utc).replace(tzinfo=None).isoformat(),
+        "endpoint": endpoint,
+        "query_id": query_id,
+        "query": normalized,
+        "duration_ms": round(seconds * 1000, 2),
+        "rows": rows,
+        "bytes": pending.bytes,
+        "analyzed": None,
+        "plan_hash": None,
+        "plan_changed": False,
+        "plan": None,
+    }
+    if pending.vars is not False and _should_explain(query_id, sql):
+        _attach_plan(conn, entry, sql, pending.vars, analyze=seconds * 1000 <= QUERY_EXPLAIN_MAX_MS)
+    telemetry.incr("slow_queries", endpoint=endpoint, query=query_id)
+    print(f"🐢 Slow query {query_id} ({endpoint}) {entry['duration_ms']:.0f}ms, {rows} rows: {normalized[:160]}")
+    with _lock:
+        _recent.append(entry)
+        _pending.append(entry)
+
+
+_READ_ONLY = re.compile(r"^\s*(SELECT|WITH)\b", re.IGNORECASE)
+_WRITES = re.compile(r"\b(INSERT|UPDATE|DELETE|MERGE|FOR\s+UPDATE|FOR\s+SHARE)\b", re.IGNORECASE)
+
+
+def _should_explain(query_id, sql):
+    # EXPLAIN ANALYZE chạy lại query thật -> chỉ SELECT thuần
+    if not _READ_ONLY.match(sql) or _WRITES.search(sql):
+        return False
+    if random.random() >= QUERY_EXPLAIN_SAMPLE:
+        return False
+    now = time.monotonic()
+    with _lock:
+        last = _explained_at.get(query_id)
+        if last is not None and now - last < QUERY_EXPLAIN_INTERVAL_SECONDS:
+            return False
+        _explained_at[query_id] = now
+    return True
+
+
+def _plan_shape(node):
+    return (
+        node.get("Node Type"), node.get("Relation Name"), node.get("Index Name"),
+        tuple(_plan_shape(child) for child in node.get("Plans", [])),
+    )
+
+
+def _attach_plan(conn, entry, sql, vars, analyze):
+    """
+    EXPLAIN trên cùng connection. Đang trong transaction -> bọc trong SAVEPOINT để lỗi không
+    làm hỏng transaction của caller; chưa có transaction -> rollback ngay transaction của EXPLAIN.
+    """
+    if conn.closed:
+        return
+    status = conn.info.transaction_status
+    if status == psycopg2.extensions.TRANSACTION_STATUS_INERROR:
+        return
+    options = "ANALYZE, BUFFERS, FORMAT JSON" if analyze else "FORMAT JSON"
+    savepoint = not conn.autocommit and status != psycopg2.extensions.TRANSACTION_STATUS_IDLE
+    own_transaction = not conn.autocommit and not savepoint
+    started = time.perf_counter()
+    # Cursor gốc (không bọc): EXPLAIN không tự ghi nhận thành query
+    cur = psycopg2.extensions.cursor(conn)
+    try:
+        if savepoint:
+            cur.execute("SAVEPOINT querylog_explain")
+        try:
+            cur.execute(f"EXPLAIN ({options}) {sql}", vars)
+            plan = cur.fetchone()[0]
+        finally:
+            if savepoint:
+                cur.execute("ROLLBACK TO SAVEPOINT querylog_explain")
+                cur.execute("RELEASE SAVEPOINT querylog_explain")
+    except psycopg2.Error as e:
+        print(f"[WARN] EXPLAIN {entry['query_id']} failed: {str(e).strip()}")
+        return
+    finally:
+        cur.close()
+        if own_transaction:
+            conn.rollback()
+    telemetry.observe("db_explain", time.perf_counter() - started, endpoint=entry["endpoint"])
+
+    plan = plan[0] if isinstance(plan, list) else plan
+    if isinstance(plan, str):
+        plan = json.loads(plan)[0]
+    plan_hash = hashlib.sha1(repr(_plan_shape(plan["Plan"])).encode()).hexdigest()[:12]
+    with _lock:
+        previous = _plan_hashes.get(entry["query_id"])
+        _plan_hashes[entry["query_id"]] = plan_hash
+    entry.update(analyzed=analyze, plan_hash=plan_hash, plan=plan,
+                 plan_changed=previous is not None and previous != plan_hash)
+    if entry["plan_changed"]:
+        telemetry.incr("plan_changes", query=entry["query_id"])
+        summary = summarize_plan(plan)
+        print(f"⚠️ Plan of query {entry['query_id']} changed ({previous} -> {plan_hash}): "
+              f"root {summary['node']}, seq scans {summary['seq_scans']}")
+
+
+def summarize_plan(plan):
+    """Tóm tắt plan JSON: node gốc, các bảng bị Seq Scan, thời gian và buffers."""
+    root = plan.get("Plan", {})
+    seq_scans = []
+
+    def walk(node):
+        if node.get("Node Type") == "Seq Scan":
+            seq_scans.append(node.get("Relation Name"))
+        for child in node.get("Plans", []):
+            walk(child)
+
+    walk(root)
+    return {
+        "node": root.get("Node Type"),
+        "total_cost": root.get("Total Cost"),
+        "plan_rows": root.get("Plan Rows"),
+        "actual_rows": root.get("Actual Rows"),
+        "planning_ms": plan.get("Planning Time"),
+        "execution_ms": plan.get("Execution Time"),
+        "shared_hit_blocks": root.get("Shared Hit Blocks"),
+        "shared_read_blocks": root.get("Shared Read Blocks"),
+        "seq_scans": seq_scans,
+    }
+
+
+# --- ĐỌC / LƯU ---
+def stats(limit=50):
+    """Tổng hợp theo (endpoint, query_id) trong process, sắp theo tổng thời gian giảm dần."""
+    with _lock:
+        items = [dict(s) for s in _stats.values()]
+    items.sort(key=lambda s: s["total_ms"], reverse=True)
+    for s in items:
+        s["avg_ms"] = round(s["total_ms"] / s["count"], 2) if s["count"] else None
+        s["total_ms"] = round(s["total_ms"], 2)
+        s["max_ms"] = round(s["max_ms"], 2)
+    return items[:limit]
+
+
+def recent(plans=False):
+    """Các bản ghi slow gần nhất trong process (mới nhất trước); plans=False -> chỉ tóm tắt plan."""
+    with _lock:
+        entries = list(_recent)
+    result = []
+    for entry in reversed(entries):
+        entry = dict(entry)
+        if entry["plan"] is not None:
+            entry["summary"] = summarize_plan(entry["plan"])
+            if not plans:
+                entry["plan"] = None
+        result.append(entry)
+    return result
+
+
+def pending_count():
+    with _lock:
+        return len(_pending)
+
+
+def flush(conn):
+    """Ghi các bản ghi slow chưa lưu vào slow_query_log (commit riêng); trả về số dòng đã ghi."""
+    with _lock:
+        entries = list(_pending)
+        _pending.clear()
+    if not entries:
+        return 0
+    # raw_connection() của SQLAlchemy bọc connection psycopg2 (và che mất conn.info)
+    conn = getattr(conn, "dbapi_connection", None) or conn
+    if conn.closed:
+        print(f"[WARN] Slow query log not saved ({len(entries)} entries): connection closed")
+        return 0
+    if conn.info.transaction_status == psycopg2.extensions.TRANSACTION_STATUS_INERROR:
+        # Job lỗi giữa transaction: transaction đó đã hỏng, bỏ để ghi được log
+        conn.rollback()
+    cur = psycopg2.extensions.cursor(conn)
+    try:
+        cur.execute(DDL)
+        execute_values(cur, """
+            INSERT INTO slow_query_log
+                (captured_at, endpoint, query_id, query, duration_ms, rows, bytes, analyzed, plan_hash, plan)
+            VALUES %s
+        """, [
+            (e["captured_at"], e["endpoint"], e["query_id"], e["query"], e["duration_ms"], e["rows"],
+             e["bytes"], e["analyzed"], e["plan_hash"], Json(e["plan"]) if e["plan"] is not None else None)
+            for e in entries
+        ])
+        cur.execute("DELETE FROM slow_query_log WHERE captured_at < NOW() - make_interval(days => %s)",
+                    (QUERY_LOG_RETENTION_DAYS,))
+        conn.commit()
+    except psycopg2.Error as e:
+        conn.rollback()
+        print(f"[WARN] Slow query log not saved ({len(entries)} entries): {str(e).strip()}")
+        return 0
+    finally:
+        cur.close()
+    return len(entries)
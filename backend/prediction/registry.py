@@ -0,0 +1,178 @@
+"""
+Model registry cục bộ cho Prediction Service.
+
+Cấu trúc thư mục (MODEL_REGISTRY_DIR, mặc định <LAMBDA_TASK_ROOT>/models):
+
+    models/
+      20251129T093700Z/
+        solar_mlp.keras
+        scaler.pkl
+        manifest.json   # version, created_at, sha256 từng file, feature_order, horizon_hours
+
+Version là timestamp UTC nên sort theo chuỗi = sort theo thời gian; version mới nhất
+được chọn ở mỗi lần gọi load() (chỉ là một lần listdir), nên publish version mới vào
+thư mục (ví dụ EFS mount) là Lambda dùng ngay mà không cần build lại image.
+Các version đã load được giữ trong LRU cache (MODEL_CACHE_SIZE).
+Đặt MODEL_VERSION để ghim một version cụ thể (rollback).
+"""
+import hashlib
+import json
+import os
+import shutil
+from collections import OrderedDict, namedtuple
+from datetime import datetime, timezone
+
+import telemetry
+
+BASE_DIR = os.environ.get('LAMBDA_TASK_ROOT', '')
+REGISTRY_DIR = os.getenv("MODEL_REGISTRY_DIR", os.path.join(BASE_DIR, 'models'))
+PINNED_VERSION = os.getenv("MODEL_VERSION")
+CACHE_SIZE = int(os.getenv("MODEL_CACHE_SIZE", 2))
+
+MODEL_FILE = "solar_mlp.keras"
+SCALER_FILE = "scaler.pkl"
+MANIFEST_FILE = "manifest.json"
+
+# Thứ tự feature lúc train: [Norm, Trend, Seasonal, Hour, Day, Lag1, Lag24]
+DEFAULT_FEATURE_ORDER = [
+    "solar_normalized", "solar_trend", "solar_seasonal",
+    "hour", "day_of_week", "solar_mw_lag1", "solar_mw_lag24",
+]
+
+ModelBundle = namedtuple("ModelBundle", ["version", "model", "scaler", "feature_order", "horizon_hours", "manifest"])
+
+_cache = OrderedDict()  # version -> ModelBundle
+
+
+class RegistryError(Exception):
+    pass
+
+
+def sha256_file(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def list_versions(registry_dir=None):
+    """Các version hợp lệ (có manifest), cũ -> mới."""
+    registry_dir = registry_dir or REGISTRY_DIR
+    try:
+        names = os.listdir(registry_dir)
+    except FileNotFoundError:
+        return []
+    return sorted(
+        n for n in names
+        if not n.startswith(".") and os.path.isfile(os.path.join(registry_dir, n, MANIFEST_FILE))
+    )
+
+
+def latest_version(registry_dir=None):
+    if PINNED_VERSION:
+        return PINNED_VERSION
+    versions = list_versions(registry_dir)
+    return versions[-1] if versions else None
+
+
+def read_manifest(version, registry_dir=None):
+    path = os.path.join(registry_dir or REGISTRY_DIR, version, MANIFEST_FILE)
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        raise RegistryError(f"Version '{version}' not found in registry ({path})")
+
+
+def _verify(version_dir, manifest):
+    for name, expected in manifest.get("files", {}).items():
+        actual = sha256_file(os.path.join(version_dir, name))
+        if actual != expected:
+            raise RegistryError(f"Checksum mismatch for {name}: {actual} != {expected}")
+
+
+def load(version=None, registry_dir=None):
+    """
+    Trả về ModelBundle của `version` (mặc định: mới nhất).
+    Load từ đĩa + verify checksum chỉ khi version chưa có trong LRU cache.
+    """
+    registry_dir = registry_dir or REGISTRY_DIR
+    version = version or latest_version(registry_dir)
+    if version is None:
+        raise RegistryError(f"No model version found in {registry_dir}")
+
+    if version in _cache:
+        _cache.move_to_end(version)
+        return _cache[version]
+
+    version_dir = os.path.join(registry_dir, version)
+    manifest = read_manifest(version, registry_dir)
+    print(f"⏳ Loading model version {version}...")
+    with telemetry.span("model_load", version=version):
+        _verify(version_dir, manifest)
+        # Import muộn: TensorFlow chỉ cần khi thực sự predict/train
+        import joblib
+        import tensorflow as tf
+        model = tf.keras.models.load_model(os.path.join(version_dir, manifest.get("model_file", MODEL_FILE)))
+        scaler_file = manifest.get("scaler_file", SCALER_FILE)
+        scaler = joblib.load(os.path.join(version_dir, scaler_file)) if scaler_file else None
+
+    bundle = ModelBundle(
+        version=version,
+        model=model,
+        scaler=scaler,
+        feature_order=manifest.get("feature_order", DEFAULT_FEATURE_ORDER),
+        horizon_hours=int(manifest.get("horizon_hours", 24)),
+        manifest=manifest,
+    )
+    _cache[version] = bundle
+    while len(_cache) > max(CACHE_SIZE, 1):
+        evicted, _ = _cache.popitem(last=False)
+        print(f"[REGISTRY] Evicted model version {evicted} from cache.")
+    print(f"✅ Model version {version} loaded.")
+    return bundle
+
+
+def new_version_id(now=None):
+    return (now or datetime.now(timezone.utc)).strftime("%Y%m%dT%H%M%SZ")
+
+
+def publish(model, scaler, feature_order=None, horizon_hours=24, metadata=None, registry_dir=None, version=None):
+    """
+    Ghi một version mới vào registry: lưu artifact vào thư mục tạm, tính checksum,
+    ghi manifest rồi rename (atomic) để reader không bao giờ thấy version dở dang.
+    """
+    import joblib
+
+    registry_dir = registry_dir or REGISTRY_DIR
+    version = version or new_version_id()
+    final_dir = os.path.join(registry_dir, version)
+    tmp_dir = os.path.join(registry_dir, f".{version}.tmp")
+    if os.path.exists(final_dir):
+        raise RegistryError(f"Version '{version}' already exists")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    model.save(os.path.join(tmp_dir, MODEL_FILE))
+    files = [MODEL_FILE]
+    if scaler is not None:
+        joblib.dump(scaler, os.path.join(tmp_dir, SCALER_FILE))
+        files.append(SCALER_FILE)
+
+    manifest = {
+        "version": version,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "model_file": MODEL_FILE,
+        "scaler_file": SCALER_FILE if scaler is not None else None,
+        "feature_order": list(feature_order or DEFAULT_FEATURE_ORDER),
+        "horizon_hours": horizon_hours,
+        "files": {name: sha256_file(os.path.join(tmp_dir, name)) for name in files},
+        "metadata": metadata or {},
+    }
+    with open(os.path.join(tmp_dir, MANIFEST_FILE), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    os.rename(tmp_dir, final_dir)
+    print(f"✅ Published model version {version} to {registry_dir}")
+    return version
@@ -0,0 +1,236 @@
+"""
+Train lại solar_mlp từ electricity_analysis_results (CPU), warm-start từ version mới nhất.
+
+- Đọc bằng server-side cursor theo từng đoạn TRAIN_CHUNK_ROWS dòng, không load cả bảng.
+  Mỗi epoch đọc lại luồng dữ liệu nên bộ nhớ chỉ phụ thuộc kích thước đoạn.
+- Feature giống app.prepare_features nhưng vectorized cho cả đoạn: lag1/lag24 bằng dịch
+  mảng, hour/day_of_week bằng số học datetime64; target = solar_mw của 24 giờ kế tiếp
+  (sliding_window_view). 48 dòng cuối của đoạn trước được mang sang đoạn sau để dòng
+  đầu đoạn vẫn có lag24 và dòng cuối đoạn có đủ 24 giờ target.
+- Warm-start: tiếp tục train từ weights của registry.load() và giữ nguyên scaler của
+  version đó (weights được học trên không gian đã scale bằng scaler này). Khi train từ
+  đầu (chưa có version hoặc --fresh) scaler được fit bằng partial_fit qua một lượt đọc.
+- Kết quả được publish thành version mới trong registry (model + scaler + manifest);
+  báo cáo samples/sec và peak RSS qua telemetry.
+
+    python train.py --epochs 3
+    python train.py --fresh --since 2025-01-01 --dry-run
+"""
+import argparse
+import os
+import resource
+import time
+
+import numpy as np
+
+import registry
+import telemetry
+
+TRAIN_CHUNK_ROWS = int(os.getenv("TRAIN_CHUNK_ROWS", 5000))
+TRAIN_EPOCHS = int(os.getenv("TRAIN_EPOCHS", 2))
+TRAIN_BATCH_SIZE = int(os.getenv("TRAIN_BATCH_SIZE", 256))
+TRAIN_LEARNING_RATE = float(os.getenv("TRAIN_LEARNING_RATE", 1e-4))
+
+HORIZON = 24
+LAG = 24
+# Dòng mang sang đoạn sau: LAG dòng cho lag24 + HORIZON dòng chưa có đủ target
+CARRY_ROWS = LAG + HORIZON
+
+SOURCE_COLUMNS = ["solar_mw", "solar_trend", "solar_seasonal", "solar_normalized"]
+
+
+def stream_chunks(conn, since=None, chunk_rows=None):
+    """Yield (times datetime64[us], values float64 (n, 4)) theo thứ tự thời gian."""
+    chunk_rows = chunk_rows or TRAIN_CHUNK_ROWS
+    where = "WHERE datetime >= %s" if since else ""
+    with conn.cursor(name="train_stream") as cur:
+        cur.itersize = chunk_rows
+        cur.execute(f"""
+            SELECT datetime, {', '.join(SOURCE_COLUMNS)}
+            FROM electricity_analysis_results
+            {where}
+            ORDER BY datetime
+        """, (since,) if since else None)
+        while True:
+            with telemetry.span("read_sql", table="electricity_analysis_results"):
+                rows = cur.fetchmany(chunk_rows)
+            if not rows:
+                break
+            telemetry.incr("rows_in", len(rows), table="electricity_analysis_results")
+            times = np.array([r[0] for r in rows], dtype="datetime64[us]")
+            values = np.array([r[1:] for r in rows], dtype=np.float64)  # None -> nan
+            yield times, values
+    conn.commit()
+
+
+def build_samples(times, values, feature_order):
+    """
+    Feature/target cho mọi dòng i có đủ lag24 (i >= LAG) và đủ 24 giờ target
+    (i + HORIZON < n). Trả về (X (m, n_features), y (m, 24), sample_times); bỏ dòng có NaN.
+    """
+    n = len(times)
+    if n <= CARRY_ROWS:
+        return np.empty((0, len(feature_order))), np.empty((0, HORIZON)), times[:0]
+    solar = values[:, 0]
+    rows = np.arange(LAG, n - HORIZON)
+
+    hours = times.astype("datetime64[h]").astype(np.int64)
+    days = times.astype("datetime64[D]").astype(np.int64)
+    columns = {
+        "solar_mw": solar,
+        "solar_trend": values[:, 1],
+        "solar_seasonal": values[:, 2],
+        "solar_normalized": values[:, 3],
+        "hour": hours % 24,
+        # 1970-01-01 là thứ Năm -> +3 để khớp datetime.weekday() (Thứ Hai = 0)
+        "day_of_week": (days + 3) % 7,
+        "solar_mw_lag1": np.concatenate([[np.nan], solar[:-1]]),
+        "solar_mw_lag24": np.concatenate([np.full(LAG, np.nan), solar[:-LAG]]),
+    }
+    X = np.column_stack([columns[name][rows] for name in feature_order]).astype(np.float64)
+    # Cửa sổ [i+1, i+24] của solar cho từng dòng i
+    y = np.lib.stride_tricks.sliding_window_view(solar, HORIZON)[rows + 1]
+
+    valid = ~(np.isnan(X).any(axis=1) | np.isnan(y).any(axis=1))
+    return X[valid], y[valid], times[rows][valid]
+
+
+def stream_samples(conn, feature_order, since=None, chunk_rows=None):
+    """Yield (X, y, sample_times) theo đoạn, mang CARRY_ROWS dòng cuối sang đoạn kế tiếp."""
+    carry_times = np.empty(0, dtype="datetime64[us]")
+    carry_values = np.empty((0, len(SOURCE_COLUMNS)))
+    for times, values in stream_chunks(conn, since, chunk_rows):
+        times = np.concatenate([carry_times, times])
+        values = np.concatenate([carry_values, values])
+        X, y, sample_times = build_samples(times, values, feature_order)
+        carry_times, carry_values = times[-CARRY_ROWS:], values[-CARRY_ROWS:]
+        if len(X):
+            yield X, y, sample_times
+
+
+def build_model(n_features, horizon=HORIZON):
+    import tensorflow as tf
+
+    model = tf.keras.Sequential([
+        tf.keras.layers.Input(shape=(n_features,)),
+        tf.keras.layers.Dense(64, activation="relu"),
+        tf.keras.layers.Dense(32, activation="relu"),
+        tf.keras.layers.Dense(horizon),
+    ])
+    return model
+
+
+def fit_scaler(conn, feature_order, since=None, chunk_rows=None):
+    """StandardScaler.partial_fit qua một lượt đọc (không giữ toàn bộ feature trong RAM)."""
+    from sklearn.preprocessing import StandardScaler
+
+    scaler = StandardScaler()
+    with telemetry.span("fit_scaler"):
+        for X, _, _ in stream_samples(conn, feature_order, since, chunk_rows):
+            scaler.partial_fit(X)
+    return scaler if hasattr(scaler, "mean_") else None
+
+
+def report_peak_rss(job):
+    """Đặt gauge peak_rss_mb (ru_maxrss của process, Linux trả về KB)."""
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    telemetry.set_gauge("peak_rss_mb", round(peak_mb, 1), job=job)
+    print(f"[MEM] {job}: peak RSS {peak_mb:.1f} MB")
+    return peak_mb
+
+
+def run_training_job(conn, epochs=None, since=None, fresh=False, chunk_rows=None,
+                     batch_size=None, learning_rate=None, dry_run=False, registry_dir=None):
+    """
+    Train (warm-start nếu có version) và publish version mới. Trả về dict thống kê
+    (version=None khi dry_run hoặc không có sample nào).
+    """
+    import tensorflow as tf
+
+    epochs = epochs or TRAIN_EPOCHS
+    batch_size = batch_size or TRAIN_BATCH_SIZE
+    learning_rate = learning_rate or TRAIN_LEARNING_RATE
+
+    parent = None
+    if not fresh:
+        try:
+            parent = registry.load(registry_dir=registry_dir)
+        except registry.RegistryError as e:
+            print(f"[WARN] No model to warm-start from ({e}), training from scratch.")
+
+    if parent is not None:
+        feature_order = list(parent.feature_order)
+        # Không train thẳng trên object trong LRU cache của registry (đang dùng để predict)
+        model = tf.keras.models.clone_model(parent.model)
+        model.set_weights(parent.model.get_weights())
+        scaler = parent.scaler
+        print(f"🔁 Warm-starting from model version {parent.version}")
+    else:
+        feature_order = list(registry.DEFAULT_FEATURE_ORDER)
+        model = build_model(len(feature_order))
+        scaler = fit_scaler(conn, feature_order, since, chunk_rows)
+    model.compile(optimizer=tf.keras.optimizers.Adam(learning_rate=learning_rate), loss="mse")
+
+    stats = {"parent_version": parent.version if parent else None, "epochs": epochs, "samples": 0,
+             "trained_until": None, "loss": None}
+    train_seconds = 0.0
+    for epoch in range(epochs):
+        epoch_samples, weighted_loss = 0, 0.0
+        for X, y, sample_times in stream_samples(conn, feature_order, since, chunk_rows):
+            if scaler is not None:
+                X = scaler.transform(X)
+            started = time.perf_counter()
+            with telemetry.span("train_chunk"):
+                history = model.fit(X, y, batch_size=batch_size, epochs=1, shuffle=True, verbose=0)
+            train_seconds += time.perf_counter() - started
+            epoch_samples += len(X)
+            weighted_loss += history.history["loss"][-1] * len(X)
+            stats["trained_until"] = str(sample_times[-1])
+        if epoch_samples == 0:
+            print("⚠️ No training samples (need > 48 consecutive valid hours).")
+            return dict(stats, version=None)
+        stats["samples"] += epoch_samples
+        stats["loss"] = round(weighted_loss / epoch_samples, 4)
+        print(f"   Epoch {epoch + 1}/{epochs}: {epoch_samples} samples, loss={stats['loss']}")
+
+    samples_per_sec = stats["samples"] / train_seconds if train_seconds else 0.0
+    stats["samples_per_sec"] = round(samples_per_sec, 1)
+    stats["peak_rss_mb"] = round(report_peak_rss("training"), 1)
+    telemetry.incr("train_samples", stats["samples"])
+    telemetry.set_gauge("train_samples_per_sec", stats["samples_per_sec"])
+    telemetry.set_gauge("train_loss", stats["loss"])
+    print(f"📈 Trained on {stats['samples']} samples at {samples_per_sec:.0f} samples/sec.")
+
+    if dry_run:
+        return dict(stats, version=None)
+    version = registry.publish(model, scaler, feature_order=feature_order, horizon_hours=HORIZON,
+                               metadata=stats, registry_dir=registry_dir)
+    return dict(stats, version=version)
+
+
+def main():
+    from app import get_db_connection
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--epochs", type=int, default=None)
+    parser.add_argument("--since", help="Chỉ train trên dữ liệu từ ngày này (YYYY-MM-DD)")
+    parser.add_argument("--fresh", action="store_true", help="Không warm-start, fit lại scaler")
+    parser.add_argument("--chunk-rows", type=int, default=None)
+    parser.add_argument("--batch-size", type=int, default=None)
+    parser.add_argument("--learning-rate", type=float, default=None)
+    parser.add_argument("--registry-dir", default=None)
+    parser.add_argument("--dry-run", action="store_true", help="Train nhưng không publish version")
+    args = parser.parse_args()
+
+    conn = get_db_connection()
+    try:
+        result = run_training_job(conn, args.epochs, args.since, args.fresh, args.chunk_rows,
+                                  args.batch_size, args.learning_rate, args.dry_run, args.registry_dir)
+    finally:
+        conn.close()
+    print(result)
+    return 0 if result.get("samples") else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
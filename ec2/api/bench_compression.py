@@ -0,0 +1,162 @@
+"""
+Benchmark kích thước + thời gian response trước/sau CompressionMiddleware.
+
+Offline (mặc định): payload giả lập đúng dạng range=month (720 giờ) của /measurements,
+/analysis và /clustering, phục vụ qua một app FastAPI nhỏ:
+  - baseline: không middleware (JSON thô như trước),
+  - miss: middleware, lần đầu của version (serialize + nén),
+  - hit: middleware, cùng version (bytes đã nén trong cache).
+
+Online (--url): gọi API đang chạy với từng Accept-Encoding, đo bytes trên dây và thời gian.
+
+    python bench_compression.py
+    python bench_compression.py --url http://localhost:8000 --repeat 5
+"""
+import argparse
+import json
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+
+from compression import CompressionMiddleware, brotli, compress
+
+HOURS = 30 * 24
+SOURCES = ["solar", "wind", "gas", "hydro", "unknown", "biomass", "nuclear", "geothermal"]
+COMPONENTS = ["trend", "seasonal", "residual", "normalized"]
+
+
+def _hours(now):
+    start = now - timedelta(hours=HOURS)
+    return [(start + timedelta(hours=i)) for i in range(HOURS)]
+
+
+def _mw(rng, base, spread):
+    return round(max(0.0, rng.gauss(base, spread)), 3)
+
+
+def synthetic_payloads(seed=0):
+    """Payload dạng response thật (cùng key, số chữ số, ISO datetime) cho range=month."""
+    rng = random.Random(seed)
+    times = _hours(datetime(2025, 6, 1))
+    measurements = [
+        {
+            "datetime": t.isoformat(), "zone": "US-CAL-LDWP",
+            "solar_mw": _mw(rng, 600, 300), "wind_mw": _mw(rng, 150, 60), "gas_mw": _mw(rng, 2200, 400),
+            "hydro_mw": _mw(rng, 300, 80), "unknown_mw": _mw(rng, 500, 120),
+        }
+        for t in times
+    ]
+    analysis = []
+    for t in times:
+        row = {"datetime": t.isoformat()}
+        for s in SOURCES:
+            value = _mw(rng, 400, 200)
+            row[f"{s}_mw"] = value
+            for c in COMPONENTS:
+                row[f"{s}_{c}"] = round(rng.gauss(0, 50), 6)
+        analysis.append(row)
+    clustering = [
+        {
+            "datetime": t.isoformat(), "solar_mw": _mw(rng, 600, 300), "wind_mw": _mw(rng, 150, 60),
+            "gas_mw": _mw(rng, 2200, 400), "carbon_intensity": _mw(rng, 320, 40),
+            "cluster_id": rng.randrange(4),
+        }
+        for t in times
+    ]
+    envelope = {"success": True, "range": "month", "delta": False, "watermark": times[-1].isoformat()}
+    return {
+        "/measurements": dict(envelope, count=len(measurements), data=measurements),
+        "/analysis": dict(envelope, sources=SOURCES, count=len(analysis), data=analysis),
+        "/clustering": dict(envelope, count=len(clustering), data=clustering),
+    }
+
+
+def codec_table(payloads, repeat):
+    """Kích thước và thời gian nén thuần cho từng payload / encoding."""
+    encodings = ["gzip"] + (["br"] if brotli is not None else [])
+    print(f"{'path':<14}{'raw KB':>9}" + "".join(f"{e + ' KB':>10}{e + ' ms':>9}" for e in encodings))
+    for path, payload in payloads.items():
+        # Cùng dạng JSON gọn như response của FastAPI
+        body = json.dumps(payload, separators=(",", ":")).encode()
+        line = f"{path:<14}{len(body) / 1024:>9.1f}"
+        for e in encodings:
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                out = compress(body, e)
+                timings.append(time.perf_counter() - started)
+            line += f"{len(out) / 1024:>10.1f}{min(timings) * 1000:>9.2f}"
+        print(line)
+
+
+def offline(repeat):
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+
+    payloads = synthetic_payloads()
+    codec_table(payloads, repeat)
+
+    def make_app(with_middleware):
+        app = FastAPI()
+        for path, payload in payloads.items():
+            app.add_api_route(path, lambda payload=payload: payload, methods=["GET"])
+        if with_middleware:
+            app.add_middleware(CompressionMiddleware, routes={p: ["bench"] for p in payloads},
+                               version=lambda tables: "v1")
+        return app
+
+    baseline = TestClient(make_app(False))
+    encoding = "br" if brotli is not None else "gzip"
+    print(f"\n{'path':<14}{'baseline':>22}{'miss (' + encoding + ')':>24}{'hit (' + encoding + ')':>24}")
+    for path in payloads:
+        cached = TestClient(make_app(True))
+        rows = []
+        for client, headers, runs in (
+            (baseline, {"Accept-Encoding": "identity"}, repeat),
+            (cached, {"Accept-Encoding": encoding}, 1),
+            (cached, {"Accept-Encoding": encoding}, repeat),
+        ):
+            timings, size = [], 0
+            for _ in range(runs):
+                # TestClient đã giải nén body -> bytes trên dây lấy từ Content-Length
+                started = time.perf_counter()
+                response = client.get(path, headers=headers)
+                timings.append(time.perf_counter() - started)
+                size = int(response.headers["content-length"])
+            rows.append(f"{size / 1024:>9.1f} KB {statistics.median(timings) * 1000:>7.2f} ms")
+        print(f"{path:<14}" + "".join(f"{r:>24}" for r in rows))
+
+
+def online(url, repeat):
+    import requests
+
+    encodings = ["identity", "gzip"] + (["br"] if brotli is not None else [])
+    for path in ("/measurements?range=month", "/analysis?range=month", "/clustering?range=month"):
+        line = f"{path:<28}"
+        for e in encodings:
+            timings, size = [], 0
+            for _ in range(repeat):
+                started = time.perf_counter()
+                response = requests.get(url.rstrip("/") + path, headers={"Accept-Encoding": e}, stream=True)
+                raw = response.raw.read(decode_content=False)
+                timings.append(time.perf_counter() - started)
+                size = len(raw)
+            line += f"{e:>10}: {size / 1024:>8.1f} KB {statistics.median(timings) * 1000:>7.1f} ms"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="API đang chạy; bỏ trống -> benchmark offline với payload giả lập")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    if args.url:
+        online(args.url, args.repeat)
+    else:
+        offline(args.repeat)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
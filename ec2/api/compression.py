@@ -0,0 +1,273 @@
+"""
+Nén response (brotli/gzip theo Accept-Encoding) + cache response đã nén theo version dữ liệu.
+
+- Mọi response đủ lớn (>= minimum_size) được nén khi client chấp nhận; br chỉ khi có
+  package brotli. Luôn kèm Vary: Accept-Encoding.
+- Route trong `routes` (path -> các bảng nguồn) là cacheable. Endpoint ghi lại nguồn thực sự
+  của response bằng record_source() ("snapshot" + version snapshot); không ghi gì = đọc DB.
+  Entry được version theo đúng nguồn đó: `version(tables, "db")` (MAX(updated_at) của các
+  bảng, một query rẻ trên index, lấy trước khi chạy endpoint) hoặc version snapshot đã phục
+  vụ. Cache giữ một entry / (path, query string): body gốc + từng bản nén đã tạo. Version
+  của nguồn chưa đổi -> trả thẳng bytes đã nén (không query payload, không serialize, không
+  nén lại); version khác hoặc quá `max_age` giây (range tương đối như "30 ngày qua" trượt
+  theo thời gian) -> chạy endpoint và thay entry.
+- Response cacheable có ETag theo version: If-None-Match khớp entry còn hợp lệ -> 304 không body.
+- Bộ nhớ giới hạn bởi `max_bytes` (LRU theo tổng bytes mọi bản). Cache theo process.
+- Body từ `threadpool_min_size` bytes trở lên được nén trong threadpool (brotli/gzip vài MB
+  mất hàng chục ms CPU) để không chặn event loop.
+
+Là ASGI middleware thuần (không qua BaseHTTPMiddleware) và phải nằm trong CORSMiddleware
+để response lấy từ cache vẫn có header CORS.
+"""
+import gzip
+import hashlib
+import time
+from collections import OrderedDict
+from contextvars import ContextVar
+
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders
+
+import telemetry
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Không nén lại các kiểu đã nén sẵn
+COMPRESSIBLE_TYPES = ("application/json", "text/")
+
+# Nguồn của response đang xử lý: list dùng chung (không set lại) nên endpoint chạy trong task
+# con (vd sau BaseHTTPMiddleware) vẫn ghi được vào list của middleware
+_sources = ContextVar("response_sources", default=None)
+
+
+def record_source(source, version=None):
+    """Endpoint báo response lấy từ đâu: ("snapshot", version snapshot) | ("db", None)."""
+    holder = _sources.get()
+    if holder is not None:
+        holder.append((source, version))
+
+
+def negotiate(accept_encoding):
+    """Encoding tốt nhất client chấp nhận: 'br' | 'gzip' | 'identity' (theo q, hoà -> br)."""
+    weights = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        name = name.strip().lower()
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[name] = q
+    star = weights.get("*", 0.0)
+    candidates = (["br"] if brotli is not None else []) + ["gzip"]
+    best, best_q = "identity", 0.0
+    for name in candidates:
+        q = weights.get(name, star)
+        if q > best_q:
+            best, best_q = name, q
+    return best
+
+
+def compress(body, encoding, gzip_level=6, brotli_quality=5):
+    if encoding == "br":
+        return brotli.compress(body, quality=brotli_quality)
+    if encoding == "gzip":
+        # mtime=0: cùng body -> cùng bytes
+        return gzip.compress(body, compresslevel=gzip_level, mtime=0)
+    return body
+
+
+class CacheEntry:
+    def __init__(self, source, version, status, headers, body, etag):
+        self.source = source
+        self.version = version
+        self.status = status
+        self.headers = headers
+        self.variants = {"identity": body}
+        self.etag = etag
+        self.stored_at = time.monotonic()
+
+    @property
+    def size(self):
+        return sum(len(v) for v in self.variants.values())
+
+
+class ResponseCache:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key, entry):
+        self.discard(key)
+        if entry.size > self.max_bytes:
+            return
+        self._entries[key] = entry
+        self.size += entry.size
+        self._evict()
+
+    def add_variant(self, key, entry, encoding, body):
+        previous = entry.variants.get(encoding)
+        entry.variants[encoding] = body
+        # Entry không được giữ (quá lớn khi put) hoặc đã bị evict/thay trong lúc nén -> không tính
+        if self._entries.get(key) is not entry:
+            return
+        # Hai request cùng nén một encoding: bản sau thay bản trước
+        self.size += len(body) - (len(previous) if previous is not None else 0)
+        self._evict()
+
+    def discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry.size
+
+    def _evict(self):
+        while self.size > self.max_bytes and self._entries:
+            _, entry = self._entries.popitem(last=False)
+            self.size -= entry.size
+            telemetry.incr("response_cache", result="evicted")
+        telemetry.set_gauge("response_cache_bytes", self.size)
+
+
+def _etag(path, query, version):
+    digest = hashlib.sha1(repr((path, query, version)).encode()).hexdigest()[:20]
+    return f'"{digest}"'
+
+
+class CompressionMiddleware:
+    def __init__(self, app, routes=None, version=None, max_age=300.0, max_bytes=64 * 1024 * 1024,
+                 minimum_size=1024, gzip_level=6, brotli_quality=5, threadpool_min_size=256 * 1024):
+        """
+        routes: {path: [bảng]} cacheable; version(tables, source) -> giá trị hashable hoặc None
+        (không cache) cho source "db" | "snapshot", chạy trong threadpool vì có thể query DB.
+        """
+        self.app = app
+        self.routes = routes or {}
+        self.version = version
+        self.max_age = max_age
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.threadpool_min_size = threadpool_min_size
+        self.cache = ResponseCache(max_bytes)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        request_headers = Headers(scope=scope)
+        encoding = negotiate(request_headers.get("accept-encoding", ""))
+        path = scope["path"]
+
+        key = db_version = sources = None
+        tables = self.routes.get(path) if scope["method"] == "GET" and self.version else None
+        if tables:
+            # Query string chuẩn hoá để ?a=1&b=2 và ?b=2&a=1 dùng chung entry
+            query = "&".join(sorted(scope.get("query_string", b"").decode("latin-1").split("&")))
+            key = (path, query)
+            entry = self.cache.get(key)
+            if entry is not None and time.monotonic() - entry.stored_at < self.max_age:
+                if await self._current_version(tables, entry.source) == entry.version:
+                    if entry.etag in request_headers.get("if-none-match", ""):
+                        telemetry.incr("response_cache", result="not_modified")
+                        await self._send(send, 304, [(b"etag", entry.etag.encode())], b"")
+                        return
+                    telemetry.incr("response_cache", result="hit")
+                    await self._send_entry(send, key, entry, encoding)
+                    return
+            telemetry.incr("response_cache", result="miss")
+            # Lấy trước khi đọc: ghi xảy ra trong lúc đọc chỉ làm entry bị coi là cũ, không bị che
+            db_version = await self._current_version(tables, "db")
+            sources = []
+
+        start = {}
+        chunks = []
+
+        async def capture(message):
+            if message["type"] == "http.response.start":
+                start.update(message)
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+
+        token = _sources.set(sources)
+        try:
+            await self.app(scope, receive, capture)
+        finally:
+            _sources.reset(token)
+        body = b"".join(chunks)
+        headers = MutableHeaders(raw=list(start.get("headers", [])))
+        status = start.get("status", 500)
+
+        compressible = (
+            len(body) >= self.minimum_size
+            and "content-encoding" not in headers
+            and headers.get("content-type", "").startswith(COMPRESSIBLE_TYPES)
+        )
+        source, version = self._response_version(sources, db_version)
+        if status == 200 and version is not None and compressible:
+            del headers["content-length"]
+            entry = CacheEntry(source, version, status, headers.raw, body, _etag(path, query, version))
+            self.cache.put(key, entry)
+            await self._send_entry(send, key, entry, encoding)
+            return
+        if compressible and encoding != "identity":
+            body = await self._compress(body, encoding)
+            headers["content-encoding"] = encoding
+            headers.add_vary_header("Accept-Encoding")
+        headers["content-length"] = str(len(body))
+        await self._send(send, status, headers.raw, body)
+
+    async def _current_version(self, tables, source):
+        try:
+            return await run_in_threadpool(self.version, tables, source)
+        except Exception as e:
+            print(f"[WARN] Response cache version check failed: {e}")
+            return None
+
+    @staticmethod
+    def _response_version(sources, db_version):
+        """(source, version) của response vừa chạy: snapshot chỉ khi mọi phần đều từ snapshot."""
+        if sources and all(source == "snapshot" for source, _ in sources):
+            return "snapshot", ("snapshot",) + tuple(version for _, version in sources)
+        return "db", db_version
+
+    async def _compress(self, body, encoding):
+        with telemetry.span("response_compress", encoding=encoding):
+            if len(body) >= self.threadpool_min_size:
+                compressed = await run_in_threadpool(compress, body, encoding, self.gzip_level, self.brotli_quality)
+            else:
+                compressed = compress(body, encoding, self.gzip_level, self.brotli_quality)
+        telemetry.incr("response_bytes", len(body), stage="raw")
+        telemetry.incr("response_bytes", len(compressed), stage=encoding)
+        return compressed
+
+    async def _send_entry(self, send, key, entry, encoding):
+        body = entry.variants.get(encoding)
+        if body is None:
+            # Nén lần đầu cho encoding này, các request sau cùng version dùng lại
+            body = await self._compress(entry.variants["identity"], encoding)
+            self.cache.add_variant(key, entry, encoding, body)
+        headers = MutableHeaders(raw=list(entry.headers))
+        if encoding != "identity":
+            headers["content-encoding"] = encoding
+        headers.add_vary_header("Accept-Encoding")
+        headers["etag"] = entry.etag
+        headers["content-length"] = str(len(body))
+        await self._send(send, entry.status, headers.raw, body)
+
+    @staticmethod
+    async def _send(send, status, raw_headers, body):
+        await send({"type": "http.response.start", "status": status, "headers": raw_headers})
+        await send({"type": "http.response.body", "body": body})
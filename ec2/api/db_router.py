@@ -0,0 +1,163 @@
+"""
+Định tuyến connection đọc: read replica (DB_READ_HOSTS) trước, primary (DB_HOST) sau cùng.
+
+- API chỉ đọc nên mọi query của endpoint GET đi qua đây; ingestion và các job batch vẫn
+  ghi thẳng vào primary.
+- Health check lười: khi chọn replica mà lần kiểm tra trước đã quá `check_interval`
+  giây, một request (không chặn các request khác) mở connection tới replica và đo độ trễ
+  replication. Replica không kết nối được bị loại cho tới lần kiểm tra sau.
+- Độ trễ = now() - pg_last_xact_replay_timestamp(), bằng 0 khi đã replay hết WAL nhận
+  được và WAL receiver đang streaming (primary không có ghi thì timestamp replay đứng yên
+  nhưng replica không hề trễ). Receiver mất kết nối thì replay cũng dừng ở LSN cuối đã nhận
+  -> không biết độ trễ (inf), replica bị bỏ qua. Cột status của pg_stat_wal_receiver chỉ
+  hiện với role pg_monitor / pg_read_all_stats; user khác chỉ thấy pid (process receiver
+  thoát khi mất kết nối) nên dùng pid làm tín hiệu thay thế.
+- Replica trễ quá `max_lag` bị bỏ qua cho mọi read; endpoint nhạy với độ mới
+  (/status/latest) truyền max_lag nhỏ hơn. Không còn replica phù hợp -> primary.
+- Các replica hợp lệ được chọn xoay vòng.
+
+Trạng thái được đưa lên /metrics: gauge replica_healthy, replica_lag_seconds và counter
+db_route (target=replica|primary).
+"""
+import itertools
+import threading
+import time
+
+import psycopg2
+
+import telemetry
+
+LAG_SQL = """
+    SELECT pg_is_in_recovery(),
+        CASE
+            WHEN NOT pg_is_in_recovery() THEN 0
+            WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN
+                CASE WHEN EXISTS (
+                    SELECT 1 FROM pg_stat_wal_receiver WHERE COALESCE(status = 'streaming', pid IS NOT NULL)
+                ) THEN 0 END
+            ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+        END
+"""
+
+
+def parse_hosts(value, default_port=5432):
+    """'host1,host2:5433' -> [('host1', 5432), ('host2', 5433)]"""
+    hosts = []
+    for item in (value or "").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        host, _, port = item.partition(":")
+        hosts.append((host, int(port) if port else default_port))
+    return hosts
+
+
+class Replica:
+    def __init__(self, config):
+        self.config = config
+        self.name = f"{config['host']}:{config['port']}"
+        self.healthy = True
+        self.lag = None
+        self.checked_at = 0.0
+        self.error = None
+        self.lock = threading.Lock()
+
+
+class ReadRouter:
+    def __init__(self, primary, replica_hosts=(), max_lag=300.0, check_interval=10.0, connect_timeout=2,
+                 connection_factory=None):
+        """
+        primary: kwargs của psycopg2.connect; replica dùng cùng database/user/password.
+        connection_factory: class connection cho các connection đọc trả về (không dùng cho health check).
+        """
+        self.primary = primary
+        self.replicas = [Replica(dict(primary, host=host, port=port)) for host, port in replica_hosts]
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.connect_timeout = connect_timeout
+        self.connect_kwargs = {"connection_factory": connection_factory} if connection_factory else {}
+        self._rotation = itertools.count()
+
+    def check(self, replica):
+        """Kết nối thử và đo độ trễ replication của replica."""
+        try:
+            conn = psycopg2.connect(**replica.config, connect_timeout=self.connect_timeout)
+            try:
+                with conn.cursor() as cur:
+                    cur.execute(LAG_SQL)
+                    _, lag = cur.fetchone()
+            finally:
+                conn.close()
+            replica.healthy, replica.error = True, None
+            # NULL: replica chưa replay transaction nào hoặc đã replay hết nhưng receiver
+            # không streaming (bị cắt khỏi primary) -> không biết độ trễ
+            replica.lag = float(lag) if lag is not None else float("inf")
+        except psycopg2.Error as e:
+            if replica.healthy:
+                print(f"[WARN] Read replica {replica.name} unavailable: {str(e).strip()}")
+            replica.healthy, replica.error = False, str(e).strip()
+        replica.checked_at = time.monotonic()
+        telemetry.set_gauge("replica_healthy", int(replica.healthy), host=replica.name)
+        if replica.lag is not None and replica.lag != float("inf"):
+            telemetry.set_gauge("replica_lag_seconds", round(replica.lag, 3), host=replica.name)
+
+    def _refresh(self, replica):
+        if time.monotonic() - replica.checked_at < self.check_interval:
+            return
+        # Chỉ một request kiểm tra; các request khác dùng kết quả lần trước
+        if replica.lock.acquire(blocking=False):
+            try:
+                self.check(replica)
+            finally:
+                replica.lock.release()
+
+    def targets(self, max_lag=None):
+        """Danh sách config để thử theo thứ tự: các replica hợp lệ (xoay vòng), rồi primary."""
+        limit = self.max_lag if max_lag is None else min(max_lag, self.max_lag)
+        usable = []
+        for replica in self.replicas:
+            self._refresh(replica)
+            if replica.healthy and replica.lag is not None and replica.lag <= limit:
+                usable.append(replica)
+        if usable:
+            start = next(self._rotation) % len(usable)
+            usable = usable[start:] + usable[:start]
+        return [r.config for r in usable] + [self.primary]
+
+    def is_primary(self, config):
+        return config is self.primary
+
+    def mark_down(self, config, error):
+        """Replica lỗi giữa chừng (connect/query) -> loại cho tới lần kiểm tra kế tiếp."""
+        for replica in self.replicas:
+            if replica.config is config:
+                replica.healthy, replica.error = False, str(error).strip()
+                replica.checked_at = time.monotonic()
+                telemetry.set_gauge("replica_healthy", 0, host=replica.name)
+                print(f"[WARN] Read replica {replica.name} marked down: {replica.error}")
+
+    def connect(self, max_lag=None):
+        """Connection đọc; replica không kết nối được -> thử target kế tiếp, cuối cùng là primary."""
+        for config in self.targets(max_lag):
+            if self.is_primary(config):
+                break
+            try:
+                conn = psycopg2.connect(**config, connect_timeout=self.connect_timeout, **self.connect_kwargs)
+            except psycopg2.OperationalError as e:
+                self.mark_down(config, e)
+                continue
+            telemetry.incr("db_route", target="replica")
+            return conn, config
+        telemetry.incr("db_route", target="primary")
+        return psycopg2.connect(**self.primary, **self.connect_kwargs), self.primary
+
+    def status(self):
+        return [
+            {
+                "host": r.name,
+                "healthy": r.healthy,
+                "lag_seconds": None if r.lag is None or r.lag == float("inf") else round(r.lag, 3),
+                "error": r.error,
+            }
+            for r in self.replicas
+        ]
@@ -1,16 +1,31 @@
 import os
+import hmac
 import json
+import time
+import asyncio
+import threading
+from contextlib import contextmanager
 import boto3
-from fastapi import FastAPI, Query, HTTPException, Body
+from fastapi import FastAPI, Query, HTTPException, Body, Header, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
+from starlette.concurrency import run_in_threadpool
 import psycopg2
 from psycopg2.extras import RealDictCursor
-from datetime import datetime, timedelta
+from psycopg2.pool import PoolError, ThreadedConnectionPool
+from datetime import datetime, timedelta, timezone
 from typing import Optional, List, Dict, Any
 from dotenv import load_dotenv
 import numpy as np
 from pydantic import BaseModel
 from sqlalchemy import create_engine, text
+import telemetry
+import querylog
+import completeness
+from singleflight import SingleFlight
+from db_router import ReadRouter, parse_hosts
+from compression import CompressionMiddleware, record_source
+from snapshots import SnapshotStore
 
 load_dotenv()
 
@@ -20,6 +35,39 @@ app = FastAPI(
     version="2.0.0"
 )
 
+# --- NÉN + CACHE RESPONSE ---
+# Route cacheable -> bảng nguồn; version = MAX(updated_at) của các bảng (xem data_version)
+CACHEABLE_ROUTES = {
+    "/measurements": ["electricity_measurements"],
+    "/analysis": ["electricity_analysis_results"],
+    "/analysis/distribution": ["electricity_measurements"],
+    "/analysis/correlations": ["electricity_measurements"],
+    "/analysis/trend": ["electricity_measurements"],
+    "/analysis/seasonal": ["electricity_measurements"],
+    "/clustering": ["cluster_profiles", "electricity_measurements"],
+    "/clustering/profiles": ["cluster_profiles", "electricity_measurements"],
+}
+RESPONSE_CACHE_SECONDS = float(os.getenv("RESPONSE_CACHE_SECONDS", "300"))
+RESPONSE_CACHE_MAX_MB = float(os.getenv("RESPONSE_CACHE_MAX_MB", "64"))
+RESPONSE_COMPRESS_MIN_BYTES = int(os.getenv("RESPONSE_COMPRESS_MIN_BYTES", "1024"))
+RESPONSE_GZIP_LEVEL = int(os.getenv("RESPONSE_GZIP_LEVEL", "6"))
+RESPONSE_BROTLI_QUALITY = int(os.getenv("RESPONSE_BROTLI_QUALITY", "5"))
+# Body lớn hơn ngưỡng này được nén trong threadpool thay vì trên event loop
+RESPONSE_COMPRESS_THREADPOOL_BYTES = int(os.getenv("RESPONSE_COMPRESS_THREADPOOL_BYTES", str(256 * 1024)))
+
+# Thêm trước CORS -> nằm trong CORS: response lấy từ cache vẫn có header CORS
+app.add_middleware(
+    CompressionMiddleware,
+    routes=CACHEABLE_ROUTES,
+    version=lambda tables, source: data_version(tables, source),
+    max_age=RESPONSE_CACHE_SECONDS,
+    max_bytes=int(RESPONSE_CACHE_MAX_MB * 1024 * 1024),
+    minimum_size=RESPONSE_COMPRESS_MIN_BYTES,
+    gzip_level=RESPONSE_GZIP_LEVEL,
+    brotli_quality=RESPONSE_BROTLI_QUALITY,
+    threadpool_min_size=RESPONSE_COMPRESS_THREADPOOL_BYTES,
+)
+
 # --- CẤU HÌNH CORS ---
 app.add_middleware(
     CORSMiddleware,
@@ -29,6 +77,24 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# --- INSTRUMENTATION ---
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """Đo latency và đếm request theo route template (không theo URL thô để tránh bùng nổ label)."""
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        # Response từ cache nén không đi qua router -> dùng path (route cacheable không có tham số path)
+        fallback = request.url.path if request.url.path in CACHEABLE_ROUTES else "unmatched"
+        path = getattr(route, "path", fallback)
+        telemetry.observe("http_request", time.perf_counter() - start, method=request.method, path=path)
+        telemetry.incr("http_requests", method=request.method, path=path, status=status)
+
 # --- CẤU HÌNH DB ---
 DB_CONFIG = {
     "host": os.getenv("DB_HOST", "localhost"),
@@ -38,6 +104,48 @@ DB_CONFIG = {
     "password": os.getenv("DB_PASS", "112acc"),
 }
 
+# Pool cho /dashboard: mỗi section chạy song song trên 1 connection
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+# Pool đã dùng hết -> chờ tối đa bấy nhiêu giây rồi mới báo lỗi (503)
+DB_POOL_WAIT_SECONDS = float(os.getenv("DB_POOL_WAIT_SECONDS", "10"))
+
+# Read replica (host[:port], phân tách bằng dấu phẩy; cùng DB_NAME/DB_USER/DB_PASS với primary).
+# Mọi read của API đi qua replica khoẻ, trễ không quá DB_REPLICA_MAX_LAG_SECONDS; không có -> primary.
+DB_READ_HOSTS = parse_hosts(os.getenv("DB_READ_HOSTS", ""), DB_CONFIG["port"])
+DB_REPLICA_MAX_LAG_SECONDS = float(os.getenv("DB_REPLICA_MAX_LAG_SECONDS", "300"))
+DB_REPLICA_CHECK_SECONDS = float(os.getenv("DB_REPLICA_CHECK_SECONDS", "10"))
+DB_CONNECT_TIMEOUT = int(os.getenv("DB_CONNECT_TIMEOUT", "2"))
+# Endpoint nhạy với độ mới chỉ dùng replica trễ ít hơn ngưỡng này
+STATUS_MAX_LAG_SECONDS = float(os.getenv("STATUS_MAX_LAG_SECONDS", "5"))
+
+db_router = ReadRouter(DB_CONFIG, DB_READ_HOSTS, max_lag=DB_REPLICA_MAX_LAG_SECONDS,
+                       check_interval=DB_REPLICA_CHECK_SECONDS, connect_timeout=DB_CONNECT_TIMEOUT,
+                       connection_factory=querylog.LoggedConnection)
+
+# Query chậm (xem querylog.py) được ghi vào slow_query_log trên primary mỗi QUERY_LOG_FLUSH_SECONDS
+QUERY_LOG_FLUSH_SECONDS = float(os.getenv("QUERY_LOG_FLUSH_SECONDS", "60"))
+# /admin/* cần header X-Admin-Token khớp giá trị này; rỗng -> /admin/* bị tắt (403)
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+# Snapshot do job analysis/clustering publish (thư mục local/EFS hoặc s3://); rỗng -> luôn đọc DB
+SNAPSHOT_URI = os.getenv("SNAPSHOT_URI", "")
+SNAPSHOT_CACHE_DIR = os.getenv("SNAPSHOT_CACHE_DIR", "/tmp/snapshots")
+SNAPSHOT_MAX_AGE_SECONDS = float(os.getenv("SNAPSHOT_MAX_AGE_SECONDS", "7200"))
+SNAPSHOT_POLL_SECONDS = float(os.getenv("SNAPSHOT_POLL_SECONDS", "5"))
+
+# Watermark trả cho client không vượt quá (giờ DB - khoảng này): updated_at = NOW() là lúc
+# transaction ghi bắt đầu, nên phải lớn hơn transaction ghi dài nhất + DB_REPLICA_MAX_LAG_SECONDS
+WATERMARK_SAFETY_SECONDS = int(os.getenv("WATERMARK_SAFETY_SECONDS", "900"))
+
+snapshot_store = SnapshotStore(SNAPSHOT_URI, SNAPSHOT_CACHE_DIR, max_age=SNAPSHOT_MAX_AGE_SECONDS,
+                               poll_seconds=SNAPSHOT_POLL_SECONDS)
+# Bảng -> dataset snapshot chứa nó (version của snapshot thay cho query MAX(updated_at))
+TABLE_SNAPSHOTS = {"electricity_measurements": "measurements", "electricity_analysis_results": "analysis"}
+
+# Hàm payload -> độ trễ replica tối đa (giây); hàm không có ở đây dùng DB_REPLICA_MAX_LAG_SECONDS
+READ_MAX_LAG_SECONDS = {"latest_status_payload": STATUS_MAX_LAG_SECONDS}
+
 DATABASE_URL = f"postgresql://{DB_CONFIG['user']}:{DB_CONFIG['password']}@{DB_CONFIG['host']}:{DB_CONFIG['port']}/{DB_CONFIG['database']}"
 engine = create_engine(DATABASE_URL)
 
@@ -51,16 +159,185 @@ LAMBDA_MAPPING = {
     "clustering": "clustering-lambda"
 }
 
+# --- COALESCING ---
+# Trigger cùng service + payload trong khoảng này gắn vào lần kích hoạt trước, không chạy job trùng
+TRIGGER_DEBOUNCE_SECONDS = float(os.getenv("TRIGGER_DEBOUNCE_SECONDS", "60"))
+# Các read giống hệt nhau (cùng endpoint + tham số) dùng chung 1 lần query trong khoảng này
+READ_COALESCE_SECONDS = float(os.getenv("READ_COALESCE_SECONDS", "2"))
+
+trigger_flight = SingleFlight("trigger", TRIGGER_DEBOUNCE_SECONDS)
+read_flight = SingleFlight("read", READ_COALESCE_SECONDS)
+
 # --- HELPER FUNCTIONS ---
 
-def get_db_connection():
-    """Tạo kết nối database"""
+def open_read_connection(max_lag=None):
+    """(conn, target) đọc qua db_router: replica nếu có, không thì primary."""
     try:
-        conn = psycopg2.connect(**DB_CONFIG)
-        return conn
+        return db_router.connect(max_lag)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Database connection error: {str(e)}")
 
+def get_db_connection(max_lag=None):
+    """Tạo kết nối database (chỉ đọc: có thể là read replica)"""
+    return open_read_connection(max_lag)[0]
+
+def with_connection(fn, *args):
+    """Chạy fn(conn, *args) trên một connection riêng; lỗi DB -> HTTP 500 như các endpoint trước đây."""
+    conn, target = open_read_connection(READ_MAX_LAG_SECONDS.get(fn.__name__))
+    try:
+        with querylog.tag(fn.__name__):
+            return fn(conn, *args)
+    except HTTPException:
+        raise
+    except psycopg2.OperationalError as e:
+        if db_router.is_primary(target):
+            raise HTTPException(status_code=500, detail=str(e))
+        # Replica rớt giữa chừng: loại nó và đọc lại (replica khác hoặc primary)
+        db_router.mark_down(target, e)
+        return with_connection(fn, *args)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        conn.close()
+
+async def coalesced_read(fn, *args):
+    """with_connection(fn, *args) trong threadpool, gộp với các request đồng thời cùng tham số."""
+    result, _ = await read_flight.do((fn.__name__,) + args, with_connection, fn, *args)
+    return result
+
+def snapshot_view(dataset, view, *args):
+    """view(snapshot, *args) trên snapshot mới nhất của dataset; None nếu không có hoặc không phủ request."""
+    snapshot = snapshot_store.get(dataset)
+    if snapshot is None:
+        return None
+    with telemetry.span("snapshot_view", view=view.__name__):
+        payload = view(snapshot, *args)
+    telemetry.incr("snapshot_reads", view=view.__name__, hit=payload is not None)
+    if payload is not None:
+        # Cache response theo version snapshot này thay vì MAX(updated_at) của DB
+        record_source("snapshot", snapshot.version)
+    return payload
+
+async def snapshot_or_read(dataset, view, fn, *args):
+    """Payload từ snapshot mmap (không chạm DB) nếu được, không thì coalesced_read(fn, *args)."""
+    payload = await run_in_threadpool(snapshot_view, dataset, view, *args)
+    if payload is not None:
+        return payload
+    return await coalesced_read(fn, *args)
+
+class BlockingConnectionPool(ThreadedConnectionPool):
+    """
+    ThreadedConnectionPool ném PoolError ngay khi hết connection; pool này chờ một slot
+    (tối đa `wait` giây) nên nhiều /dashboard đồng thời xếp hàng thay vì hỏng section.
+    """
+
+    def __init__(self, minconn, maxconn, *args, wait=10.0, **kwargs):
+        super().__init__(minconn, maxconn, *args, **kwargs)
+        self.wait = wait
+        self._slots = threading.BoundedSemaphore(maxconn)
+
+    def getconn(self, key=None):
+        started = time.perf_counter()
+        if not self._slots.acquire(timeout=self.wait):
+            telemetry.incr("errors", stage="db_pool_exhausted")
+            raise PoolError(f"connection pool exhausted (waited {self.wait:g}s)")
+        telemetry.observe("db_pool_wait", time.perf_counter() - started)
+        try:
+            return super().getconn(key)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn=None, key=None, close=False):
+        try:
+            super().putconn(conn, key, close)
+        finally:
+            self._slots.release()
+
+_pools = {}
+_pool_lock = threading.Lock()
+
+def get_pool(config=None) -> BlockingConnectionPool:
+    """Connection pool dùng chung cho các query chạy song song, một pool / server (tạo lần đầu khi cần)."""
+    config = config or DB_CONFIG
+    key = (config["host"], config["port"])
+    pool = _pools.get(key)
+    if pool is None:
+        with _pool_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                pool = _pools[key] = BlockingConnectionPool(
+                    DB_POOL_MIN, DB_POOL_MAX, wait=DB_POOL_WAIT_SECONDS, connect_timeout=DB_CONNECT_TIMEOUT,
+                    connection_factory=querylog.LoggedConnection, **config
+                )
+    return pool
+
+@contextmanager
+def pooled_connection(max_lag=None):
+    """
+    Mượn connection từ pool; luôn rollback trước khi trả để không để lại transaction mở.
+    Pool vẫn hết sau DB_POOL_WAIT_SECONDS hoặc primary lỗi kết nối -> HTTP 503 (quá tải /
+    DB không với tới, không phải lỗi của request). Replica lỗi giữa chừng bị loại rồi ném lại
+    OperationalError để caller đọc lại trên target kế tiếp (xem with_pooled_connection).
+    """
+    for target in db_router.targets(max_lag):
+        try:
+            pool = get_pool(target)
+            conn = pool.getconn()
+            break
+        except PoolError as e:
+            raise HTTPException(status_code=503, detail=f"Database busy: {e}")
+        except psycopg2.OperationalError as e:
+            if db_router.is_primary(target):
+                raise HTTPException(status_code=503, detail=f"Database unavailable: {e}")
+            db_router.mark_down(target, e)
+    telemetry.incr("db_route", target="primary" if db_router.is_primary(target) else "replica")
+    try:
+        yield conn
+    except psycopg2.OperationalError as e:
+        if db_router.is_primary(target):
+            raise HTTPException(status_code=503, detail=f"Database unavailable: {e}")
+        db_router.mark_down(target, e)
+        raise
+    finally:
+        try:
+            conn.rollback()
+        except Exception:
+            pass
+        pool.putconn(conn, close=bool(conn.closed))
+
+def with_pooled_connection(fn, *args, max_lag=None):
+    """
+    Chạy fn(conn, *args) trên connection mượn từ pool. Như with_connection: replica rớt giữa
+    chừng bị loại và fn chạy lại trên target kế tiếp (replica khác hoặc primary).
+    """
+    try:
+        with pooled_connection(max_lag) as conn:
+            return fn(conn, *args)
+    except psycopg2.OperationalError:
+        # Lỗi của primary đã thành HTTPException trong pooled_connection: đây là replica
+        return with_pooled_connection(fn, *args, max_lag=max_lag)
+
+def data_version(tables, source="db"):
+    """
+    Version dữ liệu cho cache response theo nguồn của response: "snapshot" -> version snapshot
+    hiện tại của các bảng (không query DB), "db" -> MAX(updated_at) của từng bảng (index, rẻ).
+    None (không cache) khi bảng chưa có, chưa có cột updated_at hoặc không còn snapshot.
+    """
+    if source == "snapshot":
+        snapshot_versions = [snapshot_store.get(TABLE_SNAPSHOTS.get(t, "")) for t in tables]
+        if not all(snapshot_versions):
+            return None
+        return ("snapshot",) + tuple(s.version for s in snapshot_versions)
+    with pooled_connection() as conn, querylog.tag("data_version"):
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT " + ", ".join(f"(SELECT MAX(updated_at) FROM {t})" for t in tables))
+                row = cur.fetchone()
+        except psycopg2.Error:
+            return None
+    return tuple(v.isoformat() if v is not None else None for v in row)
+
 def get_time_range(range_param: str) -> datetime:
     now = datetime.now()
     if range_param == "day": return now - timedelta(days=1)
@@ -68,6 +345,54 @@ def get_time_range(range_param: str) -> datetime:
     elif range_param == "month": return now - timedelta(days=30)
     else: return now - timedelta(days=1)
 
+def parse_since(since: Optional[str]) -> Optional[datetime]:
+    """Watermark `since` (ISO 8601) -> datetime UTC không tz như cột updated_at. Sai định dạng -> 400."""
+    if not since:
+        return None
+    try:
+        value = datetime.fromisoformat(since.replace("Z", "+00:00"))
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid since '{since}', expected ISO 8601 timestamp")
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+_tables_with_updated_at = set()
+
+def has_updated_at(cur, table: str) -> bool:
+    """Bảng đã có cột updated_at chưa (do ingestion/analysis tạo); cache khi đã có."""
+    if table in _tables_with_updated_at:
+        return True
+    cur.execute("""
+        SELECT EXISTS (
+            SELECT FROM information_schema.columns
+            WHERE table_name = %s AND column_name = 'updated_at'
+        )
+    """, (table,))
+    if cur.fetchone()['exists']:
+        _tables_with_updated_at.add(table)
+        return True
+    return False
+
+def pop_watermark(cur, rows, since: Optional[datetime]) -> Optional[str]:
+    """
+    Bỏ updated_at khỏi từng dòng, trả về watermark mới = MAX(updated_at) (hoặc since nếu không
+    có dòng nào), nhưng không vượt quá LOCALTIMESTAMP - WATERMARK_SAFETY_SECONDS: transaction
+    ghi còn đang chạy có thể commit dòng mang updated_at cũ hơn MAX hiện tại. Dòng trong khoảng
+    an toàn được trả lại ở lần gọi sau (client merge theo datetime nên trùng không sao).
+    """
+    latest = since
+    for row in rows:
+        updated_at = row.pop('updated_at', None)
+        if updated_at is not None and (latest is None or updated_at > latest):
+            latest = updated_at
+    if latest is None:
+        return None
+    cur.execute("SELECT LOCALTIMESTAMP - make_interval(secs => %s) AS safe_until", (WATERMARK_SAFETY_SECONDS,))
+    return min(latest, cur.fetchone()['safe_until']).isoformat()
+
+SINCE_DESCRIPTION = "Watermark của lần gọi trước: chỉ trả về dòng được insert/update sau thời điểm này"
+
 def invoke_lambda_service(service_key: str, payload: Dict[str, Any] = {}):
     """
     Hàm dùng chung để kích hoạt AWS Lambda.
@@ -108,12 +433,24 @@ def invoke_lambda_service(service_key: str, payload: Dict[str, Any] = {}):
         print(f"[API Error] Lỗi gọi Lambda: {str(e)}", flush=True)
         raise HTTPException(status_code=500, detail=f"Lỗi kích hoạt Lambda: {str(e)}")
 
+async def trigger_lambda_service(service_key: str, payload: Dict[str, Any]):
+    """
+    invoke_lambda_service qua single-flight: click lặp lại / retry / nhiều user cùng lúc
+    trong TRIGGER_DEBOUNCE_SECONDS nhận lại kết quả của lần kích hoạt đầu (coalesced=True).
+    """
+    key = (service_key, json.dumps(payload, sort_keys=True))
+    result, shared = await trigger_flight.do(key, invoke_lambda_service, service_key, payload)
+    if shared:
+        print(f"[API] Bỏ qua trigger trùng cho {service_key}: job vừa được kích hoạt", flush=True)
+    return {**result, "coalesced": shared}
+
 # --- TRIGGER ENDPOINTS (GỌI LAMBDA) ---
 
 @app.post("/trigger-ingestion")
 async def trigger_ingestion(
     action: str = Body("realtime", embed=True), 
-    start_date: Optional[str] = Body(None, embed=True)
+    start_date: Optional[str] = Body(None, embed=True),
+    continuation_token: Optional[str] = Body(None, embed=True)
 ):
     """
     Kích hoạt Service Ingestion (Thu thập dữ liệu).
@@ -126,22 +463,29 @@ async def trigger_ingestion(
     payload = {"action": action}
     if start_date:
         payload["start_date"] = start_date
-    return invoke_lambda_service("ingestion", payload)
+    if continuation_token:
+        payload["continuation_token"] = continuation_token
+    return await trigger_lambda_service("ingestion", payload)
 
 @app.post("/trigger-analysis")
 async def trigger_analysis():
     """Kích hoạt Service Analysis (Phân tích Trend, Seasonal)"""
-    return invoke_lambda_service("analysis", {"action": "run-now"})
+    return await trigger_lambda_service("analysis", {"action": "run-now"})
 
 @app.post("/trigger-prediction")
 async def trigger_prediction():
     """Kích hoạt Service Prediction (Dự báo AI)"""
-    return invoke_lambda_service("prediction", {"action": "run-now"})
+    return await trigger_lambda_service("prediction", {"action": "run-now"})
 
 @app.post("/trigger-clustering")
 async def trigger_clustering():
     """Kích hoạt Service Clustering (Phân cụm)"""
-    return invoke_lambda_service("clustering", {"action": "run-now"})
+    return await trigger_lambda_service("clustering", {"action": "run-now"})
+
+@app.post("/trigger-evaluation")
+async def trigger_evaluation():
+    """Kích hoạt job đánh giá độ chính xác dự báo (chạy trong Lambda prediction)"""
+    return await trigger_lambda_service("prediction", {"action": "evaluate"})
 
 # Giữ endpoint cũ để tương thích ngược (nếu cần)
 # @app.post("/trigger-clustering")
@@ -154,318 +498,886 @@ async def trigger_clustering():
 @app.get("/")
 async def root():
     """Health check endpoint"""
-    return {"status": "ok", "message": "Electricity Maps LA Analysis API"}
+    return {"status": "ok", "message": "Electricity Maps LA Analysis API", "read_replicas": db_router.status(),
+            "snapshots": snapshot_store.status()}
 
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus scrape endpoint"""
+    return PlainTextResponse(telemetry.render_prometheus(), media_type="text/plain; version=0.0.4")
+
+
+# --- QUERY LOG ---
+def flush_query_log():
+    """Ghi query chậm của process này vào slow_query_log (luôn trên primary: replica chỉ đọc)."""
+    if not querylog.pending_count():
+        return 0
+    pool = get_pool(DB_CONFIG)
+    conn = pool.getconn()
+    try:
+        return querylog.flush(conn)
+    finally:
+        pool.putconn(conn, close=bool(conn.closed))
+
+async def _flush_query_log_forever():
+    while True:
+        await asyncio.sleep(QUERY_LOG_FLUSH_SECONDS)
+        try:
+            await run_in_threadpool(flush_query_log)
+        except Exception as e:
+            print(f"[WARN] Slow query log flush failed: {e}")
+
+@app.on_event("startup")
+async def start_query_log_flush():
+    asyncio.create_task(_flush_query_log_forever())
+
+def slow_query_history(conn, hours, limit, plans):
+    """Query chậm đã lưu (mọi worker API và các job), mới nhất trước; plan_changed so với lần EXPLAIN trước của cùng query."""
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        if not table_exists(cur, "slow_query_log"):
+            return []
+        # LAG trong (query_id, có plan hay không): dòng có plan so với dòng có plan liền trước
+        cur.execute("""
+            SELECT captured_at, endpoint, query_id, query, duration_ms, rows, bytes, analyzed,
+                   plan_hash, previous_plan_hash, plan
+            FROM (
+                SELECT *, LAG(plan_hash) OVER (
+                    PARTITION BY query_id, plan_hash IS NULL ORDER BY captured_at
+                ) AS previous_plan_hash
+                FROM slow_query_log
+            ) log
+            WHERE captured_at >= NOW() - make_interval(hours => %s)
+            ORDER BY captured_at DESC
+            LIMIT %s
+        """, (hours, limit))
+        rows = cur.fetchall()
+    for row in rows:
+        row['captured_at'] = row['captured_at'].isoformat()
+        previous = row.pop('previous_plan_hash')
+        row['plan_changed'] = row['plan_hash'] is not None and previous is not None and previous != row['plan_hash']
+        if row['plan'] is not None:
+            row['summary'] = querylog.summarize_plan(row['plan'])
+            if not plans:
+                row['plan'] = None
+    return rows
+
+@app.get("/admin/queries")
+async def get_query_log(
+    hours: int = Query(24, ge=1, le=24 * 14),
+    limit: int = Query(50, ge=1, le=500),
+    plans: bool = Query(False, description="Trả về plan JSON đầy đủ thay vì chỉ phần tóm tắt"),
+    x_admin_token: Optional[str] = Header(None),
+):
+    """
+    Thống kê query theo endpoint của worker này (latency, rows, bytes), các query chậm gần
+    đây và lịch sử slow_query_log kèm EXPLAIN đã lấy mẫu. Cần header X-Admin-Token = ADMIN_TOKEN;
+    không đặt ADMIN_TOKEN thì luôn 403 (SQL + plan không được lộ qua CORS *).
+    """
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled (ADMIN_TOKEN not set)")
+    if not hmac.compare_digest(x_admin_token or "", ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+    try:
+        history = await run_in_threadpool(with_connection, slow_query_history, hours, limit, plans)
+        history_error = None
+    except HTTPException as e:
+        history, history_error = None, e.detail
+    return {
+        "success": True,
+        "slow_ms": querylog.QUERY_SLOW_MS,
+        "explain_sample": querylog.QUERY_EXPLAIN_SAMPLE,
+        "queries": querylog.stats(limit),
+        "recent": querylog.recent(plans)[:limit],
+        "history": history,
+        "history_error": history_error,
+    }
+
+
+def measurements_payload(conn, range, since=None):
+    """Payload của GET /measurements (sync: endpoint gọi qua with_connection, /dashboard gọi trong threadpool)."""
+    start_time = get_time_range(range)
+    
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        tracked = has_updated_at(cur, "electricity_measurements")
+        delta = since is not None and tracked
+        cur.execute(f"""
+            SELECT 
+                datetime,
+                zone,
+                solar_mw,
+                wind_mw,
+                gas_mw,
+                hydro_mw,
+                unknown_mw,
+                {'updated_at' if tracked else 'NULL AS updated_at'}
+            FROM electricity_measurements
+            WHERE datetime >= %s {'AND updated_at > %s' if delta else ''}
+            ORDER BY datetime ASC
+        """, (start_time, since) if delta else (start_time,))
+        
+        rows = cur.fetchall()
+        watermark = pop_watermark(cur, rows, since)
+        
+        # Chuyển datetime thành ISO string
+        for row in rows:
+            row['datetime'] = row['datetime'].isoformat()
+        
+        return {
+            "success": True,
+            "range": range,
+            "delta": delta,
+            "watermark": watermark,
+            "count": len(rows),
+            "data": rows
+        }
+
 @app.get("/measurements")
-async def get_measurements(range: str = Query("day", enum=["day", "week", "month"])):
+async def get_measurements(
+    range: str = Query("day", enum=["day", "week", "month"]),
+    since: Optional[str] = Query(None, description=SINCE_DESCRIPTION)
+):
     """
     Lấy dữ liệu đo lường từ bảng electricity_measurements
     - range: 'day' (24h), 'week' (7 ngày), 'month' (30 ngày)
+    - since: watermark trả về ở lần gọi trước -> chỉ lấy dòng mới/thay đổi trong range
     """
+    return await snapshot_or_read("measurements", measurements_snapshot_payload, measurements_payload,
+                                  range, parse_since(since))
+
+
+# Nguồn được Analysis Service phân tích -> cột gốc trong electricity_analysis_results.
+# Mỗi nguồn có thêm <nguồn>_trend/_seasonal/_residual/_normalized (layout wide).
+ANALYSIS_SOURCES = {
+    "solar": "solar_mw", "wind": "wind_mw", "gas": "gas_mw", "unknown": "unknown_mw",
+    "hydro": "hydro_mw", "biomass": "biomass_mw", "nuclear": "nuclear_mw",
+    "geothermal": "geothermal_mw", "carbon_intensity": "carbon_intensity",
+}
+ANALYSIS_COMPONENTS = ["trend", "seasonal", "residual", "normalized"]
+
+def analysis_columns(sources: Optional[str]) -> Optional[List[str]]:
+    """'solar,wind' -> danh sách cột (whitelist, không nối chuỗi input vào SQL). None = tất cả."""
+    if not sources:
+        return None
+    names = [name.strip() for name in sources.split(",") if name.strip()]
+    unknown = [name for name in names if name not in ANALYSIS_SOURCES]
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown sources: {', '.join(unknown)}. Allowed: {', '.join(ANALYSIS_SOURCES)}"
+        )
+    columns = []
+    for name in dict.fromkeys(names):
+        columns.append(ANALYSIS_SOURCES[name])
+        columns.extend(f"{name}_{comp}" for comp in ANALYSIS_COMPONENTS)
+    return columns
+
+def analysis_payload(conn, range, sources, since=None):
+    """Payload của GET /analysis (sync: endpoint gọi qua with_connection, /dashboard gọi trong threadpool)."""
     start_time = get_time_range(range)
+    columns = analysis_columns(sources)
     
-    conn = get_db_connection()
-    try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("""
-                SELECT 
-                    datetime,
-                    zone,
-                    solar_mw,
-                    wind_mw,
-                    gas_mw,
-                    hydro_mw,
-                    unknown_mw
-                FROM electricity_measurements
-                WHERE datetime >= %s
-                ORDER BY datetime ASC
-            """, (start_time,))
-            
-            rows = cur.fetchall()
-            
-            # Chuyển datetime thành ISO string
-            for row in rows:
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        tracked = has_updated_at(cur, "electricity_analysis_results")
+        delta = since is not None and tracked
+        if columns:
+            select_list = "datetime, " + ", ".join(columns) + (", updated_at" if tracked else "")
+        else:
+            select_list = "*"
+        cur.execute(f"""
+            SELECT {select_list}
+            FROM electricity_analysis_results
+            WHERE datetime >= %s {'AND updated_at > %s' if delta else ''}
+            ORDER BY datetime ASC
+        """, (start_time, since) if delta else (start_time,))
+        
+        rows = cur.fetchall()
+        watermark = pop_watermark(cur, rows, since)
+        
+        # Chuyển datetime thành ISO string
+        for row in rows:
+            if row.get('datetime'):
                 row['datetime'] = row['datetime'].isoformat()
-            
-            return {
-                "success": True,
-                "range": range,
-                "count": len(rows),
-                "data": rows
-            }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
-
+        
+        return {
+            "success": True,
+            "range": range,
+            "sources": [name.strip() for name in sources.split(",") if name.strip()] if sources else list(ANALYSIS_SOURCES),
+            "delta": delta,
+            "watermark": watermark,
+            "count": len(rows),
+            "data": rows
+        }
 
 @app.get("/analysis")
-async def get_analysis(range: str = Query("day", enum=["day", "week", "month"])):
+async def get_analysis(
+    range: str = Query("day", enum=["day", "week", "month"]),
+    sources: Optional[str] = Query(None, description="Ví dụ: solar,wind,carbon_intensity (mặc định: tất cả)"),
+    since: Optional[str] = Query(None, description=SINCE_DESCRIPTION)
+):
     """
     Lấy kết quả phân tích từ bảng electricity_analysis_results
-    - Bao gồm: trend, seasonal, normalized data
+    - Bao gồm: trend, seasonal, residual, normalized data cho từng nguồn
+    - sources: chỉ lấy các nguồn cần thiết (ít cột -> payload nhỏ hơn)
+    - since: chỉ lấy các giờ có kết quả thay đổi sau watermark
     """
+    return await snapshot_or_read("analysis", analysis_snapshot_payload, analysis_payload,
+                                  range, sources, parse_since(since))
+
+# --- DISTRIBUTION (histogram + percentile tính trong Postgres) ---
+DISTRIBUTION_SOURCES = dict(ANALYSIS_SOURCES, load=None)  # load = tổng mọi nguồn MW
+DEFAULT_DISTRIBUTION_SOURCES = "load"
+DISTRIBUTION_PERCENTILES = [0.05, 0.25, 0.5, 0.75, 0.95]
+MAX_DISTRIBUTION_BINS = 200
+# Histogram chỉ đổi khi có giờ mới -> cache theo (range, bins, sources, min, max)
+DISTRIBUTION_CACHE_SECONDS = float(os.getenv("DISTRIBUTION_CACHE_SECONDS", "300"))
+distribution_flight = SingleFlight("distribution", DISTRIBUTION_CACHE_SECONDS)
+
+def _histogram(row, bins):
+    """Dòng stats + buckets của SQL -> edges (bins + 1), counts (bins), below/above, percentile."""
+    if row is None:
+        return {"count": 0, "edges": [], "counts": [], "percentiles": {}}
+    lo, hi = row['lo'], row['hi']
+    buckets = {int(k): v for k, v in row['buckets'].items()}
+    width = (hi - lo) / bins if hi > lo else 0
+    return {
+        "count": row['count'],
+        "mean": row['mean'],
+        "min": row['min'],
+        "max": row['max'],
+        "percentiles": {f"p{round(q * 100)}": v for q, v in zip(DISTRIBUTION_PERCENTILES, row['percentiles'])},
+        "edges": [lo + i * width for i in range(bins + 1)],
+        "counts": [buckets.get(i, 0) for i in range(1, bins + 1)],
+        "below": buckets.get(0, 0),
+        "above": buckets.get(bins + 1, 0),
+    }
+
+def distribution_payload(conn, range, bins=20, sources=DEFAULT_DISTRIBUTION_SOURCES, lower=None, upper=None):
+    """
+    Payload của GET /analysis/distribution: mỗi nguồn 1 histogram `bins` cột + percentile.
+    Unpivot bằng LATERAL VALUES, đếm bằng width_bucket -> trả về ~bins số / nguồn dù range dài bao nhiêu.
+    lower/upper: biên cố định (None -> min/max của dữ liệu); giá trị ngoài biên đếm vào below/above.
+    Chỉ một biên và nó nằm ngoài dữ liệu (vd min >= max dữ liệu) -> khoảng rỗng tại biên đó:
+    các cột đều 0, mọi giá trị nằm trong below/above.
+    """
+    names = [name.strip() for name in sources.split(",") if name.strip()] or [DEFAULT_DISTRIBUTION_SOURCES]
+    unknown = [name for name in names if name not in DISTRIBUTION_SOURCES]
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown sources: {', '.join(unknown)}. Allowed: {', '.join(DISTRIBUTION_SOURCES)}"
+        )
+    if not 1 <= bins <= MAX_DISTRIBUTION_BINS:
+        raise HTTPException(status_code=400, detail=f"bins must be between 1 and {MAX_DISTRIBUTION_BINS}")
+    if lower is not None and upper is not None and lower >= upper:
+        raise HTTPException(status_code=400, detail="min must be smaller than max")
+    names = list(dict.fromkeys(names))
     start_time = get_time_range(range)
-    
-    conn = get_db_connection()
-    try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("""
-                SELECT *
-                FROM electricity_analysis_results
-                WHERE datetime >= %s
-                ORDER BY datetime ASC
-            """, (start_time,))
-            
-            rows = cur.fetchall()
-            
-            # Chuyển datetime thành ISO string
-            for row in rows:
-                if row.get('datetime'):
-                    row['datetime'] = row['datetime'].isoformat()
-            
+
+    total_sql = " + ".join(f"COALESCE(m.{c}, 0)" for c in POWER_COLUMNS)
+    values_sql = ", ".join(
+        f"('{name}', {f'm.{column}' if column else f'({total_sql})'})"
+        for name, column in DISTRIBUTION_SOURCES.items() if name in names
+    )
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(f"""
+            WITH v AS (
+                SELECT s.source, s.value::float8 AS value
+                FROM electricity_measurements m
+                CROSS JOIN LATERAL (VALUES {values_sql}) AS s(source, value)
+                WHERE m.datetime >= %(start)s AND s.value IS NOT NULL
+            ),
+            stats AS (
+                SELECT source,
+                    COUNT(*) AS count, AVG(value) AS mean, MIN(value) AS min, MAX(value) AS max,
+                    -- Biên còn lại kẹp theo biên cố định để lo <= hi (LEAST/GREATEST bỏ qua NULL)
+                    COALESCE(%(lower)s, LEAST(MIN(value), %(upper)s)) AS lo,
+                    COALESCE(%(upper)s, GREATEST(MAX(value), %(lower)s)) AS hi,
+                    percentile_cont(%(percentiles)s::float8[]) WITHIN GROUP (ORDER BY value) AS percentiles
+                FROM v
+                GROUP BY source
+            ),
+            hist AS (
+                -- width_bucket: 0 = dưới lo, bins+1 = từ hi trở lên; giá trị đúng bằng hi tính vào cột cuối.
+                -- lo = hi (dữ liệu hằng số, hoặc biên cố định ngoài dữ liệu): đúng bằng biên -> cột 1
+                SELECT v.source,
+                    CASE WHEN s.hi <= s.lo THEN
+                            CASE WHEN v.value < s.lo THEN 0 WHEN v.value > s.hi THEN %(bins)s + 1 ELSE 1 END
+                         WHEN v.value = s.hi THEN %(bins)s
+                         ELSE width_bucket(v.value, s.lo, s.hi, %(bins)s) END AS bucket,
+                    COUNT(*) AS n
+                FROM v JOIN stats s USING (source)
+                GROUP BY 1, 2
+            )
+            SELECT s.*, COALESCE(
+                (SELECT json_object_agg(h.bucket, h.n) FROM hist h WHERE h.source = s.source), '{{}}'
+            ) AS buckets
+            FROM stats s
+        """, {"start": start_time, "lower": lower, "upper": upper, "bins": bins,
+              "percentiles": DISTRIBUTION_PERCENTILES})
+        rows = {row['source']: row for row in cur.fetchall()}
+
+    return {
+        "success": True,
+        "range": range,
+        "bins": bins,
+        "sources": {name: _histogram(rows.get(name), bins) for name in names},
+    }
+
+@app.get("/analysis/distribution")
+async def get_distribution(
+    range: str = Query("day", enum=["day", "week", "month"]),
+    bins: int = Query(20, ge=1, le=MAX_DISTRIBUTION_BINS),
+    sources: str = Query(DEFAULT_DISTRIBUTION_SOURCES, description="Ví dụ: load,solar,wind (load = tổng mọi nguồn)"),
+    min: Optional[float] = Query(None, description="Biên dưới của histogram (mặc định: min dữ liệu)"),
+    max: Optional[float] = Query(None, description="Biên trên của histogram (mặc định: max dữ liệu)")
+):
+    """
+    Phân phối giá trị theo nguồn (histogram + p5/p25/p50/p75/p95), tính trên server
+    thay vì tải toàn bộ /measurements về trình duyệt. Kết quả cache DISTRIBUTION_CACHE_SECONDS.
+    """
+    args = (range, bins, sources, min, max)
+    result, _ = await distribution_flight.do(("distribution",) + args, with_connection, distribution_payload, *args)
+    return result
+
+def predictions_payload(conn):
+    """Payload của GET /predictions (sync: endpoint gọi qua with_connection, /dashboard gọi trong threadpool)."""
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        # 1. Kiểm tra bảng 'solar_predictions' có tồn tại không
+        cur.execute("""
+            SELECT EXISTS (
+                SELECT FROM information_schema.tables 
+                WHERE table_name = 'solar_predictions'
+            )
+        """)
+        table_exists = cur.fetchone()['exists']
+        
+        if not table_exists:
             return {
                 "success": True,
-                "range": range,
-                "count": len(rows),
-                "data": rows
+                "message": "Predictions table (solar_predictions) not yet created",
+                "data": []
             }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
+        
+        # 2. Query dữ liệu
+        cur.execute("""
+            SELECT id, prediction_time, target_time, predicted_solar_mw, cluster_id,created_at
+            FROM solar_predictions
+            WHERE target_time >= NOW()
+            ORDER BY target_time ASC
+            LIMIT 24
+        """)
+        
+        rows = cur.fetchall()
+        
+        # 3. Format lại ngày giờ sang dạng chuỗi ISO để trả về JSON không bị lỗi
+        for row in rows:
+            if row.get('target_time'):
+                row['target_time'] = row['target_time'].isoformat()
+            if row.get('prediction_time'):
+                row['prediction_time'] = row['prediction_time'].isoformat()
+            if row.get('created_at'):
+                row['created_at'] = row['created_at'].isoformat()
+        
+        return {
+            "success": True,
+            "count": len(rows),
+            "data": rows
+        }
 
 @app.get("/predictions")
 async def get_predictions():
     """
     Lấy dự đoán solar cho 24h tới từ bảng solar_predictions
     """
-    conn = get_db_connection()
-    try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            # 1. Kiểm tra bảng 'solar_predictions' có tồn tại không
-            cur.execute("""
-                SELECT EXISTS (
-                    SELECT FROM information_schema.tables 
-                    WHERE table_name = 'solar_predictions'
-                )
-            """)
-            table_exists = cur.fetchone()['exists']
-            
-            if not table_exists:
-                return {
-                    "success": True,
-                    "message": "Predictions table (solar_predictions) not yet created",
-                    "data": []
-                }
-            
-            # 2. Query dữ liệu
-            cur.execute("""
-                SELECT id, prediction_time, target_time, predicted_solar_mw, cluster_id,created_at
-                FROM solar_predictions
-                WHERE target_time >= NOW()
-                ORDER BY target_time ASC
-                LIMIT 24
-            """)
-            
-            rows = cur.fetchall()
-            
-            # 3. Format lại ngày giờ sang dạng chuỗi ISO để trả về JSON không bị lỗi
-            for row in rows:
-                if row.get('target_time'):
-                    row['target_time'] = row['target_time'].isoformat()
-                if row.get('prediction_time'):
-                    row['prediction_time'] = row['prediction_time'].isoformat()
-                if row.get('created_at'):
-                    row['created_at'] = row['created_at'].isoformat()
-            
+    return await coalesced_read(predictions_payload)
+
+
+def prediction_accuracy_payload(conn, group_by="horizon", days=30, model_version=None):
+    """
+    Payload của GET /predictions/accuracy: độ chính xác dự báo từ bảng forecast_accuracy_metrics
+    (do job evaluate ghi). MAE, RMSE, bias (predicted - actual) tính từ các tổng cộng dồn.
+    """
+    group_columns = {"horizon": "horizon_h", "day": "day", "model_version": "model_version"}
+    key = group_columns[group_by]
+
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        if not table_exists(cur, "forecast_accuracy_metrics"):
             return {
                 "success": True,
-                "count": len(rows),
-                "data": rows
+                "message": "Accuracy table (forecast_accuracy_metrics) not yet created",
+                "data": []
             }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
 
+        cur.execute(f"""
+            SELECT 
+                {key} AS key,
+                SUM(n) AS n,
+                SUM(sum_abs_error) / SUM(n) AS mae,
+                SQRT(SUM(sum_sq_error) / SUM(n)) AS rmse,
+                SUM(sum_error) / SUM(n) AS bias
+            FROM forecast_accuracy_metrics
+            WHERE day >= CURRENT_DATE - %s
+                AND (%s::text IS NULL OR model_version = %s)
+            GROUP BY {key}
+            ORDER BY {key} ASC
+        """, (days, model_version, model_version))
+        rows = cur.fetchall()
 
-@app.get("/status/latest")
-async def get_latest_status():
+    data = []
+    for row in rows:
+        k = row['key']
+        data.append({
+            group_by: k.isoformat() if hasattr(k, 'isoformat') else k,
+            "n": int(row['n']),
+            "mae": round(row['mae'], 3),
+            "rmse": round(row['rmse'], 3),
+            "bias": round(row['bias'], 3)
+        })
+
+    return {
+        "success": True,
+        "group_by": group_by,
+        "days": days,
+        "count": len(data),
+        "data": data
+    }
+
+@app.get("/predictions/accuracy")
+async def get_prediction_accuracy(
+    group_by: str = Query("horizon", enum=["horizon", "day", "model_version"]),
+    days: int = Query(30, ge=1, le=365),
+    model_version: Optional[str] = None
+):
     """
-    Lấy trạng thái mới nhất.
-    Ưu tiên lấy cluster_id trực tiếp từ bản ghi đo lường mới nhất trong electricity_measurements.
+    Độ chính xác dự báo từ bảng forecast_accuracy_metrics (do job evaluate ghi).
+    - group_by: 'horizon' (1-24h), 'day' hoặc 'model_version'
+    - MAE, RMSE, bias (predicted - actual) tính từ các tổng cộng dồn
     """
-    conn = get_db_connection()
-    try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            # Lấy measurement mới nhất
+    return await coalesced_read(prediction_accuracy_payload, group_by, days, model_version)
+
+
+# Tổng tải = mọi nguồn (khớp grid_status_snapshot.total_mw và frontend)
+POWER_COLUMNS = ['solar_mw', 'wind_mw', 'gas_mw', 'unknown_mw', 'hydro_mw', 'biomass_mw', 'nuclear_mw', 'geothermal_mw']
+DEFAULT_ZONE = os.getenv("ZONE", "US-CAL-LDWP")
+
+_existing_tables = set()
+
+def table_exists(cur, table: str) -> bool:
+    """to_regclass(table) IS NOT NULL; chỉ cache kết quả dương (bảng có thể được tạo sau)."""
+    if table in _existing_tables:
+        return True
+    cur.execute("SELECT to_regclass(%s) IS NOT NULL AS exists", (table,))
+    if cur.fetchone()['exists']:
+        _existing_tables.add(table)
+        return True
+    return False
+
+def cluster_labels(cur, source_table: str) -> Dict[int, str]:
+    """
+    Map cluster_id -> tên cụm do Clustering Service ghi vào cluster_profiles cùng transaction
+    với cluster_id (k và tên luôn khớp nhãn trong DB, kể cả khi payload thiếu cụm); {} nếu chưa có.
+    """
+    if not table_exists(cur, "cluster_profiles"):
+        return {}
+    cur.execute("""
+        SELECT cluster_id, cluster_label FROM cluster_profiles
+        WHERE source_table = %s
+        ORDER BY cluster_id
+    """, (source_table,))
+    return {row['cluster_id']: row['cluster_label'] for row in cur.fetchall()}
+
+def latest_status_payload(conn, zone=DEFAULT_ZONE):
+    """Payload của GET /status/latest (sync: endpoint gọi qua with_connection, /dashboard gọi trong threadpool)."""
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        # 1. Snapshot do ingestion/clustering duy trì: đọc 1 dòng theo primary key
+        snapshot = None
+        if table_exists(cur, "grid_status_snapshot"):
             cur.execute("""
-                SELECT *
-                FROM electricity_measurements
-                ORDER BY datetime DESC
-                LIMIT 1
-            """)
-            latest_measurement = cur.fetchone()
-            
-            # Xử lý datetime
-            if latest_measurement and latest_measurement.get('datetime'):
-                latest_measurement['datetime'] = latest_measurement['datetime'].isoformat()
-            
-            # Tính tổng công suất
-            total_mw = 0
-            current_cluster_id = None
-
-            if latest_measurement:
-                # Tính tổng load
-                for key in ['solar_mw', 'wind_mw', 'gas_mw', 'hydro_mw', 'unknown_mw']:
-                    if latest_measurement.get(key):
-                        total_mw += latest_measurement[key]
-                
-                # Lấy cluster_id trực tiếp từ measurement
-                # Nếu là -1 (chưa phân cụm) hoặc None thì trả về None
-                cid = latest_measurement.get('cluster_id')
-                if cid is not None and cid != -1:
-                    current_cluster_id = cid
-            
+                SELECT *,
+                    EXTRACT(EPOCH FROM (NOW() AT TIME ZONE 'UTC') - measured_at) AS age_seconds
+                FROM grid_status_snapshot
+                WHERE zone = %s
+            """, (zone,))
+            snapshot = cur.fetchone()
+
+        if snapshot:
+            latest_measurement = {"datetime": snapshot['measured_at'].isoformat(), "zone": snapshot['zone'],
+                                  "carbon_intensity": snapshot['carbon_intensity'],
+                                  "cluster_id": snapshot['cluster_id']}
+            latest_measurement.update({key: snapshot[key] for key in POWER_COLUMNS})
             return {
                 "success": True,
+                "source": "snapshot",
                 "latest_measurement": latest_measurement,
-                "total_power_mw": total_mw,
-                "current_cluster_id": current_cluster_id, # Trả về field này rõ ràng cho frontend
+                "total_power_mw": snapshot['total_mw'] or 0,
+                "delta_1h_mw": snapshot['delta_1h_mw'],
+                "delta_24h_mw": snapshot['delta_24h_mw'],
+                "current_cluster_id": snapshot['cluster_id'],
+                "current_cluster_label": snapshot['cluster_label'],
+                "age_seconds": round(float(snapshot['age_seconds']), 1),
+                "refreshed_at": snapshot['refreshed_at'].isoformat() if snapshot['refreshed_at'] else None,
                 "timestamp": datetime.now().isoformat()
             }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
 
-@app.get("/analysis/correlations")
-async def get_correlations():
+        # 2. Fallback (chưa có snapshot): đọc measurement mới nhất như trước
+        cur.execute("""
+            SELECT *
+            FROM electricity_measurements
+            ORDER BY datetime DESC
+            LIMIT 1
+        """)
+        latest_measurement = cur.fetchone()
+        
+        # Tính tổng công suất
+        total_mw = 0
+        current_cluster_id = None
+        age_seconds = None
+
+        if latest_measurement:
+            age_seconds = round((datetime.utcnow() - latest_measurement['datetime']).total_seconds(), 1)
+            latest_measurement['datetime'] = latest_measurement['datetime'].isoformat()
+
+            # Tính tổng load trên mọi nguồn
+            total_mw = sum(latest_measurement.get(key) or 0 for key in POWER_COLUMNS)
+            
+            # Lấy cluster_id trực tiếp từ measurement
+            # Nếu là -1 (chưa phân cụm) hoặc None thì trả về None
+            cid = latest_measurement.get('cluster_id')
+            if cid is not None and cid != -1:
+                current_cluster_id = cid
+        
+        return {
+            "success": True,
+            "source": "measurements",
+            "latest_measurement": latest_measurement,
+            "total_power_mw": total_mw,
+            "current_cluster_id": current_cluster_id, # Trả về field này rõ ràng cho frontend
+            "age_seconds": age_seconds,
+            "timestamp": datetime.now().isoformat()
+        }
+
+@app.get("/status/latest")
+async def get_latest_status(zone: str = Query(DEFAULT_ZONE)):
     """
-    Tính ma trận tương quan giữa các nguồn năng lượng
+    Lấy trạng thái mới nhất.
+    Đọc 1 dòng từ grid_status_snapshot (tổng tải, chênh lệch 1h/24h, cụm, độ trễ dữ liệu);
+    chưa có snapshot thì tính từ bản ghi đo lường mới nhất trong electricity_measurements.
     """
-    conn = get_db_connection()
-    try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            # Lấy dữ liệu 7 ngày gần nhất để tính correlation
-            cur.execute("""
-                SELECT 
-                    COALESCE(solar_mw, 0) as solar_mw,
-                    COALESCE(wind_mw, 0) as wind_mw,
-                    COALESCE(gas_mw, 0) as gas_mw,
-                    COALESCE(hydro_mw, 0) as hydro_mw
-                FROM electricity_measurements
-                WHERE datetime >= NOW() - INTERVAL '7 days'
-                ORDER BY datetime ASC
-            """)
-            
-            rows = cur.fetchall()
-            
-            if len(rows) < 10:
-                return {
-                    "success": True,
-                    "message": "Not enough data for correlation (need at least 10 records)",
-                    "correlations": None,
-                    "data_points": len(rows)
-                }
-            
-            # Tính correlation bằng Python
-            columns = ['solar_mw', 'wind_mw', 'gas_mw', 'hydro_mw']
-            data = {col: [] for col in columns}
-            
-            for row in rows:
-                for col in columns:
-                    val = row.get(col)
-                    data[col].append(float(val) if val is not None else 0.0)
-            
-            # Tạo matrix và tính correlation
-            matrix = np.array([data[col] for col in columns], dtype=np.float64)
-            
-            # Tính correlation với xử lý NaN/Inf
-            with np.errstate(divide='ignore', invalid='ignore'):
-                correlation_matrix = np.corrcoef(matrix)
-            
-            # Thay NaN và Inf bằng 0
-            correlation_matrix = np.nan_to_num(correlation_matrix, nan=0.0, posinf=0.0, neginf=0.0)
-            
-            # Chuyển thành dict
-            correlations = {}
-            for i, col1 in enumerate(columns):
-                correlations[col1] = {}
-                for j, col2 in enumerate(columns):
-                    val = correlation_matrix[i][j]
-                    # Đảm bảo giá trị là số hợp lệ
-                    if np.isnan(val) or np.isinf(val):
-                        correlations[col1][col2] = 0.0
-                    else:
-                        correlations[col1][col2] = round(float(val), 4)
-            
+    return await coalesced_read(latest_status_payload, zone)
+
+def data_completeness_payload(conn, range="month", zone=DEFAULT_ZONE):
+    """
+    Payload của GET /status/completeness: bao nhiêu giờ thiếu / toàn 0 (những giờ này bị
+    interpolate trong Analysis) và các khoảng thiếu liên tiếp. SQL dùng chung với ingestion
+    (completeness.py) nên "giờ thiếu" ở đây khớp với những giờ backfill sẽ lấy lại.
+    """
+    now = datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+    end = now - timedelta(hours=1)
+    hours = {"day": 24, "week": 24 * 7, "month": 24 * 30}[range]
+    start = end - timedelta(hours=hours - 1)
+    params = {"start": start, "end": end, "zone": zone}
+
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(completeness.COMPLETENESS_SQL, params)
+        summary = cur.fetchone()
+        cur.execute(completeness.GAP_RANGES_SQL, params)
+        gaps = cur.fetchall()
+    for gap in gaps:
+        gap['gap_start'] = gap['gap_start'].isoformat()
+        gap['gap_end'] = gap['gap_end'].isoformat()
+
+    expected = summary['expected_hours']
+    usable = summary['present_hours'] - summary['zero_hours']
+    return {
+        "success": True,
+        "range": range,
+        "zone": zone,
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "expected_hours": expected,
+        "present_hours": summary['present_hours'],
+        "missing_hours": expected - summary['present_hours'],
+        "zero_hours": summary['zero_hours'],
+        "completeness_pct": round(100.0 * usable / expected, 2) if expected else 0.0,
+        "gaps": gaps
+    }
+
+@app.get("/status/completeness")
+async def get_data_completeness(
+    range: str = Query("month", enum=["day", "week", "month"]),
+    zone: str = Query("US-CAL-LDWP")
+):
+    """
+    Độ đầy đủ của chuỗi dữ liệu theo giờ: bao nhiêu giờ thiếu / toàn 0
+    (những giờ này bị interpolate trong Analysis) và các khoảng thiếu liên tiếp.
+    """
+    return await coalesced_read(data_completeness_payload, range, zone)
+
+def correlations_payload(conn):
+    """Payload của GET /analysis/correlations (sync: endpoint gọi qua with_connection, /dashboard gọi trong threadpool)."""
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        # Lấy dữ liệu 7 ngày gần nhất để tính correlation
+        cur.execute("""
+            SELECT 
+                COALESCE(solar_mw, 0) as solar_mw,
+                COALESCE(wind_mw, 0) as wind_mw,
+                COALESCE(gas_mw, 0) as gas_mw,
+                COALESCE(hydro_mw, 0) as hydro_mw
+            FROM electricity_measurements
+            WHERE datetime >= NOW() - INTERVAL '7 days'
+            ORDER BY datetime ASC
+        """)
+        
+        rows = cur.fetchall()
+        
+        if len(rows) < 10:
             return {
                 "success": True,
-                "columns": columns,
-                "correlations": correlations,
+                "message": "Not enough data for correlation (need at least 10 records)",
+                "correlations": None,
                 "data_points": len(rows)
             }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
+        
+        # Tính correlation bằng Python
+        columns = ['solar_mw', 'wind_mw', 'gas_mw', 'hydro_mw']
+        data = {col: [] for col in columns}
+        
+        for row in rows:
+            for col in columns:
+                val = row.get(col)
+                data[col].append(float(val) if val is not None else 0.0)
+        
+        # Tạo matrix và tính correlation
+        matrix = np.array([data[col] for col in columns], dtype=np.float64)
+        
+        # Tính correlation với xử lý NaN/Inf
+        with np.errstate(divide='ignore', invalid='ignore'):
+            correlation_matrix = np.corrcoef(matrix)
+        
+        # Thay NaN và Inf bằng 0
+        correlation_matrix = np.nan_to_num(correlation_matrix, nan=0.0, posinf=0.0, neginf=0.0)
+        
+        # Chuyển thành dict
+        correlations = {}
+        for i, col1 in enumerate(columns):
+            correlations[col1] = {}
+            for j, col2 in enumerate(columns):
+                val = correlation_matrix[i][j]
+                # Đảm bảo giá trị là số hợp lệ
+                if np.isnan(val) or np.isinf(val):
+                    correlations[col1][col2] = 0.0
+                else:
+                    correlations[col1][col2] = round(float(val), 4)
+        
+        return {
+            "success": True,
+            "columns": columns,
+            "correlations": correlations,
+            "data_points": len(rows)
+        }
 
-@app.get("/clustering")
-async def get_clustering_results(range: str = Query("week", enum=["day", "week", "month"])):
+@app.get("/analysis/correlations")
+async def get_correlations():
     """
-    Lấy kết quả clustering từ cột cluster_id trong bảng electricity_measurements
+    Tính ma trận tương quan giữa các nguồn năng lượng
     """
+    return await snapshot_or_read("measurements", correlations_snapshot_payload, correlations_payload)
+
+def clustering_payload(conn, range, since=None):
+    """Payload của GET /clustering (sync: endpoint gọi qua with_connection, /dashboard gọi trong threadpool)."""
     start_time = get_time_range(range)
     
-    conn = get_db_connection()
-    try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            # Lấy dữ liệu có cluster_id
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        # Clustering service set updated_at khi cluster_id của dòng thay đổi
+        tracked = has_updated_at(cur, "electricity_measurements")
+        delta = since is not None and tracked
+        # Lấy dữ liệu có cluster_id
+        cur.execute(f"""
+            SELECT 
+                datetime,
+                zone,
+                solar_mw,
+                wind_mw,
+                gas_mw,
+                hydro_mw,
+                unknown_mw,
+                cluster_id,
+                {'updated_at' if tracked else 'NULL AS updated_at'}
+            FROM electricity_measurements
+            WHERE datetime >= %s
+                AND cluster_id IS NOT NULL
+                AND cluster_id != -1
+                {'AND updated_at > %s' if delta else ''}
+            ORDER BY datetime ASC
+        """, (start_time, since) if delta else (start_time,))
+        
+        rows = cur.fetchall()
+        watermark = pop_watermark(cur, rows, since)
+        
+        for row in rows:
+            if row.get('datetime'):
+                row['datetime'] = row['datetime'].isoformat()
+        
+        # Thống kê số lượng mỗi cluster (ở chế độ delta: chỉ của các dòng thay đổi)
+        cluster_stats = {}
+        for row in rows:
+            cid = row.get('cluster_id')
+            if cid is not None:
+                cluster_stats[cid] = cluster_stats.get(cid, 0) + 1
+        
+        return {
+            "success": True,
+            "range": range,
+            "delta": delta,
+            "watermark": watermark,
+            "count": len(rows),
+            "cluster_stats": cluster_stats,
+            "cluster_labels": cluster_labels(cur, "electricity_measurements"),
+            "data": rows
+        }
+
+@app.get("/clustering")
+async def get_clustering_results(
+    range: str = Query("week", enum=["day", "week", "month"]),
+    since: Optional[str] = Query(None, description=SINCE_DESCRIPTION)
+):
+    """
+    Lấy kết quả clustering từ cột cluster_id trong bảng electricity_measurements
+    - since: chỉ lấy các dòng mới hoặc đổi cluster sau watermark
+    """
+    return await snapshot_or_read("measurements", clustering_snapshot_payload, clustering_payload,
+                                  range, parse_since(since))
+
+MAX_CLUSTER_POINTS = 5000
+
+def clustering_profiles_payload(conn, range="week", points=False, max_points=500):
+    """
+    Payload của GET /clustering/profiles: profile từng cụm do Clustering Service ghi sẵn
+    (centroid, mean/std, occupancy theo giờ, count) -> kích thước không phụ thuộc range.
+    points=True: thêm tối đa max_points điểm đã gán nhãn trong range (lấy đều theo thời gian).
+    """
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        rows = []
+        if table_exists(cur, "cluster_profiles"):
             cur.execute("""
-                SELECT 
-                    datetime,
-                    zone,
-                    solar_mw,
-                    wind_mw,
-                    gas_mw,
-                    hydro_mw,
-                    unknown_mw,
-                    cluster_id
+                SELECT cluster_id, cluster_label, k, features, centroid, mean, std,
+                       hour_counts, count, share, score, metric, updated_at
+                FROM cluster_profiles
+                WHERE source_table = 'electricity_measurements'
+                ORDER BY cluster_id
+            """)
+            rows = cur.fetchall()
+        for row in rows:
+            if row.get('updated_at'):
+                row['updated_at'] = row['updated_at'].isoformat()
+
+        payload = {
+            "success": True,
+            "k": rows[0]['k'] if rows else None,
+            "metric": rows[0]['metric'] if rows else None,
+            "score": rows[0]['score'] if rows else None,
+            "updated_at": rows[0]['updated_at'] if rows else None,
+            "cluster_stats": {row['cluster_id']: row['count'] for row in rows},
+            "cluster_labels": {row['cluster_id']: row['cluster_label'] for row in rows},
+            "profiles": rows,
+        }
+        if not points:
+            return payload
+
+        # Downsample trên server: chỉ trả về mỗi dòng thứ `step` trong range
+        cur.execute("""
+            SELECT datetime, zone, solar_mw, wind_mw, gas_mw, hydro_mw, unknown_mw, cluster_id
+            FROM (
+                SELECT *,
+                    row_number() OVER (ORDER BY datetime) AS rn,
+                    COUNT(*) OVER () AS total
                 FROM electricity_measurements
                 WHERE datetime >= %s
                     AND cluster_id IS NOT NULL
                     AND cluster_id != -1
-                ORDER BY datetime ASC
-            """, (start_time,))
-            
-            rows = cur.fetchall()
-            
-            for row in rows:
-                if row.get('datetime'):
-                    row['datetime'] = row['datetime'].isoformat()
-            
-            # Thống kê số lượng mỗi cluster
-            cluster_stats = {}
-            for row in rows:
-                cid = row.get('cluster_id')
-                if cid is not None:
-                    cluster_stats[cid] = cluster_stats.get(cid, 0) + 1
-            
+            ) AS labelled
+            WHERE (rn - 1) %% GREATEST(CEIL(total::float8 / %s)::bigint, 1) = 0
+            ORDER BY datetime ASC
+        """, (get_time_range(range), max_points))
+        data = cur.fetchall()
+        for row in data:
+            row['datetime'] = row['datetime'].isoformat()
+        payload.update({"range": range, "count": len(data), "data": data})
+        return payload
+
+@app.get("/clustering/profiles")
+async def get_clustering_profiles(
+    range: str = Query("week", enum=["day", "week", "month"]),
+    points: bool = Query(False, description="Kèm các điểm đã gán nhãn (đã downsample)"),
+    max_points: int = Query(500, ge=1, le=MAX_CLUSTER_POINTS)
+):
+    """
+    Ý nghĩa từng cụm (bảng cluster_profiles): centroid theo đơn vị gốc, mean/std mỗi nguồn,
+    phân bố theo giờ trong ngày và số dòng. Điểm thô chỉ trả về khi points=true.
+    """
+    return await coalesced_read(clustering_profiles_payload, range, points, max_points)
+
+
+def clustering_prediction_payload(conn):
+    """Payload của GET /clustering-prediction (sync: endpoint gọi qua with_connection, /dashboard gọi trong threadpool)."""
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        # Kiểm tra bảng solar_predictions có tồn tại không
+        cur.execute("""
+            SELECT EXISTS (
+                SELECT FROM information_schema.tables 
+                WHERE table_name = 'solar_predictions'
+            )
+        """)
+        table_exists = cur.fetchone()['exists']
+        
+        if not table_exists:
             return {
                 "success": True,
-                "range": range,
-                "count": len(rows),
-                "cluster_stats": cluster_stats,
-                "data": rows
+                "message": "Predictions table (solar_predictions) not yet created",
+                "data": []
             }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
-
+        
+        # Lấy dữ liệu có cluster_id != -1
+        cur.execute("""
+            SELECT 
+                id,
+                prediction_time,
+                target_time,
+                predicted_solar_mw,
+                created_at,
+                cluster_id
+            FROM solar_predictions
+            WHERE cluster_id IS NOT NULL 
+                AND cluster_id != -1
+            ORDER BY target_time ASC
+        """)
+        
+        rows = cur.fetchall()
+        
+        # Format datetime thành ISO string
+        for row in rows:
+            if row.get('prediction_time'):
+                row['prediction_time'] = row['prediction_time'].isoformat()
+            if row.get('target_time'):
+                row['target_time'] = row['target_time'].isoformat()
+            if row.get('created_at'):
+                row['created_at'] = row['created_at'].isoformat()
+        
+        # Thống kê số lượng mỗi cluster
+        cluster_stats = {}
+        for row in rows:
+            cid = row.get('cluster_id')
+            if cid is not None and cid != -1:
+                cluster_stats[cid] = cluster_stats.get(cid, 0) + 1
+        
+        return {
+            "success": True,
+            "count": len(rows),
+            "cluster_stats": cluster_stats,
+            "cluster_labels": cluster_labels(cur, "solar_predictions"),
+            "data": rows
+        }
 
 @app.get("/clustering-prediction")
 async def get_clustering_predictions():
@@ -473,68 +1385,46 @@ async def get_clustering_predictions():
     Lấy kết quả clustering từ cột cluster_id trong bảng solar_predictions
     Chỉ trả về các dự đoán đã được phân cụm (cluster_id != -1)
     """
-    conn = get_db_connection()
-    try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            # Kiểm tra bảng solar_predictions có tồn tại không
-            cur.execute("""
-                SELECT EXISTS (
-                    SELECT FROM information_schema.tables 
-                    WHERE table_name = 'solar_predictions'
-                )
-            """)
-            table_exists = cur.fetchone()['exists']
-            
-            if not table_exists:
-                return {
-                    "success": True,
-                    "message": "Predictions table (solar_predictions) not yet created",
-                    "data": []
-                }
-            
-            # Lấy dữ liệu có cluster_id != -1
-            cur.execute("""
-                SELECT 
-                    id,
-                    prediction_time,
-                    target_time,
-                    predicted_solar_mw,
-                    created_at,
-                    cluster_id
-                FROM solar_predictions
-                WHERE cluster_id IS NOT NULL 
-                    AND cluster_id != -1
-                ORDER BY target_time ASC
-            """)
-            
-            rows = cur.fetchall()
-            
-            # Format datetime thành ISO string
-            for row in rows:
-                if row.get('prediction_time'):
-                    row['prediction_time'] = row['prediction_time'].isoformat()
-                if row.get('target_time'):
-                    row['target_time'] = row['target_time'].isoformat()
-                if row.get('created_at'):
-                    row['created_at'] = row['created_at'].isoformat()
-            
-            # Thống kê số lượng mỗi cluster
-            cluster_stats = {}
-            for row in rows:
-                cid = row.get('cluster_id')
-                if cid is not None and cid != -1:
-                    cluster_stats[cid] = cluster_stats.get(cid, 0) + 1
-            
-            return {
-                "success": True,
-                "count": len(rows),
-                "cluster_stats": cluster_stats,
-                "data": rows
-            }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
+    return await coalesced_read(clustering_prediction_payload)
+
+def trend_payload(conn, range):
+    """Payload của GET /analysis/trend (sync: endpoint gọi qua with_connection, /dashboard gọi trong threadpool)."""
+    start_time = get_time_range(range)
+    
+    # Xác định độ phân giải thời gian (Time Bucket)
+    if range in ["month", "year"]:
+        trunc_interval = "day"  # Gom theo ngày
+    else:
+        trunc_interval = "hour" # Gom theo giờ
+        
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        # Query tính trung bình theo bucket
+        query = f"""
+            SELECT 
+                DATE_TRUNC('{trunc_interval}', datetime) as time_bucket,
+                AVG(COALESCE(solar_mw, 0) + COALESCE(wind_mw, 0) + COALESCE(gas_mw, 0) + COALESCE(hydro_mw, 0) + COALESCE(unknown_mw, 0)) as avg_load,
+                AVG(COALESCE(solar_mw, 0)) as avg_solar,
+                AVG(COALESCE(wind_mw, 0)) as avg_wind
+            FROM electricity_measurements
+            WHERE datetime >= %s
+            GROUP BY time_bucket
+            ORDER BY time_bucket ASC
+        """
+        cur.execute(query, (start_time,))
+        rows = cur.fetchall()
+        
+        # Format datetime
+        for row in rows:
+            if row.get('time_bucket'):
+                row['timestamp'] = row['time_bucket'].isoformat()
+                del row['time_bucket'] # Xóa key cũ cho gọn
+        
+        return {
+            "success": True,
+            "range": range,
+            "interval": trunc_interval,
+            "data": rows
+        }
 
 @app.get("/analysis/trend")
 async def get_trend_analysis(range: str = Query("month", enum=["week", "month", "year"])):
@@ -544,48 +1434,45 @@ async def get_trend_analysis(range: str = Query("month", enum=["week", "month",
     - Nếu range = month/year -> Gom nhóm theo NGÀY (Daily Average)
     - Nếu range = week -> Gom nhóm theo GIỜ (Hourly Average)
     """
+    return await snapshot_or_read("measurements", trend_snapshot_payload, trend_payload, range)
+
+def seasonal_payload(conn, range):
+    """Payload của GET /analysis/seasonal (sync: endpoint gọi qua with_connection, /dashboard gọi trong threadpool)."""
     start_time = get_time_range(range)
     
-    # Xác định độ phân giải thời gian (Time Bucket)
-    if range in ["month", "year"]:
-        trunc_interval = "day"  # Gom theo ngày
-    else:
-        trunc_interval = "hour" # Gom theo giờ
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        # Query gom nhóm theo giờ (0-23)
+        cur.execute("""
+            SELECT 
+                EXTRACT(HOUR FROM datetime) as hour_of_day,
+                AVG(COALESCE(solar_mw, 0) + COALESCE(wind_mw, 0) + COALESCE(gas_mw, 0) + COALESCE(hydro_mw, 0) + COALESCE(unknown_mw, 0)) as avg_load,
+                AVG(COALESCE(solar_mw, 0)) as avg_solar,
+                AVG(COALESCE(wind_mw, 0)) as avg_wind,
+                COUNT(*) as data_points
+            FROM electricity_measurements
+            WHERE datetime >= %s
+            GROUP BY hour_of_day
+            ORDER BY hour_of_day ASC
+        """, (start_time,))
         
-    conn = get_db_connection()
-    try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            # Query tính trung bình theo bucket
-            query = f"""
-                SELECT 
-                    DATE_TRUNC('{trunc_interval}', datetime) as time_bucket,
-                    AVG(COALESCE(solar_mw, 0) + COALESCE(wind_mw, 0) + COALESCE(gas_mw, 0) + COALESCE(hydro_mw, 0) + COALESCE(unknown_mw, 0)) as avg_load,
-                    AVG(COALESCE(solar_mw, 0)) as avg_solar,
-                    AVG(COALESCE(wind_mw, 0)) as avg_wind
-                FROM electricity_measurements
-                WHERE datetime >= %s
-                GROUP BY time_bucket
-                ORDER BY time_bucket ASC
-            """
-            cur.execute(query, (start_time,))
-            rows = cur.fetchall()
-            
-            # Format datetime
-            for row in rows:
-                if row.get('time_bucket'):
-                    row['timestamp'] = row['time_bucket'].isoformat()
-                    del row['time_bucket'] # Xóa key cũ cho gọn
-            
-            return {
-                "success": True,
-                "range": range,
-                "interval": trunc_interval,
-                "data": rows
-            }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
+        rows = cur.fetchall()
+        
+        # Format lại dữ liệu cho dễ dùng ở frontend
+        formatted_data = []
+        for row in rows:
+            formatted_data.append({
+                "hour": int(row['hour_of_day']),
+                "hour_label": f"{int(row['hour_of_day']):02d}:00",
+                "avg_load": round(row['avg_load'], 2),
+                "avg_solar": round(row['avg_solar'], 2),
+                "avg_wind": round(row['avg_wind'], 2)
+            })
+        
+        return {
+            "success": True,
+            "range": range,
+            "data": formatted_data
+        }
 
 @app.get("/analysis/seasonal")
 async def get_seasonal_analysis(range: str = Query("month", enum=["week", "month", "year"])):
@@ -593,47 +1480,242 @@ async def get_seasonal_analysis(range: str = Query("month", enum=["week", "month
     API phục vụ vẽ biểu đồ Seasonal (Daily Profile).
     Gom nhóm dữ liệu theo giờ trong ngày (0-23h) để tìm ra mẫu hình tiêu thụ trung bình.
     """
-    start_time = get_time_range(range)
-    
-    conn = get_db_connection()
-    try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            # Query gom nhóm theo giờ (0-23)
-            cur.execute("""
-                SELECT 
-                    EXTRACT(HOUR FROM datetime) as hour_of_day,
-                    AVG(COALESCE(solar_mw, 0) + COALESCE(wind_mw, 0) + COALESCE(gas_mw, 0) + COALESCE(hydro_mw, 0) + COALESCE(unknown_mw, 0)) as avg_load,
-                    AVG(COALESCE(solar_mw, 0)) as avg_solar,
-                    AVG(COALESCE(wind_mw, 0)) as avg_wind,
-                    COUNT(*) as data_points
-                FROM electricity_measurements
-                WHERE datetime >= %s
-                GROUP BY hour_of_day
-                ORDER BY hour_of_day ASC
-            """, (start_time,))
-            
-            rows = cur.fetchall()
-            
-            # Format lại dữ liệu cho dễ dùng ở frontend
-            formatted_data = []
-            for row in rows:
-                formatted_data.append({
-                    "hour": int(row['hour_of_day']),
-                    "hour_label": f"{int(row['hour_of_day']):02d}:00",
-                    "avg_load": round(row['avg_load'], 2),
-                    "avg_solar": round(row['avg_solar'], 2),
-                    "avg_wind": round(row['avg_wind'], 2)
-                })
-            
-            return {
-                "success": True,
-                "range": range,
-                "data": formatted_data
-            }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
+    return await snapshot_or_read("measurements", seasonal_snapshot_payload, seasonal_payload, range)
+
+
+# --- SNAPSHOT VIEWS ---
+# Cùng payload với các hàm *_payload(conn, ...) ở trên nhưng tính trên slice mmap của snapshot.
+# Trả về None khi không phục vụ được (delta `since`, range ngoài snapshot) -> caller đọc DB.
+
+def _snapshot_floats(snapshot, name, rows):
+    return [None if v != v else v for v in snapshot.column(name)[rows].tolist()]
+
+def _snapshot_isoformat(snapshot, name, rows):
+    return [v.isoformat() if v is not None else None for v in snapshot.column(name)[rows].tolist()]
+
+def _snapshot_watermark(snapshot, rows):
+    """Như pop_watermark: MAX(updated_at) của các dòng, chặn bởi safe_until của snapshot."""
+    updated = snapshot.column("updated_at")[rows]
+    updated = updated[~np.isnat(updated)]
+    if not len(updated):
+        return None
+    latest = updated.max().item()
+    safe_until = snapshot.manifest.get("safe_until")
+    if safe_until:
+        latest = min(latest, datetime.fromisoformat(safe_until))
+    return latest.isoformat()
+
+def _snapshot_records(snapshot, rows, columns, mask=None):
+    """Dòng dạng dict (datetime ISO, zone, các cột số) như RealDictCursor trả về."""
+    if mask is not None:
+        rows = np.arange(rows.start, rows.stop)[mask]
+    values = {"datetime": _snapshot_isoformat(snapshot, "datetime", rows)}
+    for name in columns:
+        if name == "zone":
+            values[name] = snapshot.text(name, rows)
+        elif name == "cluster_id":
+            values[name] = snapshot.column(name)[rows].tolist()
+        else:
+            values[name] = _snapshot_floats(snapshot, name, rows)
+    names = list(values)
+    return [dict(zip(names, row)) for row in zip(*values.values())], rows
+
+def measurements_snapshot_payload(snapshot, range, since=None):
+    rows = snapshot.rows_since(get_time_range(range)) if since is None else None
+    if rows is None:
+        return None
+    data, _ = _snapshot_records(snapshot, rows, ["zone", "solar_mw", "wind_mw", "gas_mw", "hydro_mw", "unknown_mw"])
+    return {
+        "success": True,
+        "range": range,
+        "delta": False,
+        "watermark": _snapshot_watermark(snapshot, rows),
+        "count": len(data),
+        "data": data,
+        "snapshot": snapshot.version,
+    }
+
+def analysis_snapshot_payload(snapshot, range, sources, since=None):
+    rows = snapshot.rows_since(get_time_range(range)) if since is None else None
+    if rows is None:
+        return None
+    columns = analysis_columns(sources) or [c for c in snapshot.manifest["columns"] if c not in ("datetime", "updated_at")]
+    if any(c not in snapshot.manifest["columns"] for c in columns):
+        return None
+    data, _ = _snapshot_records(snapshot, rows, columns)
+    return {
+        "success": True,
+        "range": range,
+        "sources": [name.strip() for name in sources.split(",") if name.strip()] if sources else list(ANALYSIS_SOURCES),
+        "delta": False,
+        "watermark": _snapshot_watermark(snapshot, rows),
+        "count": len(data),
+        "data": data,
+        "snapshot": snapshot.version,
+    }
+
+def clustering_snapshot_payload(snapshot, range, since=None):
+    rows = snapshot.rows_since(get_time_range(range)) if since is None else None
+    # Snapshot cũ chưa kèm tên cụm (cluster_profiles) -> đọc DB
+    labels = snapshot.manifest.get("cluster_labels")
+    if rows is None or labels is None:
+        return None
+    # cluster_id NULL được lưu thành -1: cùng điều kiện IS NOT NULL AND != -1
+    mask = snapshot.column("cluster_id")[rows] >= 0
+    data, picked = _snapshot_records(
+        snapshot, rows, ["zone", "solar_mw", "wind_mw", "gas_mw", "hydro_mw", "unknown_mw", "cluster_id"], mask
+    )
+    ids, counts = np.unique(snapshot.column("cluster_id")[picked], return_counts=True)
+    cluster_stats = {int(cid): int(n) for cid, n in zip(ids, counts)}
+    return {
+        "success": True,
+        "range": range,
+        "delta": False,
+        "watermark": _snapshot_watermark(snapshot, picked),
+        "count": len(data),
+        "cluster_stats": cluster_stats,
+        "cluster_labels": {int(cid): label for cid, label in labels.items()},
+        "data": data,
+        "snapshot": snapshot.version,
+    }
+
+def _snapshot_load(snapshot, rows):
+    """(load, solar, wind) theo dòng, NULL -> 0 như COALESCE trong các query tương ứng."""
+    cols = {c: np.nan_to_num(snapshot.column(c)[rows]) for c in ("solar_mw", "wind_mw", "gas_mw", "hydro_mw", "unknown_mw")}
+    return sum(cols.values()), cols["solar_mw"], cols["wind_mw"]
+
+def _grouped_means(groups, *series):
+    keys, index = np.unique(groups, return_inverse=True)
+    counts = np.bincount(index)
+    return keys, [np.bincount(index, weights=s) / counts for s in series]
+
+def trend_snapshot_payload(snapshot, range):
+    rows = snapshot.rows_since(get_time_range(range))
+    if rows is None:
+        return None
+    trunc_interval = "day" if range in ["month", "year"] else "hour"
+    load, solar, wind = _snapshot_load(snapshot, rows)
+    buckets = snapshot.column("datetime")[rows].astype("datetime64[D]" if trunc_interval == "day" else "datetime64[h]")
+    keys, (avg_load, avg_solar, avg_wind) = _grouped_means(buckets, load, solar, wind)
+    timestamps = [t.isoformat() for t in keys.astype("datetime64[us]").tolist()]
+    data = [
+        {"avg_load": l, "avg_solar": s, "avg_wind": w, "timestamp": t}
+        for l, s, w, t in zip(avg_load.tolist(), avg_solar.tolist(), avg_wind.tolist(), timestamps)
+    ]
+    return {"success": True, "range": range, "interval": trunc_interval, "data": data, "snapshot": snapshot.version}
+
+def seasonal_snapshot_payload(snapshot, range):
+    rows = snapshot.rows_since(get_time_range(range))
+    if rows is None:
+        return None
+    load, solar, wind = _snapshot_load(snapshot, rows)
+    hours = snapshot.column("datetime")[rows].astype("datetime64[h]").astype(np.int64) % 24
+    keys, (avg_load, avg_solar, avg_wind) = _grouped_means(hours, load, solar, wind)
+    data = [
+        {"hour": h, "hour_label": f"{h:02d}:00", "avg_load": round(l, 2), "avg_solar": round(s, 2), "avg_wind": round(w, 2)}
+        for h, l, s, w in zip(keys.tolist(), avg_load.tolist(), avg_solar.tolist(), avg_wind.tolist())
+    ]
+    return {"success": True, "range": range, "data": data, "snapshot": snapshot.version}
+
+def correlations_snapshot_payload(snapshot):
+    rows = snapshot.rows_since(datetime.now() - timedelta(days=7))
+    if rows is None or rows.stop - rows.start < 10:
+        # Ít dữ liệu: để DB trả về đúng thông báo như trước
+        return None
+    columns = ['solar_mw', 'wind_mw', 'gas_mw', 'hydro_mw']
+    matrix = np.array([np.nan_to_num(snapshot.column(c)[rows]) for c in columns], dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        correlation_matrix = np.nan_to_num(np.corrcoef(matrix), nan=0.0, posinf=0.0, neginf=0.0)
+    correlations = {
+        col1: {col2: round(float(correlation_matrix[i][j]), 4) for j, col2 in enumerate(columns)}
+        for i, col1 in enumerate(columns)
+    }
+    return {
+        "success": True,
+        "columns": columns,
+        "correlations": correlations,
+        "data_points": rows.stop - rows.start,
+        "snapshot": snapshot.version,
+    }
+
+
+# Section -> hàm payload (conn, range). Tên section trùng với key trong response của /dashboard.
+DASHBOARD_SECTIONS = {
+    "measurements": lambda conn, range: measurements_payload(conn, range),
+    "status": lambda conn, range: latest_status_payload(conn),
+    "predictions": lambda conn, range: predictions_payload(conn),
+    "correlations": lambda conn, range: correlations_payload(conn),
+    "clustering": lambda conn, range: clustering_profiles_payload(conn, range, points=True),
+    "clustering_prediction": lambda conn, range: clustering_prediction_payload(conn),
+    "trend": lambda conn, range: trend_payload(conn, range),
+    "seasonal": lambda conn, range: seasonal_payload(conn, range),
+    "analysis": lambda conn, range: analysis_payload(conn, range, None),
+    "distribution": lambda conn, range: distribution_payload(conn, range, bins=10),
+}
+# Section phục vụ được từ snapshot: (dataset, view(snapshot, range)); None -> đọc DB qua pool
+DASHBOARD_SECTION_SNAPSHOTS = {
+    "measurements": ("measurements", measurements_snapshot_payload),
+    "correlations": ("measurements", lambda snapshot, range: correlations_snapshot_payload(snapshot)),
+    "trend": ("measurements", trend_snapshot_payload),
+    "seasonal": ("measurements", seasonal_snapshot_payload),
+    "analysis": ("analysis", lambda snapshot, range: analysis_snapshot_payload(snapshot, range, None)),
+}
+# Section dùng chung cache với endpoint riêng (kết quả ít thay đổi)
+DASHBOARD_SECTION_FLIGHTS = {"distribution": distribution_flight}
+# Section nhạy với độ trễ replica (cùng ngưỡng với endpoint riêng)
+DASHBOARD_SECTION_MAX_LAG = {"status": STATUS_MAX_LAG_SECONDS}
+# Mặc định: đúng các section mà Dashboard.tsx hiển thị
+DEFAULT_DASHBOARD_SECTIONS = [name for name in DASHBOARD_SECTIONS if name != "analysis"]
+
+def _dashboard_section(name: str, range: str):
+    payload = None
+    if name in DASHBOARD_SECTION_SNAPSHOTS:
+        dataset, view = DASHBOARD_SECTION_SNAPSHOTS[name]
+        payload = snapshot_view(dataset, view, range)
+    if payload is None:
+        with telemetry.span("dashboard_section", section=name), querylog.tag(f"dashboard.{name}"):
+            payload = with_pooled_connection(DASHBOARD_SECTIONS[name], range,
+                                             max_lag=DASHBOARD_SECTION_MAX_LAG.get(name))
+    # Bỏ các field trùng lặp giữa các section cho payload gọn
+    return {k: v for k, v in payload.items() if k not in ("success", "range")}
+
+@app.get("/dashboard")
+async def get_dashboard(
+    range: str = Query("day", enum=["day", "week", "month"]),
+    sections: Optional[str] = Query(None, description="Ví dụ: measurements,status,trend (mặc định: toàn bộ dashboard)")
+):
+    """
+    Gộp các request của Dashboard thành một: mỗi section chạy song song trong threadpool,
+    trên connection lấy từ pool, nên latency ~ section chậm nhất thay vì tổng các request.
+    Section lỗi trả về {"error": ...} thay vì làm hỏng cả response.
+    """
+    names = [n.strip() for n in sections.split(",") if n.strip()] if sections else DEFAULT_DASHBOARD_SECTIONS
+    unknown = [n for n in names if n not in DASHBOARD_SECTIONS]
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown sections: {', '.join(unknown)}. Allowed: {', '.join(DASHBOARD_SECTIONS)}"
+        )
+    names = list(dict.fromkeys(names))
+
+    async def run(name):
+        try:
+            flight = DASHBOARD_SECTION_FLIGHTS.get(name)
+            if flight is not None:
+                result, _ = await flight.do(("dashboard", name, range), _dashboard_section, name, range)
+                return name, result
+            return name, await run_in_threadpool(_dashboard_section, name, range)
+        except Exception as e:
+            telemetry.incr("errors", stage="dashboard", section=name)
+            return name, {"error": str(e)}
+
+    results = await asyncio.gather(*(run(name) for name in names))
+    return {
+        "success": True,
+        "range": range,
+        "generated_at": datetime.now().isoformat(),
+        "sections": dict(results),
+    }
 
 
 if __name__ == "__main__":
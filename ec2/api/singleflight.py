@@ -0,0 +1,54 @@
+"""
+Single-flight: gộp các lời gọi giống hệt nhau đang chạy đồng thời thành một lần thực thi.
+
+- Request đầu tiên với một key chạy hàm (trong threadpool vì hàm là sync: query DB,
+  boto3...). Các request cùng key đến sau chỉ chờ và nhận chung kết quả đó.
+- Sau khi xong, kết quả còn được giữ thêm `window` giây (debounce): request trong
+  khoảng này dùng lại kết quả thay vì chạy lại. window = 0 -> chỉ gộp khi đang chạy.
+- Lỗi không bị giữ lại: mọi request đang chờ nhận cùng exception, request sau chạy lại.
+- Task dùng chung được shield: client huỷ request không huỷ công việc của người khác.
+
+Chỉ gộp trong một process (mỗi worker uvicorn có bảng riêng).
+"""
+import asyncio
+
+from starlette.concurrency import run_in_threadpool
+
+import telemetry
+
+
+class SingleFlight:
+    def __init__(self, name, window=0.0):
+        self.name = name
+        self.window = window
+        self._calls = {}
+
+    async def do(self, key, fn, *args):
+        """
+        Chạy fn(*args) một lần cho mỗi key. Trả về (result, shared) với shared=True khi
+        kết quả lấy từ lần gọi khác (đang chạy hoặc còn trong debounce window).
+        """
+        task = self._calls.get(key)
+        shared = task is not None
+        if shared:
+            telemetry.incr("singleflight_shared", flight=self.name)
+        else:
+            task = asyncio.ensure_future(run_in_threadpool(fn, *args))
+            self._calls[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+            telemetry.incr("singleflight_executed", flight=self.name)
+        return await asyncio.shield(task), shared
+
+    def _done(self, key, task):
+        # task.exception() cũng đánh dấu exception đã được lấy (tránh warning của asyncio)
+        if task.cancelled() or task.exception() is not None or self.window <= 0:
+            self._forget(key, task)
+        else:
+            asyncio.get_running_loop().call_later(self.window, self._forget, key, task)
+
+    def _forget(self, key, task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+
+    def __len__(self):
+        return len(self._calls)
@@ -0,0 +1,155 @@
+"""
+Đọc snapshot do job analysis/clustering publish (backend/*/snapshots.py) bằng mmap.
+
+- Mỗi dataset có LATEST trỏ tới thư mục version bất biến gồm manifest.json và một file
+  .npy / cột. Cột được np.load(mmap_mode="r") lần đầu dùng: trang dữ liệu nằm trong page
+  cache của OS, dùng chung giữa các request và các worker, không copy vào heap.
+- LATEST được kiểm tra lại tối đa mỗi `poll_seconds` (một request kiểm tra, các request
+  khác dùng version đang có). SNAPSHOT_URI là s3://... -> version mới được tải về
+  `cache_dir` một lần rồi mmap từ đó.
+- Snapshot cũ hơn `max_age` giây, rỗng, hoặc không phủ được range yêu cầu -> None,
+  caller đọc DB như trước.
+"""
+import json
+import os
+import shutil
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+import telemetry
+
+
+class Snapshot:
+    def __init__(self, path, manifest):
+        self.path = path
+        self.manifest = manifest
+        self.version = manifest["version"]
+        self.created_at = datetime.fromisoformat(manifest["created_at"])
+        covers_from = manifest.get("covers_from")
+        self.covers_from = np.datetime64(covers_from, "us") if covers_from else None
+        self._columns = {}
+
+    @property
+    def age_seconds(self):
+        return time.time() - self.created_at.timestamp()
+
+    def column(self, name):
+        array = self._columns.get(name)
+        if array is None:
+            array = self._columns[name] = np.load(os.path.join(self.path, f"{name}.npy"), mmap_mode="r")
+        return array
+
+    def rows_since(self, start):
+        """slice các dòng có datetime >= start (view, không copy); None nếu snapshot không phủ start."""
+        start = np.datetime64(start, "us")
+        if self.covers_from is None or start < self.covers_from:
+            return None
+        keys = self.column("datetime")
+        return slice(int(np.searchsorted(keys, start, side="left")), len(keys))
+
+    def text(self, name, rows):
+        """Giá trị text của cột `name` cho slice `rows` (mã ngoài danh sách -> None)."""
+        values = self.manifest["text_values"].get(name, [])
+        lookup = values + [None]
+        return [lookup[min(code, len(values))] for code in self.column(name)[rows].tolist()]
+
+
+def _read_text(path):
+    with open(path) as f:
+        return f.read().strip()
+
+
+class SnapshotStore:
+    def __init__(self, uri, cache_dir="/tmp/snapshots", max_age=7200.0, poll_seconds=5.0):
+        self.uri = uri
+        self.cache_dir = cache_dir
+        self.max_age = max_age
+        self.poll_seconds = poll_seconds
+        self._current = {}
+        self._checked_at = {}
+        self._lock = threading.Lock()
+
+    def get(self, dataset):
+        """Snapshot mới nhất còn dùng được của dataset, hoặc None."""
+        if not self.uri:
+            return None
+        if time.monotonic() - self._checked_at.get(dataset, 0.0) >= self.poll_seconds:
+            if self._lock.acquire(blocking=False):
+                try:
+                    self._refresh(dataset)
+                finally:
+                    self._lock.release()
+        snapshot = self._current.get(dataset)
+        if snapshot is None or snapshot.age_seconds > self.max_age:
+            return None
+        return snapshot
+
+    def _refresh(self, dataset):
+        self._checked_at[dataset] = time.monotonic()
+        try:
+            version = self._latest(dataset)
+            current = self._current.get(dataset)
+            if version and (current is None or current.version != version):
+                path = self._fetch(dataset, version)
+                with open(os.path.join(path, "manifest.json")) as f:
+                    manifest = json.load(f)
+                self._current[dataset] = Snapshot(path, manifest) if manifest["rows"] else None
+                telemetry.set_gauge("snapshot_rows", manifest["rows"], dataset=dataset)
+                print(f"📦 Snapshot {dataset}/{version} loaded ({manifest['rows']} rows)")
+        except Exception as e:
+            telemetry.incr("errors", stage="snapshot_load", dataset=dataset)
+            print(f"[WARN] Snapshot {dataset} refresh failed: {e}")
+        snapshot = self._current.get(dataset)
+        if snapshot is not None:
+            telemetry.set_gauge("snapshot_age_seconds", round(snapshot.age_seconds, 1), dataset=dataset)
+
+    def _latest(self, dataset):
+        if not self.uri.startswith("s3://"):
+            latest = os.path.join(self.uri, dataset, "LATEST")
+            return _read_text(latest) if os.path.exists(latest) else None
+        bucket, root = self._s3_root(dataset)
+        try:
+            body = self._s3().get_object(Bucket=bucket, Key=f"{root}/LATEST")["Body"].read()
+        except self._s3().exceptions.NoSuchKey:
+            return None
+        return body.decode().strip()
+
+    def _fetch(self, dataset, version):
+        """Thư mục local của version (S3: tải về cache_dir, giữ version trước cho request đang đọc)."""
+        if not self.uri.startswith("s3://"):
+            return os.path.join(self.uri, dataset, version)
+        target = os.path.join(self.cache_dir, dataset, version)
+        if not os.path.isdir(target):
+            bucket, root = self._s3_root(dataset)
+            client = self._s3()
+            staging = f"{target}.tmp"
+            shutil.rmtree(staging, ignore_errors=True)
+            os.makedirs(staging)
+            listing = client.list_objects_v2(Bucket=bucket, Prefix=f"{root}/{version}/")
+            for obj in listing.get("Contents", []):
+                client.download_file(bucket, obj["Key"], os.path.join(staging, os.path.basename(obj["Key"])))
+            os.rename(staging, target)
+        parent = os.path.dirname(target)
+        for old in sorted(d for d in os.listdir(parent) if not d.endswith(".tmp"))[:-2]:
+            shutil.rmtree(os.path.join(parent, old), ignore_errors=True)
+        return target
+
+    def _s3_root(self, dataset):
+        bucket, _, prefix = self.uri[len("s3://"):].partition("/")
+        prefix = prefix.strip("/")
+        return bucket, f"{prefix}/{dataset}" if prefix else dataset
+
+    def _s3(self):
+        import boto3
+        if not hasattr(self, "_client"):
+            self._client = boto3.client("s3", endpoint_url=os.getenv("AWS_ENDPOINT_URL") or None)
+        return self._client
+
+    def status(self):
+        return {
+            dataset: {"version": s.version, "age_seconds": round(s.age_seconds, 1), "rows": s.manifest["rows"]}
+            for dataset, s in self._current.items() if s is not None
+        }
@@ -16,11 +16,12 @@ interface Props {
   data: ClusterPoint[];
 }
 
-const COLORS = ["#f59e0b", "#ef4444", "#06b6d4"];
+const COLORS = ["#f59e0b", "#ef4444", "#06b6d4", "#22c55e", "#a855f7", "#64748b"];
+// Fallback khi point không có cluster_label: ID đã được sắp theo solar tăng dần
 const CLUSTER_NAMES: { [key: number]: string } = {
-  2: "Clean Wind High",
-  0: "Clean Solar High",
-  1: "Dirty Energy High",
+  0: "Low Solar / Night",
+  1: "Moderate / Transition",
+  2: "High Solar / Peak",
 };
 
 export const ClusterVisuals: React.FC<Props> = ({ data }) => {
@@ -75,7 +76,9 @@ export const ClusterVisuals: React.FC<Props> = ({ data }) => {
                 const point = payload[0].payload;
                 const clusterId = point.cluster_id;
                 const clusterName =
-                  CLUSTER_NAMES[clusterId] || `Cluster ${clusterId}`;
+                  point.cluster_label ||
+                  CLUSTER_NAMES[clusterId] ||
+                  `Cluster ${clusterId}`;
 
                 return (
                   <div className="bg-slate-800 border border-slate-700 p-2 rounded text-xs text-white shadow-lg">
@@ -1,44 +1,14 @@
-import React, { useMemo } from 'react';
+import React from 'react';
 import { BarChart, Bar, XAxis, YAxis, Tooltip, ResponsiveContainer } from 'recharts';
-import { Measurement } from '../../types';
+import { DistributionBin } from '../../types';
 
 interface Props {
-  data: Measurement[];
+  // Histogram tính sẵn ở backend (/analysis/distribution), không cần raw measurements
+  data: DistributionBin[];
 }
 
 export const PowerHistogram: React.FC<Props> = ({ data }) => {
-  const histogramData = useMemo(() => {
-    if (!data || !Array.isArray(data) || data.length === 0) return [];
-
-    const loads = data.map(d => d.load);
-    const min = Math.min(...loads);
-    const max = Math.max(...loads);
-
-    // Handle single value or no variance
-    if (min === max) {
-      return [{ range: `${min}`, count: loads.length }];
-    }
-
-    const binCount = 10;
-    const binSize = (max - min) / binCount;
-
-    const bins = Array.from({ length: binCount }, (_, i) => ({
-      range: `${Math.round(min + i * binSize)}-${Math.round(min + (i + 1) * binSize)}`,
-      count: 0
-    }));
-
-    loads.forEach(load => {
-      const binIndex = Math.min(
-        Math.floor((load - min) / binSize),
-        binCount - 1
-      );
-      if (bins[binIndex]) {
-        bins[binIndex].count++;
-      }
-    });
-
-    return bins;
-  }, [data]);
+  const histogramData = Array.isArray(data) ? data : [];
 
   if (histogramData.length === 0) {
     return <div className="w-full h-[250px] flex items-center justify-center text-slate-500">No data</div>;
@@ -24,6 +24,7 @@ import { GridService } from "../services/api";
 import {
   ClusterPoint,
   CorrelationData,
+  DistributionBin,
   GridStatus,
   Measurement,
   Prediction,
@@ -52,40 +53,23 @@ export const Dashboard: React.FC = () => {
   );
   const [trendData, setTrendData] = useState<TrendData[]>([]);
   const [seasonalData, setSeasonalData] = useState<SeasonalData[]>([]);
+  const [distribution, setDistribution] = useState<DistributionBin[]>([]);
 
   // Fetch all data
   const fetchData = async () => {
     setLoading(true);
     setError(null);
     try {
-      const [
-        measData,
-        statusData,
-        predData,
-        corrData,
-        clusterData,
-        predClusterData,
-        trendRes,
-        seasonalRes,
-      ] = await Promise.all([
-        GridService.getMeasurements(timeRange),
-        GridService.getLatestStatus(),
-        GridService.getPredictions(),
-        GridService.getCorrelations(),
-        GridService.getClustering(timeRange),
-        GridService.getClusteringPrediction(),
-        GridService.getTrendAnalysis(timeRange),
-        GridService.getSeasonalAnalysis(timeRange),
-      ]);
-
-      setMeasurements(measData);
-      setStatus(statusData);
-      setPredictions(predData);
-      setCorrelations(corrData);
-      setClusters(clusterData);
-      setPredictionClusters(predClusterData);
-      setTrendData(trendRes);
-      setSeasonalData(seasonalRes);
+      const dashboard = await GridService.getDashboard(timeRange);
+      setMeasurements(dashboard.measurements);
+      setStatus(dashboard.status);
+      setPredictions(dashboard.predictions);
+      setCorrelations(dashboard.correlations);
+      setClusters(dashboard.clusters);
+      setPredictionClusters(dashboard.predictionClusters);
+      setTrendData(dashboard.trend);
+      setSeasonalData(dashboard.seasonal);
+      setDistribution(dashboard.distribution);
     } catch (err: any) {
       console.error(err);
       setError(
@@ -371,7 +355,7 @@ export const Dashboard: React.FC = () => {
             <Wind size={18} className="text-secondary" />
             Load Distribution
           </h3>
-          <PowerHistogram data={measurements} />
+          <PowerHistogram data={distribution} />
         </div>
 
         {/* Clustering */}
@@ -1,5 +1,5 @@
 import axios from 'axios';
-import { ClusterPoint, CorrelationData, GridStatus, Measurement, Prediction, SeasonalData, TimeRange, TrendData } from '../types';
+import { ClusterPoint, CorrelationData, DashboardData, DistributionBin, GridStatus, Measurement, Prediction, SeasonalData, TimeRange, TrendData } from '../types';
 
 const API_BASE_URL = 'http://52.77.236.120:8000';
 
@@ -11,10 +11,118 @@ const apiClient = axios.create({
   timeout: 10000,
 });
 
+// Clustering service sắp nhãn theo centroid solar tăng dần nên ID ổn định giữa các lần chạy.
+// Dùng khi backend không trả cluster_labels (mặc định k = 3).
 const CLUSTER_NAMES: { [key: number]: string } = {
-  0: 'Low Generation / Night',   // Thường là nhóm có giá trị thấp nhất
-  1: 'Moderate / Transition',    // Nhóm trung bình
-  2: 'High Output / Peak',       // Nhóm cao nhất
+  0: 'Low Solar / Night',
+  1: 'Moderate / Transition',
+  2: 'High Solar / Peak',
+};
+
+// --- Mapper: payload backend -> kiểu dữ liệu frontend ---
+// Dùng chung cho endpoint riêng lẻ và các section của /dashboard (cùng shape).
+
+const mapMeasurements = (payload: any): Measurement[] => {
+  // Backend returns { success: true, data: [...] }
+  const rawData = payload?.data || [];
+
+  return rawData.map((item: any) => ({
+    timestamp: item.datetime,
+    solar: item.solar_mw || 0,
+    wind: item.wind_mw || 0,
+    gas: item.gas_mw || 0,
+    hydro: item.hydro_mw || 0,
+    // Calculate total load from available sources
+    load: (item.solar_mw || 0) + (item.wind_mw || 0) + (item.gas_mw || 0) +
+      (item.hydro_mw || 0) + (item.biomass_mw || 0) +
+      (item.geothermal_mw || 0) + (item.unknown_mw || 0),
+    cluster_id: item.cluster_id
+  }));
+};
+
+const mapPredictions = (payload: any): Prediction[] => {
+  const rawData = payload?.data || [];
+
+  return rawData.map((item: any) => {
+    const clusterId = item.cluster_id;
+    let clusterLabel = 'Pending'; // Trạng thái mặc định cho dự đoán
+
+    if (clusterId !== undefined && clusterId !== null && clusterId !== -1) {
+      // Lấy tên từ bảng mapping, nếu không có thì dùng tên dự phòng
+      clusterLabel = CLUSTER_NAMES[clusterId] || `Pattern ${clusterId}`;
+    }
+
+    return {
+      timestamp: item.target_time,
+      prediction: item.predicted_solar_mw,
+      cluster_id: clusterId,
+      cluster_label: clusterLabel // Thêm trường label vào đây
+    };
+  });
+};
+
+const mapLatestStatus = (data: any): GridStatus => {
+  // Logic mới: Lấy trực tiếp từ field current_cluster_id backend trả về
+  const clusterId = data?.current_cluster_id;
+
+  // Tạo label hiển thị có ý nghĩa hơn
+  let clusterLabel = 'Unknown';
+
+  if (clusterId !== undefined && clusterId !== null && clusterId !== -1) {
+    // Ưu tiên tên cụm lưu trong snapshot (theo k thực tế của lần clustering gần nhất)
+    clusterLabel = data?.current_cluster_label || CLUSTER_NAMES[clusterId] || `Pattern ${clusterId}`;
+  }
+
+  return {
+    total_power: data?.total_power_mw || 0,
+    cluster_id: clusterId ?? -1,
+    cluster_label: clusterLabel,
+    timestamp: data?.latest_measurement?.datetime || data?.timestamp || new Date().toISOString()
+  };
+};
+
+const mapClustering = (payload: any): ClusterPoint[] => {
+  const rawData = payload?.data || [];
+  const labels: { [key: number]: string } = payload?.cluster_labels || CLUSTER_NAMES;
+
+  return rawData.map((item: any) => {
+    const load = (item.solar_mw || 0) + (item.wind_mw || 0) + (item.gas_mw || 0) +
+      (item.hydro_mw || 0) + (item.biomass_mw || 0) +
+      (item.geothermal_mw || 0) + (item.unknown_mw || 0);
+    return {
+      x: item.solar_mw || 0, // Mapping solar to X for visualization
+      y: item.wind_mw || 0,  // Mapping wind to Y for visualization
+      cluster_id: item.cluster_id,
+      load: load,
+      cluster_label: labels[item.cluster_id]
+    };
+  });
+};
+
+const mapClusteringPrediction = (payload: any): ClusterPoint[] => {
+  const rawData = payload?.data || [];
+  const labels: { [key: number]: string } = payload?.cluster_labels || CLUSTER_NAMES;
+
+  return rawData.map((item: any) => {
+    return {
+      x: new Date(item.target_time).getTime(), // Mapping time to X
+      y: item.predicted_solar_mw || 0,         // Mapping predicted solar to Y
+      cluster_id: item.cluster_id,
+      load: 0, // Not applicable for prediction clustering visualization in this context
+      cluster_label: labels[item.cluster_id]
+    };
+  });
+};
+
+// Histogram do backend tính sẵn (/analysis/distribution): edges có bins + 1 phần tử
+const mapDistribution = (payload: any, source: string = 'load'): DistributionBin[] => {
+  const dist = payload?.sources?.[source];
+  if (!dist || !dist.counts) return [];
+
+  return dist.counts.map((count: number, i: number) => ({
+    range: `${Math.round(dist.edges[i])}-${Math.round(dist.edges[i + 1])}`,
+    count
+  }));
 };
 
 export const GridService = {
@@ -22,21 +130,7 @@ export const GridService = {
     const response = await apiClient.get(`/measurements`, {
       params: { range },
     });
-    // Backend returns { success: true, data: [...] }
-    const rawData = response.data.data || [];
-
-    return rawData.map((item: any) => ({
-      timestamp: item.datetime,
-      solar: item.solar_mw || 0,
-      wind: item.wind_mw || 0,
-      gas: item.gas_mw || 0,
-      hydro: item.hydro_mw || 0,
-      // Calculate total load from available sources
-      load: (item.solar_mw || 0) + (item.wind_mw || 0) + (item.gas_mw || 0) +
-        (item.hydro_mw || 0) + (item.biomass_mw || 0) +
-        (item.geothermal_mw || 0) + (item.unknown_mw || 0),
-      cluster_id: item.cluster_id
-    }));
+    return mapMeasurements(response.data);
   },
 
   getAnalysis: async (range: TimeRange): Promise<any> => {
@@ -60,6 +154,13 @@ export const GridService = {
     return response.data.data || [];
   },
 
+  getDistribution: async (range: TimeRange, bins: number = 10): Promise<DistributionBin[]> => {
+    const response = await apiClient.get(`/analysis/distribution`, {
+      params: { range, bins, sources: 'load' },
+    });
+    return mapDistribution(response.data);
+  },
+
   getCorrelations: async (): Promise<CorrelationData> => {
     const response = await apiClient.get(`/analysis/correlations`);
     return response.data.correlations || {};
@@ -67,80 +168,44 @@ export const GridService = {
 
   getPredictions: async (): Promise<Prediction[]> => {
     const response = await apiClient.get(`/predictions`);
-    const rawData = response.data.data || [];
-
-    return rawData.map((item: any) => {
-      const clusterId = item.cluster_id;
-      let clusterLabel = 'Pending'; // Trạng thái mặc định cho dự đoán
-
-      if (clusterId !== undefined && clusterId !== null && clusterId !== -1) {
-        // Lấy tên từ bảng mapping, nếu không có thì dùng tên dự phòng
-        clusterLabel = CLUSTER_NAMES[clusterId] || `Pattern ${clusterId}`;
-      }
-
-      return {
-        timestamp: item.target_time,
-        prediction: item.predicted_solar_mw,
-        cluster_id: clusterId,
-        cluster_label: clusterLabel // Thêm trường label vào đây
-      };
-    });
+    return mapPredictions(response.data);
   },
 
   getLatestStatus: async (): Promise<GridStatus> => {
     const response = await apiClient.get(`/status/latest`);
-    const data = response.data;
-
-    // Logic mới: Lấy trực tiếp từ field current_cluster_id backend trả về
-    const clusterId = data.current_cluster_id;
-
-    // Tạo label hiển thị có ý nghĩa hơn
-    let clusterLabel = 'Unknown';
-
-    if (clusterId !== undefined && clusterId !== null && clusterId !== -1) {
-      // Nếu có tên trong bảng mapping thì lấy, không thì hiển thị "Pattern X"
-      clusterLabel = CLUSTER_NAMES[clusterId] || `Pattern ${clusterId}`;
-    }
-
-    return {
-      total_power: data.total_power_mw || 0,
-      cluster_id: clusterId ?? -1,
-      cluster_label: clusterLabel,
-      timestamp: data.latest_measurement?.datetime || data.timestamp || new Date().toISOString()
-    };
+    return mapLatestStatus(response.data);
   },
 
   getClustering: async (range: TimeRange): Promise<ClusterPoint[]> => {
     const response = await apiClient.get(`/clustering`, {
       params: { range },
     });
-    const rawData = response.data.data || [];
-
-    return rawData.map((item: any) => {
-      const load = (item.solar_mw || 0) + (item.wind_mw || 0) + (item.gas_mw || 0) +
-        (item.hydro_mw || 0) + (item.biomass_mw || 0) +
-        (item.geothermal_mw || 0) + (item.unknown_mw || 0);
-      return {
-        x: item.solar_mw || 0, // Mapping solar to X for visualization
-        y: item.wind_mw || 0,  // Mapping wind to Y for visualization
-        cluster_id: item.cluster_id,
-        load: load
-      };
-    });
+    return mapClustering(response.data);
   },
 
   getClusteringPrediction: async (): Promise<ClusterPoint[]> => {
     const response = await apiClient.get(`/clustering-prediction`);
-    const rawData = response.data.data || [];
-
-    return rawData.map((item: any) => {
-      return {
-        x: new Date(item.target_time).getTime(), // Mapping time to X
-        y: item.predicted_solar_mw || 0,         // Mapping predicted solar to Y
-        cluster_id: item.cluster_id,
-        load: 0 // Not applicable for prediction clustering visualization in this context
-      };
+    return mapClusteringPrediction(response.data);
+  },
+
+  // Một request thay cho 8 request riêng lẻ: backend chạy các query song song trên connection pool
+  getDashboard: async (range: TimeRange): Promise<DashboardData> => {
+    const response = await apiClient.get(`/dashboard`, {
+      params: { range },
     });
+    const sections = response.data.sections || {};
+
+    return {
+      measurements: mapMeasurements(sections.measurements),
+      status: mapLatestStatus(sections.status),
+      predictions: mapPredictions(sections.predictions),
+      correlations: sections.correlations?.correlations || {},
+      clusters: mapClustering(sections.clustering),
+      predictionClusters: mapClusteringPrediction(sections.clustering_prediction),
+      trend: sections.trend?.data || [],
+      seasonal: sections.seasonal?.data || [],
+      distribution: mapDistribution(sections.distribution),
+    };
   },
 
   triggerClustering: async (): Promise<{ message: string }> => {
@@ -157,4 +222,4 @@ export const GridService = {
     const response = await apiClient.post<{ message: string }>(`/trigger-prediction`);
     return response.data;
   },
-};
\ No newline at end of file
+};
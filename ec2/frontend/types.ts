@@ -35,6 +35,7 @@ export interface ClusterPoint {
   y: number;
   cluster_id: number;
   load: number;
+  cluster_label?: string;
 }
 
 export interface TrendData {
@@ -52,6 +53,23 @@ export interface SeasonalData {
   avg_wind: number;
 }
 
+export interface DistributionBin {
+  range: string;
+  count: number;
+}
+
+export interface DashboardData {
+  measurements: Measurement[];
+  status: GridStatus;
+  predictions: Prediction[];
+  correlations: CorrelationData;
+  clusters: ClusterPoint[];
+  predictionClusters: ClusterPoint[];
+  trend: TrendData[];
+  seasonal: SeasonalData[];
+  distribution: DistributionBin[];
+}
+
 export interface ApiError {
   message: string;
   status?: number;
@@ -0,0 +1,169 @@
+"""
+Phát hiện bất thường online lúc ingest (zero-out đột ngột, spike) trên từng nguồn.
+
+- Trạng thái: EWMA mean/variance cho mỗi (zone, nguồn, giờ trong ngày) trong bảng
+  anomaly_state -> O(1) mỗi dòng, không quét lại lịch sử. Tách theo giờ trong ngày để
+  solar = 0 lúc đêm là bình thường nhưng 0 lúc trưa thì không.
+- Điểm: |x - mean| / std (z-score của EWMA). Gắn cờ khi đã có đủ ANOMALY_MIN_SAMPLES
+  mẫu và score >= ANOMALY_Z_THRESHOLD ("spike"/"drop"), hoặc giá trị về 0 trong khi mức
+  bình thường của giờ đó >= ANOMALY_ZERO_MIN_MEAN ("zero_out").
+- Dòng bị gắn cờ vẫn cập nhật trạng thái nhưng với trọng số nhỏ (ANOMALY_ALPHA / 10):
+  một spike không kéo lệch baseline, còn thay đổi mức thật thì dần được chấp nhận.
+- Cờ được ghi vào measurement_anomalies (datetime, zone, source); loader của
+  analysis/clustering bỏ các giờ có cờ (chỉ cần join theo primary key).
+
+Chạy trong cùng transaction với upsert measurements và chỉ cho các dòng thực sự thay đổi.
+"""
+import math
+import os
+from datetime import datetime, timezone
+
+from psycopg2.extras import execute_values
+
+import telemetry
+
+ANOMALY_ALPHA = float(os.getenv("ANOMALY_ALPHA", 0.1))
+ANOMALY_Z_THRESHOLD = float(os.getenv("ANOMALY_Z_THRESHOLD", 6.0))
+ANOMALY_MIN_SAMPLES = int(os.getenv("ANOMALY_MIN_SAMPLES", 14))
+ANOMALY_ZERO_MIN_MEAN = float(os.getenv("ANOMALY_ZERO_MIN_MEAN", 5.0))
+ANOMALY_ENABLED = os.getenv("ANOMALY_DETECTION", "true").lower() == "true"
+
+# Cùng thứ tự với tuple của app.extract_measurement (sau datetime, zone)
+SOURCES = [
+    "carbon_intensity", "solar_mw", "wind_mw", "gas_mw", "unknown_mw",
+    "hydro_mw", "biomass_mw", "nuclear_mw", "geothermal_mw",
+]
+# Sàn cho std: tránh score vô hạn khi chuỗi gần như hằng số
+MIN_STD = 1.0
+
+DDL = """
+    CREATE TABLE IF NOT EXISTS anomaly_state (
+        zone VARCHAR(50) NOT NULL,
+        source VARCHAR(50) NOT NULL,
+        hour SMALLINT NOT NULL,
+        n INTEGER NOT NULL,
+        mean DOUBLE PRECISION NOT NULL,
+        var DOUBLE PRECISION NOT NULL,
+        updated_at TIMESTAMP DEFAULT NOW(),
+        PRIMARY KEY (zone, source, hour)
+    );
+    CREATE TABLE IF NOT EXISTS measurement_anomalies (
+        datetime TIMESTAMP NOT NULL,
+        zone VARCHAR(50) NOT NULL,
+        source VARCHAR(50) NOT NULL,
+        value DOUBLE PRECISION,
+        expected DOUBLE PRECISION,
+        score DOUBLE PRECISION,
+        reason VARCHAR(20),
+        detected_at TIMESTAMP DEFAULT NOW(),
+        PRIMARY KEY (datetime, zone, source)
+    );
+"""
+
+
+def parse_datetime(value):
+    """ISO string của API (hoặc datetime) -> datetime UTC không tz như cột datetime."""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def score(value, state):
+    """(score, reason) của value so với state (n, mean, var); reason=None nếu bình thường."""
+    n, mean, var = state
+    # var của EWMA khởi tạo từ 0 nên bị thấp ở vài chục mẫu đầu -> hiệu chỉnh bias như Adam
+    correction = 1 - (1 - ANOMALY_ALPHA) ** max(n - 1, 1)
+    std = max(math.sqrt(var / correction), MIN_STD)
+    z = abs(value - mean) / std
+    if n < ANOMALY_MIN_SAMPLES:
+        return z, None
+    if value == 0 and mean >= ANOMALY_ZERO_MIN_MEAN:
+        return z, "zero_out"
+    if z >= ANOMALY_Z_THRESHOLD:
+        return z, "spike" if value > mean else "drop"
+    return z, None
+
+
+def update(value, state, flagged=False):
+    """Một bước EWMA (West, 1979) cho mean/var; dòng bị gắn cờ cập nhật với trọng số nhỏ."""
+    n, mean, var = state
+    if n == 0:
+        return 1, value, 0.0
+    alpha = ANOMALY_ALPHA / 10 if flagged else ANOMALY_ALPHA
+    diff = value - mean
+    incr = alpha * diff
+    return n + 1, mean + incr, (1 - alpha) * (var + diff * incr)
+
+
+def detect(cur, rows):
+    """
+    Chấm điểm + cập nhật trạng thái cho `rows` (tuple theo UPSERT_SQL của app) trên cursor
+    của transaction đang ghi. Trả về list cờ (datetime, zone, source, value, expected, score, reason).
+    Chạy trong SAVEPOINT: lỗi ở đây chỉ bỏ phần anomaly, không làm mất dòng measurement.
+    """
+    if not ANOMALY_ENABLED or not rows:
+        return []
+    cur.execute("SAVEPOINT anomaly_detect")
+    try:
+        flags = _detect(cur, rows)
+    except Exception as e:
+        cur.execute("ROLLBACK TO SAVEPOINT anomaly_detect")
+        telemetry.incr("errors", stage="anomaly_detect")
+        print(f"[WARN] Anomaly detection skipped: {e}")
+        return []
+    cur.execute("RELEASE SAVEPOINT anomaly_detect")
+    return flags
+
+
+def _detect(cur, rows):
+    rows = sorted(((parse_datetime(r[0]), r[1], r[2:]) for r in rows if r[0] and r[1]), key=lambda r: r[0])
+    zones = sorted({zone for _, zone, _ in rows})
+
+    # Khoá trạng thái của các zone liên quan (tối đa 24 x 9 dòng / zone) rồi xử lý trong RAM
+    cur.execute("""
+        SELECT zone, source, hour, n, mean, var FROM anomaly_state
+        WHERE zone = ANY(%s) FOR UPDATE
+    """, (zones,))
+    state = {(z, s, h): (n, m, v) for z, s, h, n, m, v in cur.fetchall()}
+    touched = set()
+    flags = []
+
+    for dt, zone, values in rows:
+        for source, value in zip(SOURCES, values):
+            if value is None:
+                continue
+            value = float(value)
+            key = (zone, source, dt.hour)
+            current = state.get(key, (0, 0.0, 0.0))
+            z, reason = score(value, current)
+            if reason:
+                flags.append((dt, zone, source, value, current[1], round(z, 3), reason))
+                telemetry.incr("anomalies", reason=reason, source=source)
+            state[key] = update(value, current, flagged=reason is not None)
+            touched.add(key)
+
+    with telemetry.span("anomaly_state"):
+        execute_values(cur, """
+            INSERT INTO anomaly_state (zone, source, hour, n, mean, var) VALUES %s
+            ON CONFLICT (zone, source, hour) DO UPDATE SET
+                n = EXCLUDED.n, mean = EXCLUDED.mean, var = EXCLUDED.var, updated_at = NOW()
+        """, [key + state[key] for key in touched])
+
+        # Dòng được ghi lại (API sửa số liệu) -> cờ cũ của giờ đó không còn đúng
+        for zone in zones:
+            cur.execute(
+                "DELETE FROM measurement_anomalies WHERE zone = %s AND datetime = ANY(%s)",
+                (zone, [dt for dt, z, _ in rows if z == zone]),
+            )
+        if flags:
+            execute_values(cur, """
+                INSERT INTO measurement_anomalies (datetime, zone, source, value, expected, score, reason)
+                VALUES %s
+            """, flags)
+
+    if flags:
+        print(f"⚠️ {len(flags)} anomalous values flagged: "
+              + ", ".join(f"{f[0]:%Y-%m-%d %H:00} {f[2]}={f[3]:.1f} ({f[6]}, z={f[5]})" for f in flags[:5]))
+    return flags
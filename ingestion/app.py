@@ -1,7 +1,13 @@
 import os
+import json
 import time
-import requests
 import psycopg2
+from psycopg2.extras import execute_values
+import anomaly
+import archive
+import grid_status
+from completeness import COMPLETENESS_SQL, GAP_SQL
+import telemetry
 from datetime import datetime, timedelta, timezone
 
 # --- CẤU HÌNH ENVIRONMENT ---
@@ -9,6 +15,14 @@ AUTH_TOKEN = os.getenv("AUTH_TOKEN")
 ZONE = "US-CAL-LDWP"
 # Mặc định backfill 30 ngày nếu không có dữ liệu
 HISTORY_DAYS = int(os.getenv("HISTORY_DAYS", 30)) 
+# Giờ toàn 0 (nguồn trả rỗng) chỉ được backfill lấy lại khi mới hơn chừng này giờ; cũ hơn thì
+# coi như nguồn không có dữ liệu cho giờ đó, không gọi lại API ở mọi lần backfill
+BACKFILL_ZERO_RETRY_HOURS = int(os.getenv("BACKFILL_ZERO_RETRY_HOURS", 72))
+# Job backfill 'running' không có tiến độ quá chừng này giờ -> 'expired', không tự resume nữa
+BACKFILL_JOB_MAX_AGE_HOURS = int(os.getenv("BACKFILL_JOB_MAX_AGE_HOURS", 24))
+
+# Snapshot dashboard dùng chung với analysis/clustering (xem snapshots.py); rỗng -> không publish
+SNAPSHOT_URI = os.getenv("SNAPSHOT_URI", "")
 
 DB_HOST = os.getenv("DB_HOST")
 DB_NAME = os.getenv("DB_NAME")
@@ -26,10 +40,16 @@ def get_db_connection():
 
 def fetch_data_from_api(url, params, max_retries=3):
     """Gọi API ElectricityMaps với Retry."""
+    # Import muộn: requests (+ urllib3, charset detection...) chỉ cần khi gọi API thật
+    import requests
     headers = {"auth-token": AUTH_TOKEN}
     for attempt in range(max_retries):
+        if attempt > 0:
+            telemetry.incr("retries", stage="api_fetch")
         try:
-            response = requests.get(url, headers=headers, params=params, timeout=30) # Tăng timeout vì response có thể nặng
+            with telemetry.span("api_fetch"):
+                response = requests.get(url, headers=headers, params=params, timeout=30) # Tăng timeout vì response có thể nặng
+            telemetry.incr("bytes_in", len(response.content), stage="api_fetch")
             if response.status_code == 200:
                 return response.json()
             elif response.status_code == 429:
@@ -44,135 +64,389 @@ def fetch_data_from_api(url, params, max_retries=3):
             time.sleep(2)
     return None
 
+# updated_at: thời điểm dòng được insert/thay đổi lần cuối -> API trả delta theo `since`
+# cluster_id: do clustering ghi, nhưng grid_status.REFRESH_SQL đọc nó ngay từ lần ingest đầu tiên
+SCHEMA_DDL = """
+    ALTER TABLE electricity_measurements ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT NOW();
+    ALTER TABLE electricity_measurements ADD COLUMN IF NOT EXISTS cluster_id INTEGER;
+    CREATE INDEX IF NOT EXISTS idx_electricity_measurements_updated_at ON electricity_measurements (updated_at);
+""" + grid_status.DDL + anomaly.DDL
+
+_schema_ready = False
+
+def ensure_schema():
+    """Chạy DDL một lần mỗi container (Lambda tái sử dụng process giữa các lần invoke)."""
+    global _schema_ready
+    if _schema_ready:
+        return
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(SCHEMA_DDL)
+        conn.commit()
+        _schema_ready = True
+    finally:
+        conn.close()
+
+UPSERT_SQL = """
+    INSERT INTO electricity_measurements 
+    (datetime, zone, carbon_intensity, solar_mw, wind_mw, gas_mw, unknown_mw, 
+     hydro_mw, biomass_mw, nuclear_mw, geothermal_mw)
+    VALUES %s
+    ON CONFLICT (datetime) DO UPDATE SET
+        carbon_intensity = EXCLUDED.carbon_intensity,
+        solar_mw = EXCLUDED.solar_mw,
+        wind_mw = EXCLUDED.wind_mw,
+        gas_mw = EXCLUDED.gas_mw,
+        unknown_mw = EXCLUDED.unknown_mw,
+        hydro_mw = EXCLUDED.hydro_mw,
+        biomass_mw = EXCLUDED.biomass_mw,
+        nuclear_mw = EXCLUDED.nuclear_mw,
+        geothermal_mw = EXCLUDED.geothermal_mw,
+        updated_at = NOW()
+    -- Bỏ qua dòng không đổi: /latest thường trả lại đúng giờ cũ, update y hệt chỉ sinh WAL + dead tuple
+    WHERE (electricity_measurements.carbon_intensity, electricity_measurements.solar_mw,
+           electricity_measurements.wind_mw, electricity_measurements.gas_mw,
+           electricity_measurements.unknown_mw, electricity_measurements.hydro_mw,
+           electricity_measurements.biomass_mw, electricity_measurements.nuclear_mw,
+           electricity_measurements.geothermal_mw)
+          IS DISTINCT FROM
+          (EXCLUDED.carbon_intensity, EXCLUDED.solar_mw, EXCLUDED.wind_mw, EXCLUDED.gas_mw,
+           EXCLUDED.unknown_mw, EXCLUDED.hydro_mw, EXCLUDED.biomass_mw, EXCLUDED.nuclear_mw,
+           EXCLUDED.geothermal_mw)
+    RETURNING datetime;
+"""
+
+def extract_measurement(data_item):
+    """
+    Chuyển 1 item JSON của API thành tuple theo thứ tự cột của UPSERT_SQL.
+    FIX: Đổi sang dùng powerConsumptionBreakdown để lấy dữ liệu tiêu thụ (bao gồm nhập khẩu).
+    """
+    dt_str = data_item.get('datetime') 
+    zone_id = data_item.get('zone')
+    
+    # Carbon Intensity
+    carbon = data_item.get('carbonIntensity', 0) 
+    
+    # --- THAY ĐỔI Ở ĐÂY ---
+    # Ưu tiên lấy Consumption (Tiêu thụ)
+    # Nếu Consumption không có thì mới lấy Production (dự phòng)
+    consumption = data_item.get('powerConsumptionBreakdown', {}) or {}
+    production = data_item.get('powerProductionBreakdown', {}) or {}
+    
+    # Dùng consumption làm nguồn chính
+    source_data = consumption if consumption else production
+    
+    # Helper để lấy giá trị an toàn
+    def get_val(key):
+        val = source_data.get(key)
+        return val if val is not None else 0
+
+    return (
+        dt_str, zone_id, carbon,
+        get_val('solar'), get_val('wind'), get_val('gas'), get_val('unknown'),
+        get_val('hydro'), get_val('biomass'), get_val('nuclear'), get_val('geothermal'),
+    )
+
 def save_to_db(data_item):
     """
     Lưu 1 record vào DB.
-    FIX: Đổi sang dùng powerConsumptionBreakdown để lấy dữ liệu tiêu thụ (bao gồm nhập khẩu).
+    Trả về True nếu dòng được insert/update (dữ liệu mới hoặc khác), False nếu
+    giống hệt dữ liệu đang có hoặc lỗi.
     """
+    dt_str = data_item.get('datetime')
+    conn = None
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-
-        dt_str = data_item.get('datetime') 
-        zone_id = data_item.get('zone')
-        
-        # Carbon Intensity
-        carbon = data_item.get('carbonIntensity', 0) 
-        
-        # --- THAY ĐỔI Ở ĐÂY ---
-        # Ưu tiên lấy Consumption (Tiêu thụ)
-        # Nếu Consumption không có thì mới lấy Production (dự phòng)
-        consumption = data_item.get('powerConsumptionBreakdown', {}) or {}
-        production = data_item.get('powerProductionBreakdown', {}) or {}
-        
-        # Dùng consumption làm nguồn chính
-        source_data = consumption if consumption else production
-        
-        # Helper để lấy giá trị an toàn
-        def get_val(key):
-            val = source_data.get(key)
-            return val if val is not None else 0
-
-        solar = get_val('solar')
-        wind = get_val('wind')
-        gas = get_val('gas')
-        unknown = get_val('unknown')
-        hydro = get_val('hydro')
-        biomass = get_val('biomass')
-        nuclear = get_val('nuclear')
-        geothermal = get_val('geothermal')
+        row = extract_measurement(data_item)
+        solar, wind, gas = row[3], row[4], row[5]
         
         # Debug: In ra nếu thấy dữ liệu vẫn bằng 0 để kiểm tra
         if solar == 0 and wind == 0 and gas == 0:
             print(f"[WARN] Data is all zeros for {dt_str}. Check API response.")
 
-        sql = """
-            INSERT INTO electricity_measurements 
-            (datetime, zone, carbon_intensity, solar_mw, wind_mw, gas_mw, unknown_mw, 
-             hydro_mw, biomass_mw, nuclear_mw, geothermal_mw)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            ON CONFLICT (datetime) DO UPDATE SET
-                carbon_intensity = EXCLUDED.carbon_intensity,
-                solar_mw = EXCLUDED.solar_mw,
-                wind_mw = EXCLUDED.wind_mw,
-                gas_mw = EXCLUDED.gas_mw,
-                unknown_mw = EXCLUDED.unknown_mw,
-                hydro_mw = EXCLUDED.hydro_mw,
-                biomass_mw = EXCLUDED.biomass_mw,
-                nuclear_mw = EXCLUDED.nuclear_mw,
-                geothermal_mw = EXCLUDED.geothermal_mw;
-        """
-        cur.execute(sql, (dt_str, zone_id, carbon, solar, wind, gas, unknown, 
-                          hydro, biomass, nuclear, geothermal))
-        conn.commit()
-        cur.close()
-        conn.close()
+        conn = get_db_connection()
+        with conn.cursor() as cur, telemetry.span("db_upsert"):
+            changed = bool(execute_values(cur, UPSERT_SQL, [row], fetch=True))
+            if changed:
+                # Cùng transaction: /status/latest không bao giờ thấy snapshot lệch với measurements.
+                # Cả hai chạy trong SAVEPOINT riêng -> lỗi của chúng không làm mất dòng measurement.
+                anomaly.detect(cur, [row])
+                grid_status.refresh(cur, row[1])
+            conn.commit()
+        telemetry.incr("rows_out" if changed else "rows_unchanged", stage="db_upsert")
+        return changed
         
     except Exception as e:
+        telemetry.incr("errors", stage="db_upsert")
         print(f"[DB ERROR] {e} | Data: {dt_str}")
+        return False
+    finally:
+        if conn is not None:
+            conn.close()
         
+def publish_measurements_snapshot(rows_changed):
+    """
+    Publish snapshot measurements cho API ngay sau khi DB đổi: /measurements, trend, seasonal,
+    correlations đọc snapshot nên không được chờ tới lần analysis/clustering kế tiếp.
+    Không có SNAPSHOT_URI hoặc không dòng nào đổi -> bỏ qua; lỗi chỉ log.
+    """
+    if not rows_changed or not SNAPSHOT_URI:
+        return None
+    # Import muộn: numpy chỉ cần khi thực sự publish, không tính vào cold start của handler
+    import snapshots
+    try:
+        conn = get_db_connection()
+    except Exception as e:
+        print(f"[WARN] Snapshot measurements not published: {e}")
+        return None
+    try:
+        return snapshots.publish_measurements(conn)
+    finally:
+        conn.close()
+
 def run_realtime_job():
-    """Job chính: Lấy dữ liệu mới nhất (Giữ nguyên)."""
+    """Job chính: Lấy dữ liệu mới nhất. Trả về True nếu DB thực sự thay đổi."""
     print(f"--- Starting Realtime Job: {datetime.now()} ---")
+    ensure_schema()
     url = "https://api.electricitymaps.com/v3/power-breakdown/latest"
     params = {"zone": ZONE}
     data = fetch_data_from_api(url, params)
     
     if data:
-        save_to_db(data)
-        print(f"[SUCCESS] Realtime data saved for {data.get('datetime')}")
+        telemetry.incr("rows_in", stage="api_fetch")
+        archive.archive_response(ZONE, "latest", data.get('datetime'), data.get('datetime'), data)
+        if save_to_db(data):
+            print(f"[SUCCESS] Realtime data saved for {data.get('datetime')}")
+            publish_measurements_snapshot(1)
+            return True
+        print(f"[INFO] No change for {data.get('datetime')}, skipped update.")
     else:
         print("[INFO] Không lấy được dữ liệu Realtime.")
+    return False
 
-def run_backfill_job(force_start_date=None):
-    """
-    Job phụ: Dùng API /past-range để lấy cục dữ liệu lớn 1 lần.
-    """
-    print("--- Starting Bulk Backfill Job (Range API) ---")
-    
-    now_utc = datetime.now(timezone.utc)
-    
-    # 1. Xác định Start Date
+# API /past-range giới hạn tối đa 10 ngày (240 giờ) mỗi lần gọi
+MAX_WINDOW_HOURS = 240
+
+def _utc_naive(dt):
+    """Chuẩn hoá về UTC không tz (cột datetime lưu giờ UTC)."""
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
+
+def _backfill_bounds(force_start_date=None):
+    """[start, end] theo giờ tròn (UTC): end là giờ đã kết thúc gần nhất."""
+    now_utc = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0, tzinfo=None)
     if force_start_date:
-        start_date = datetime.strptime(force_start_date, "%Y-%m-%d").replace(tzinfo=timezone.utc)
-        print(f"⚠️ FORCED BACKFILL from: {start_date}")
+        start = datetime.strptime(force_start_date, "%Y-%m-%d")
     else:
-        # Check DB xem dữ liệu mới nhất là khi nào
-        try:
-            conn = get_db_connection()
-            cur = conn.cursor()
-            cur.execute("SELECT MAX(datetime) FROM electricity_measurements WHERE zone = %s;", (ZONE,))
-            result = cur.fetchone()
-            cur.close()
-            conn.close()
-            latest_db_time = result[0] if result else None
-        except Exception:
-            latest_db_time = None
-
-        if latest_db_time:
-            if latest_db_time.tzinfo is None:
-                latest_db_time = latest_db_time.replace(tzinfo=timezone.utc)
-            start_date = latest_db_time + timedelta(hours=1)
+        start = now_utc - timedelta(days=HISTORY_DAYS)
+    return start, now_utc - timedelta(hours=1)
+
+def find_missing_hours(zone, start, end):
+    """
+    Danh sách các giờ (UTC) thiếu dữ liệu trong [start, end], tính hoàn toàn trong SQL.
+    Giờ toàn 0 cũ hơn BACKFILL_ZERO_RETRY_HOURS không tính là thiếu (xem completeness.GAP_SQL).
+    """
+    zero_retry_from = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(hours=BACKFILL_ZERO_RETRY_HOURS)
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            with telemetry.span("gap_detect"):
+                cur.execute(GAP_SQL, {"start": _utc_naive(start), "end": _utc_naive(end), "zone": zone,
+                                      "zero_retry_from": zero_retry_from})
+                return [row[0] for row in cur.fetchall()]
+    finally:
+        conn.close()
+
+def merge_into_windows(missing_hours, max_hours=MAX_WINDOW_HOURS):
+    """
+    Gộp các giờ thiếu (đã sort) thành ít cửa sổ /past-range nhất có thể.
+    Greedy: mở cửa sổ tại giờ thiếu đầu tiên, nuốt các giờ thiếu tiếp theo cho đến
+    khi vượt max_hours (tối ưu với bài toán phủ điểm bằng đoạn độ dài cố định).
+    Trả về list (start, end) với end = giờ thiếu cuối cùng + 1h (exclusive).
+    """
+    windows = []
+    limit = timedelta(hours=max_hours)
+    for slot in missing_hours:
+        if windows and slot + timedelta(hours=1) - windows[-1][0] <= limit:
+            windows[-1][1] = slot + timedelta(hours=1)
         else:
-            start_date = now_utc - timedelta(days=HISTORY_DAYS)
+            windows.append([slot, slot + timedelta(hours=1)])
+    return [tuple(w) for w in windows]
 
-    # 2. Xác định End Date (Là hiện tại)
-    # Lưu ý: API ElectricityMaps giới hạn range tối đa là 10 ngày (240 giờ) mỗi lần gọi.
-    # Nên chúng ta cần chia nhỏ nếu khoảng thời gian > 10 ngày.
-    
-    current_chunk_start = start_date
-    
-    while current_chunk_start < now_utc:
-        # Lấy tối đa 10 ngày mỗi lần gọi (để an toàn với API limit)
-        chunk_end = min(current_chunk_start + timedelta(days=10), now_utc)
-        
-        # Format ISO string cho API
-        start_str = current_chunk_start.isoformat()
-        end_str = chunk_end.isoformat()
+def data_completeness_report(zone=ZONE, days=HISTORY_DAYS, max_windows=50):
+    """Báo cáo độ đầy đủ của chuỗi giờ trong `days` ngày gần nhất (bao nhiêu giờ sẽ phải interpolate)."""
+    end = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0, tzinfo=None) - timedelta(hours=1)
+    start = end - timedelta(days=days) + timedelta(hours=1)
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(COMPLETENESS_SQL, {"start": start, "end": end, "zone": zone})
+            expected, present, zeros = cur.fetchone()
+    finally:
+        conn.close()
+    windows = merge_into_windows(find_missing_hours(zone, start, end))
+    missing = expected - present
+    return {
+        "zone": zone,
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "expected_hours": expected,
+        "present_hours": present,
+        "missing_hours": missing,
+        "zero_hours": zeros,
+        "completeness_pct": round(100.0 * (present - zeros) / expected, 2) if expected else 0.0,
+        "gap_windows": [[a.isoformat(), b.isoformat()] for a, b in windows[:max_windows]],
+        "gap_window_count": len(windows),
+    }
+
+PROGRESS_DDL = """
+    CREATE TABLE IF NOT EXISTS ingestion_backfill_progress (
+        job_id VARCHAR(64) PRIMARY KEY,
+        zone VARCHAR(32) NOT NULL,
+        pending_windows JSONB NOT NULL,
+        chunks_done INTEGER NOT NULL DEFAULT 0,
+        status VARCHAR(16) NOT NULL,
+        created_at TIMESTAMP DEFAULT NOW(),
+        updated_at TIMESTAMP DEFAULT NOW()
+    )
+"""
+
+def _windows_to_json(windows):
+    return json.dumps([[a.isoformat(), b.isoformat()] for a, b in windows])
+
+def _windows_from_json(value):
+    rows = json.loads(value) if isinstance(value, str) else value
+    return [(datetime.fromisoformat(a), datetime.fromisoformat(b)) for a, b in rows]
+
+def _create_backfill_job(zone, windows):
+    job_id = f"{zone}-{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%f')}"
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(PROGRESS_DDL)
+            # Job mới (vd ép start_date) thay mọi job đang chạy của zone: chúng không được resume nữa
+            cur.execute("""
+                UPDATE ingestion_backfill_progress SET status = 'superseded', updated_at = NOW()
+                WHERE zone = %s AND status = 'running'
+            """, (zone,))
+            if cur.rowcount:
+                print(f"[INFO] Superseded {cur.rowcount} running backfill job(s) of {zone}.")
+            cur.execute("""
+                INSERT INTO ingestion_backfill_progress (job_id, zone, pending_windows, status)
+                VALUES (%s, %s, %s, %s)
+            """, (job_id, zone, _windows_to_json(windows), 'running' if windows else 'completed'))
+        conn.commit()
+    finally:
+        conn.close()
+    return job_id
+
+def _load_backfill_job(zone, job_id=None):
+    """
+    Lấy job theo continuation token, hoặc job 'running' gần nhất của zone nếu không có token.
+    Job 'running' không có tiến độ trong BACKFILL_JOB_MAX_AGE_HOURS được đánh dấu 'expired'
+    trước (cửa sổ của nó đã cũ, chạy backfill mới sẽ tìm lỗ lại từ đầu).
+    """
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(PROGRESS_DDL)
+            cur.execute("""
+                UPDATE ingestion_backfill_progress SET status = 'expired', updated_at = NOW()
+                WHERE zone = %s AND status = 'running'
+                  AND updated_at < NOW() - make_interval(hours => %s)
+            """, (zone, BACKFILL_JOB_MAX_AGE_HOURS))
+            if cur.rowcount:
+                print(f"[INFO] Expired {cur.rowcount} stale backfill job(s) of {zone}.")
+            conn.commit()
+            if job_id:
+                cur.execute("SELECT job_id, pending_windows, status FROM ingestion_backfill_progress WHERE job_id = %s", (job_id,))
+            else:
+                cur.execute("""
+                    SELECT job_id, pending_windows, status FROM ingestion_backfill_progress
+                    WHERE zone = %s AND status = 'running'
+                    ORDER BY created_at DESC LIMIT 1
+                """, (zone,))
+            row = cur.fetchone()
+    finally:
+        conn.close()
+    if row is None:
+        return None
+    return row[0], _windows_from_json(row[1]), row[2]
+
+def _checkpoint_backfill_job(job_id, pending):
+    """
+    Ghi lại cursor sau mỗi chunk đã lưu -> lần chạy sau không gọi lại API cho chunk này.
+    Trả về False nếu job không còn 'running' (bị job mới thay / hết hạn trong lúc chạy).
+    """
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                UPDATE ingestion_backfill_progress
+                SET pending_windows = %s, chunks_done = chunks_done + 1, status = %s, updated_at = NOW()
+                WHERE job_id = %s AND status = 'running'
+            """, (_windows_to_json(pending), 'running' if pending else 'completed', job_id))
+            active = cur.rowcount > 0
+        conn.commit()
+    finally:
+        conn.close()
+    return active
+
+def run_backfill_job(force_start_date=None, continuation_token=None, should_stop=None):
+    """
+    Job phụ: Tìm các giờ bị thiếu (kể cả lỗ ở giữa lịch sử, không chỉ sau MAX(datetime))
+    rồi dùng API /past-range để lấy đúng các khoảng đó.
+
+    Tiến độ được checkpoint vào ingestion_backfill_progress sau mỗi chunk. Nếu
+    should_stop() trả True (sắp hết thời gian Lambda) job dừng sạch sẽ và trả về
+    continuation_token để lần gọi sau chạy tiếp đúng chỗ, không lặp lại API call.
+    """
+    print("--- Starting Gap-aware Backfill Job (Range API) ---")
+    should_stop = should_stop or (lambda: False)
+    ensure_schema()
+
+    # 1. Tiếp tục job dở dang (token, hoặc job 'running' gần nhất khi không ép start_date)
+    job = None
+    if continuation_token or not force_start_date:
+        job = _load_backfill_job(ZONE, continuation_token)
+    if continuation_token and job is None:
+        raise ValueError(f"Unknown continuation token: {continuation_token}")
+
+    if job and job[2] in ('superseded', 'expired'):
+        print(f"[INFO] Backfill {job[0]} was {job[2]}, not resuming.")
+        return {"status": job[2], "continuation_token": None, "job_id": job[0], "remaining_windows": 0,
+                "rows_changed": 0}
+    if job:
+        job_id, pending, status = job
+        print(f"⏩ Resuming backfill {job_id}: {len(pending)} windows left ({status}).")
+    else:
+        # 2. Xác định khoảng cần kiểm tra, tìm lỗ và gộp thành các cửa sổ <= 10 ngày
+        start_date, end_date = _backfill_bounds(force_start_date)
+        if force_start_date:
+            print(f"⚠️ FORCED BACKFILL from: {start_date}")
+        missing = find_missing_hours(ZONE, start_date, end_date)
+        pending = merge_into_windows(missing)
+        telemetry.incr("missing_hours", len(missing))
+        print(f"🔎 {len(missing)} missing hours between {start_date} and {end_date} -> {len(pending)} API windows.")
+        job_id = _create_backfill_job(ZONE, pending)
+
+    url = "https://api.electricitymaps.com/v3/power-breakdown/past-range"
+    rows_changed = 0
+    while pending:
+        if should_stop():
+            print(f"⏸️ Time budget low, stopping. {len(pending)} windows left -> token {job_id}")
+            publish_measurements_snapshot(rows_changed)
+            return {"status": "partial", "continuation_token": job_id, "remaining_windows": len(pending),
+                    "rows_changed": rows_changed}
+
+        window_start, window_end = pending[0]
+        # Format ISO string cho API (UTC)
+        start_str = window_start.replace(tzinfo=timezone.utc).isoformat()
+        end_str = window_end.replace(tzinfo=timezone.utc).isoformat()
         
         print(f"📥 Fetching range: {start_str} -> {end_str}")
         
-        url = "https://api.electricitymaps.com/v3/power-breakdown/past-range"
         params = {
             "zone": ZONE,
             "start": start_str,
@@ -183,21 +457,30 @@ def run_backfill_job(force_start_date=None):
         
         if response_json and 'data' in response_json:
             items = response_json['data']
+            telemetry.incr("rows_in", len(items), stage="api_fetch")
+            archive.archive_response(ZONE, "past-range", window_start, window_end, response_json)
             print(f"   -> Received {len(items)} records. Saving to DB...")
             
             # Lưu vào DB
             for item in items:
                 # API trả về item có key 'datetime', 'powerProductionBreakdown'... khớp với logic save
-                save_to_db(item)
+                rows_changed += save_to_db(item)
                 
             print(f"   ✅ Batch saved.")
         else:
             print("   ⚠️ No data received or API error.")
-        
-        # Move to next chunk
-        current_chunk_start = chunk_end
+
+        pending = pending[1:]
+        if not _checkpoint_backfill_job(job_id, pending):
+            print(f"[INFO] Backfill {job_id} was superseded or expired, stopping.")
+            publish_measurements_snapshot(rows_changed)
+            return {"status": "superseded", "continuation_token": None, "job_id": job_id,
+                    "remaining_windows": len(pending), "rows_changed": rows_changed}
         
         # Nghỉ xíu để ko spam API
         time.sleep(1)
 
-    print("--- Backfill Job Completed ---")
\ No newline at end of file
+    print("--- Backfill Job Completed ---")
+    publish_measurements_snapshot(rows_changed)
+    return {"status": "completed", "continuation_token": None, "job_id": job_id, "remaining_windows": 0,
+            "rows_changed": rows_changed}
@@ -0,0 +1,291 @@
+"""
+Lưu trữ nguyên bản (raw) các response của ElectricityMaps API + replay offline.
+
+Mỗi page API được ghi thành 1 object nén (zstd nếu có `zstandard`, không thì gzip),
+nội dung JSONL, mỗi dòng là một envelope:
+    {"fetched_at": ..., "zone": ..., "kind": ..., "window": [start, end], "response": <raw JSON>}
+
+Key: <prefix>/<zone>/<kind>/<start>_<end>_<fetched_at>.jsonl.<zst|gz>
+RAW_ARCHIVE_URI là thư mục local hoặc s3://bucket/prefix (dùng AWS_ENDPOINT_URL
+cho store S3-compatible như MinIO). Không đặt biến này -> archive tắt.
+
+Replay dựng lại electricity_measurements từ archive, không gọi API:
+    python archive.py replay --uri s3://bucket/raw --workers 4
+    python archive.py replay --uri ./raw --kind past-range --dry-run
+"""
+import argparse
+import gzip
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
+import telemetry
+
+ARCHIVE_URI = os.getenv("RAW_ARCHIVE_URI", "")
+# auto = zstd nếu cài zstandard, ngược lại gzip
+ARCHIVE_CODEC = os.getenv("RAW_ARCHIVE_CODEC", "auto")
+
+STAMP_FORMAT = "%Y%m%dT%H%M%SZ"
+
+
+def _codec():
+    if ARCHIVE_CODEC in ("auto", "zstd"):
+        try:
+            import zstandard  # noqa: F401
+            return "zst"
+        except ImportError:
+            if ARCHIVE_CODEC == "zstd":
+                print("[WARN] zstandard not installed, archiving with gzip.")
+    return "gz"
+
+
+def _compress(raw, ext):
+    if ext == "zst":
+        import zstandard
+        return zstandard.ZstdCompressor(level=10).compress(raw)
+    return gzip.compress(raw, compresslevel=6)
+
+
+def _decompress(blob, key):
+    if key.endswith(".zst"):
+        import zstandard
+        return zstandard.ZstdDecompressor().decompressobj().decompress(blob)
+    return gzip.decompress(blob)
+
+
+def _stamp(value):
+    """datetime hoặc chuỗi ISO của API -> 20251129T090000Z (an toàn cho tên file)."""
+    if value is None:
+        return "none"
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        except ValueError:
+            return "".join(c for c in value if c.isalnum())
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc)
+    return value.strftime(STAMP_FORMAT)
+
+
+def _split_s3(uri):
+    bucket, _, prefix = uri[len("s3://"):].partition("/")
+    return bucket, prefix.strip("/")
+
+
+def _s3_client():
+    import boto3
+    return boto3.client("s3", endpoint_url=os.getenv("AWS_ENDPOINT_URL") or None)
+
+
+def _put(uri, key, blob):
+    if uri.startswith("s3://"):
+        bucket, prefix = _split_s3(uri)
+        _s3_client().put_object(Bucket=bucket, Key=f"{prefix}/{key}" if prefix else key, Body=blob)
+        return
+    path = os.path.join(uri, key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(blob)
+    os.replace(tmp, path)
+
+
+def _get(uri, key):
+    if uri.startswith("s3://"):
+        bucket, prefix = _split_s3(uri)
+        obj = _s3_client().get_object(Bucket=bucket, Key=f"{prefix}/{key}" if prefix else key)
+        return obj["Body"].read()
+    with open(os.path.join(uri, key), "rb") as f:
+        return f.read()
+
+
+def list_archive(uri=None, zone=None, kinds=None):
+    """Các key (tương đối so với uri) của archive, lọc theo zone/kind."""
+    uri = uri or ARCHIVE_URI
+    suffixes = (".jsonl.zst", ".jsonl.gz")
+    keys = []
+    if uri.startswith("s3://"):
+        bucket, prefix = _split_s3(uri)
+        base = f"{prefix}/" if prefix else ""
+        paginator = _s3_client().get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=bucket, Prefix=base + (f"{zone}/" if zone else "")):
+            keys.extend(obj["Key"][len(base):] for obj in page.get("Contents", []))
+    else:
+        root = os.path.join(uri, zone) if zone else uri
+        for dirpath, _, files in os.walk(root):
+            keys.extend(os.path.relpath(os.path.join(dirpath, f), uri).replace(os.sep, "/") for f in files)
+
+    keys = [k for k in keys if k.endswith(suffixes)]
+    if kinds:
+        keys = [k for k in keys if k.split("/")[-2] in kinds]
+    return keys
+
+
+def fetched_at_of(key):
+    """Thời điểm fetch nằm ở cuối tên file -> dùng để sắp xếp (bản fetch sau thắng)."""
+    return os.path.basename(key).split(".")[0].rsplit("_", 1)[-1]
+
+
+def archive_response(zone, kind, start, end, payload, uri=None):
+    """
+    Ghi 1 page response vào archive. Không bao giờ raise: lỗi archive chỉ cảnh báo,
+    không được làm hỏng luồng ingest chính. Trả về key đã ghi (hoặc None).
+    """
+    uri = uri or ARCHIVE_URI
+    if not uri or payload is None:
+        return None
+    try:
+        fetched_at = datetime.now(timezone.utc)
+        ext = _codec()
+        key = f"{zone}/{kind}/{_stamp(start)}_{_stamp(end)}_{_stamp(fetched_at)}.jsonl.{ext}"
+        envelope = {
+            "fetched_at": fetched_at.isoformat(),
+            "zone": zone,
+            "kind": kind,
+            "window": [str(start) if start is not None else None, str(end) if end is not None else None],
+            "response": payload,
+        }
+        raw = (json.dumps(envelope, separators=(",", ":"), default=str) + "\n").encode("utf-8")
+        with telemetry.span("archive_put", kind=kind):
+            blob = _compress(raw, ext)
+            _put(uri, key, blob)
+        telemetry.incr("archive_bytes", len(blob), kind=kind)
+        return key
+    except Exception as e:
+        telemetry.incr("errors", stage="archive_put")
+        print(f"[WARN] Could not archive {kind} response: {e}")
+        return None
+
+
+def _items(envelope):
+    response = envelope.get("response") or {}
+    if isinstance(response, dict) and isinstance(response.get("data"), list):
+        return response["data"]
+    return [response]
+
+
+def parse_object(uri, key):
+    """Worker: tải + giải nén 1 object, trả về list tuple theo UPSERT_SQL của app."""
+    from app import extract_measurement  # import muộn để tránh import vòng app <-> archive
+
+    text = _decompress(_get(uri, key), key).decode("utf-8")
+    rows = []
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        for item in _items(json.loads(line)):
+            if item.get("datetime"):
+                rows.append(extract_measurement(item))
+    return rows
+
+
+def _parse_task(args):
+    return parse_object(*args)
+
+
+def replay_archive(uri=None, zone=None, kinds=None, workers=None, batch_size=5000, dry_run=False):
+    """
+    Dựng lại electricity_measurements từ archive.
+
+    Parse/giải nén chạy song song trong process pool; ghi DB ở process chính bằng
+    execute_values theo batch. Object được xử lý theo thứ tự fetched_at nên khi cùng
+    một giờ xuất hiện ở nhiều page, bản fetch sau cùng thắng (giống ingest thật).
+    """
+    from app import UPSERT_SQL, ensure_schema, get_db_connection
+    import anomaly
+    import grid_status
+    from psycopg2.extras import execute_values
+
+    uri = uri or ARCHIVE_URI
+    if not uri:
+        raise ValueError("RAW_ARCHIVE_URI is not set")
+
+    keys = sorted(list_archive(uri, zone, kinds), key=lambda k: (fetched_at_of(k), k))
+    print(f"--- Replaying {len(keys)} archived pages from {uri} ---")
+    started = time.perf_counter()
+    stats = {"objects": len(keys), "rows_parsed": 0, "rows_written": 0}
+    if not keys:
+        return stats
+
+    if not dry_run:
+        ensure_schema()
+    conn = None if dry_run else get_db_connection()
+    pending = {}
+
+    def flush():
+        if not pending:
+            return
+        if conn is not None:
+            with conn.cursor() as cur, telemetry.span("db_upsert", stage="replay"):
+                # RETURNING chỉ trả các dòng mới/khác -> rows_written không tính dòng giống hệt
+                changed = execute_values(cur, UPSERT_SQL, list(pending.values()), page_size=batch_size, fetch=True)
+                if changed:
+                    changed_at = {r[0] for r in changed}
+                    anomaly.detect(cur, [row for row in pending.values()
+                                         if row[0] and anomaly.parse_datetime(row[0]) in changed_at])
+                    for zone in {row[1] for row in pending.values() if row[1]}:
+                        grid_status.refresh(cur, zone)
+            conn.commit()
+            stats["rows_written"] += len(changed)
+        else:
+            stats["rows_written"] += len(pending)
+        pending.clear()
+
+    tasks = [(uri, key) for key in keys]
+    workers = workers or os.cpu_count() or 1
+    try:
+        if workers > 1:
+            pool = ProcessPoolExecutor(max_workers=workers)
+            results = pool.map(_parse_task, tasks, chunksize=max(1, len(tasks) // (workers * 4)))
+        else:
+            pool = None
+            results = map(_parse_task, tasks)
+
+        for rows in results:
+            stats["rows_parsed"] += len(rows)
+            for row in rows:
+                # Dedupe trong batch: ON CONFLICT không cho update cùng 1 datetime 2 lần/lệnh
+                pending.pop(row[0], None)
+                pending[row[0]] = row
+            if len(pending) >= batch_size:
+                flush()
+        flush()
+        if pool is not None:
+            pool.shutdown()
+    finally:
+        if conn is not None:
+            conn.close()
+
+    elapsed = time.perf_counter() - started
+    print(f"✅ Replay done: {stats['rows_parsed']} rows parsed, {stats['rows_written']} upserted "
+          f"in {elapsed:.1f}s{' (dry run)' if dry_run else ''}.")
+    stats["seconds"] = round(elapsed, 3)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    replay = sub.add_parser("replay", help="Ghi lại electricity_measurements từ archive")
+    replay.add_argument("--uri", default=ARCHIVE_URI)
+    replay.add_argument("--zone")
+    replay.add_argument("--kind", action="append", choices=["latest", "past-range"])
+    replay.add_argument("--workers", type=int, default=None)
+    replay.add_argument("--batch-size", type=int, default=5000)
+    replay.add_argument("--dry-run", action="store_true", help="Chỉ parse, không ghi DB")
+    sub.add_parser("ls", help="Liệt kê object trong archive").add_argument("--uri", default=ARCHIVE_URI)
+    args = parser.parse_args()
+
+    if args.command == "ls":
+        for key in list_archive(args.uri):
+            print(key)
+        return 0
+
+    replay_archive(args.uri, args.zone, args.kind, args.workers, args.batch_size, args.dry_run)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,56 @@
+"""
+SQL độ đầy đủ của chuỗi giờ electricity_measurements: giờ thiếu / toàn 0 và các khoảng thiếu.
+
+Dùng cho backfill + báo cáo completeness của ingestion và GET /status/completeness của API,
+để "giờ thiếu" có đúng một định nghĩa ở mọi nơi.
+
+Lưu ý: file này có bản sao y hệt ở ec2/api/completeness.py (mỗi service build image
+riêng) — sửa ở đây thì sửa cả bên kia.
+"""
+
+# Giờ bị coi là "lỗ": không có dòng nào, hoặc có nhưng toàn 0 (API nguồn trả về rỗng)
+ALL_ZEROS_CONDITION = "COALESCE(m.solar_mw, 0) = 0 AND COALESCE(m.wind_mw, 0) = 0 AND COALESCE(m.gas_mw, 0) = 0"
+
+
+def _missing_slots(usable_condition):
+    """Các giờ trong [start, end] của zone không có dòng thoả `usable_condition` (tham số %(start)s, %(end)s, %(zone)s)."""
+    return f"""
+    FROM generate_series(%(start)s::timestamp, %(end)s::timestamp, interval '1 hour') AS slot
+    WHERE NOT EXISTS (
+        SELECT 1 FROM electricity_measurements m
+        WHERE m.zone = %(zone)s AND m.datetime = slot
+          AND ({usable_condition})
+    )
+"""
+
+
+_MISSING_SLOTS = _missing_slots(f"NOT ({ALL_ZEROS_CONDITION})")
+
+# Giờ backfill cần lấy lại. Giờ toàn 0 trước %(zero_retry_from)s coi như đã lấy mà nguồn không
+# có dữ liệu: không gọi lại API cho chúng ở mọi lần backfill.
+GAP_SQL = f"""
+    SELECT slot
+    {_missing_slots(f"NOT ({ALL_ZEROS_CONDITION}) OR m.datetime < %(zero_retry_from)s")}
+    ORDER BY slot
+"""
+
+# Gaps & islands: các giờ thiếu liên tiếp có cùng (slot - row_number giờ)
+GAP_RANGES_SQL = f"""
+    WITH missing AS (
+        SELECT slot, slot - ROW_NUMBER() OVER (ORDER BY slot) * interval '1 hour' AS grp
+        {_MISSING_SLOTS}
+    )
+    SELECT MIN(slot) AS gap_start, MAX(slot) + interval '1 hour' AS gap_end, COUNT(*) AS hours
+    FROM missing
+    GROUP BY grp
+    ORDER BY gap_start ASC
+"""
+
+COMPLETENESS_SQL = f"""
+    SELECT
+        COUNT(*) AS expected_hours,
+        COUNT(m.datetime) AS present_hours,
+        COUNT(m.datetime) FILTER (WHERE {ALL_ZEROS_CONDITION}) AS zero_hours
+    FROM generate_series(%(start)s::timestamp, %(end)s::timestamp, interval '1 hour') AS slot
+    LEFT JOIN electricity_measurements m ON m.zone = %(zone)s AND m.datetime = slot
+"""
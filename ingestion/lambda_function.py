@@ -1,19 +1,59 @@
+import os
 import logging
 import json
-from app import run_realtime_job, run_backfill_job
+import telemetry
+from app import run_realtime_job, run_backfill_job, data_completeness_report, HISTORY_DAYS
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+# Dừng backfill khi thời gian còn lại của Lambda dưới ngưỡng này (1 chunk có thể mất ~90s với retry)
+BACKFILL_SAFETY_MS = int(os.getenv("BACKFILL_SAFETY_MS", 90000))
+# Tự gọi lại chính Lambda (async) với continuation token khi backfill chưa xong
+BACKFILL_SELF_INVOKE = os.getenv("BACKFILL_SELF_INVOKE", "false").lower() == "true"
+
+# Danh sách Lambda (phân cách bởi dấu phẩy) gọi async sau realtime job, CHỈ khi DB thay đổi
+DOWNSTREAM_ON_CHANGE = [n.strip() for n in os.getenv("DOWNSTREAM_ON_CHANGE", "").split(",") if n.strip()]
+
+def _time_budget(context):
+    """Hàm should_stop() dựa trên context.get_remaining_time_in_millis() (None khi chạy local)."""
+    if context is None or not hasattr(context, 'get_remaining_time_in_millis'):
+        return lambda: False
+    return lambda: context.get_remaining_time_in_millis() < BACKFILL_SAFETY_MS
+
+def _reinvoke_self(context, token):
+    import boto3
+    boto3.client('lambda').invoke(
+        FunctionName=context.invoked_function_arn,
+        InvocationType='Event',
+        Payload=json.dumps({'action': 'backfill', 'continuation_token': token})
+    )
+
+def _trigger_downstream(names):
+    import boto3
+    client = boto3.client('lambda')
+    triggered = []
+    for name in names:
+        try:
+            client.invoke(FunctionName=name, InvocationType='Event', Payload=json.dumps({'source': 'ingestion'}))
+            triggered.append(name)
+        except Exception as e:
+            logger.warning(f"⚠️ Could not trigger {name}: {e}")
+    return triggered
+
 def lambda_handler(event, context):
     """
     AWS Lambda Entry Point.
     Hỗ trợ payload: {"action": "backfill", "start_date": "2025-11-25"}
+                    {"action": "backfill", "continuation_token": "<token trả về lần trước>"}
+                    {"action": "completeness", "days": 30}
     """
     logger.info(f"🚀 Event Received: {json.dumps(event)}")
     
     action = 'realtime'
     force_start_date = None # Biến để chứa ngày bắt đầu (nếu có)
+    continuation_token = None
+    days = HISTORY_DAYS
     
     # 1. Trích xuất tham số từ Event
     if isinstance(event, dict):
@@ -21,32 +61,83 @@ def lambda_handler(event, context):
         if 'action' in event:
             action = event['action']
             force_start_date = event.get('start_date') # Lấy start_date
+            continuation_token = event.get('continuation_token')
+            days = event.get('days', HISTORY_DAYS)
             
         # Trường hợp gọi qua API Gateway Proxy (nếu có dùng)
         elif 'queryStringParameters' in event and event['queryStringParameters']:
              params = event['queryStringParameters']
              action = params.get('action', 'realtime')
              force_start_date = params.get('start_date')
+             continuation_token = params.get('continuation_token')
+             days = params.get('days', HISTORY_DAYS)
+
+    try:
+        days = int(days)
+        if days < 1:
+            raise ValueError
+    except (TypeError, ValueError):
+        return {
+            'statusCode': 400,
+            'body': json.dumps({'error': f"Invalid days '{days}', expected a positive integer"})
+        }
 
+    telemetry.reset()
     try:
         if action == 'backfill':
             # 2. Truyền start_date vào hàm xử lý
-            logger.info(f"Triggering Backfill Job... (Start Date: {force_start_date})")
-            run_backfill_job(force_start_date=force_start_date)
-            message = f"Backfill job completed (Start: {force_start_date})."
+            logger.info(f"Triggering Backfill Job... (Start Date: {force_start_date}, Token: {continuation_token})")
+            result = run_backfill_job(
+                force_start_date=force_start_date,
+                continuation_token=continuation_token,
+                should_stop=_time_budget(context)
+            )
+            if result['status'] == 'partial':
+                self_invoked = False
+                if BACKFILL_SELF_INVOKE and context is not None:
+                    _reinvoke_self(context, result['continuation_token'])
+                    self_invoked = True
+                return {
+                    'statusCode': 202,
+                    'body': json.dumps({
+                        'message': 'Backfill paused before Lambda timeout.',
+                        'continuation_token': result['continuation_token'],
+                        'remaining_windows': result['remaining_windows'],
+                        'rows_changed': result['rows_changed'],
+                        'self_invoked': self_invoked,
+                        'metrics': telemetry.snapshot()
+                    })
+                }
+            message = f"Backfill job {result['status']} (Start: {force_start_date}, {result['rows_changed']} rows changed)."
+        elif action == 'completeness':
+            report = data_completeness_report(days=days)
+            return {
+                'statusCode': 200,
+                'body': json.dumps({'message': 'Completeness report', 'report': report, 'metrics': telemetry.snapshot()})
+            }
         else:
             logger.info("Triggering Realtime Job...")
-            run_realtime_job()
-            message = "Realtime job completed."
+            changed = run_realtime_job()
+            # Tick không đổi dữ liệu -> không cần chạy lại analysis/clustering/prediction
+            triggered = _trigger_downstream(DOWNSTREAM_ON_CHANGE) if changed and DOWNSTREAM_ON_CHANGE else []
+            return {
+                'statusCode': 200,
+                'body': json.dumps({
+                    'message': "Realtime job completed." if changed else "Realtime job completed, no changes.",
+                    'changed': changed,
+                    'triggered': triggered,
+                    'metrics': telemetry.snapshot()
+                })
+            }
 
         return {
             'statusCode': 200,
-            'body': json.dumps({'message': message})
+            'body': json.dumps({'message': message, 'metrics': telemetry.snapshot()})
         }
 
     except Exception as e:
         logger.error(f"Function failed: {str(e)}")
         return {
             'statusCode': 500,
-            'body': json.dumps({'error': str(e)})
+            'body': json.dumps({'error': str(e), 'metrics': telemetry.snapshot()})
         }
\ No newline at end of file
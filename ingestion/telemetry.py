@@ -0,0 +1,143 @@
+"""
+Instrumentation dùng chung cho các service (Lambda jobs + API).
+
+- span(name): đo thời gian một stage (read_sql, resample, to_sql...); in dòng [TRACE]
+  cho từng span chỉ khi TELEMETRY_TRACE=true (số liệu vẫn vào snapshot/Prometheus).
+- observe(name, seconds): ghi nhận thời gian đo sẵn, không in log.
+- incr(name, value, **labels): counter (rows_in, rows_out, bytes, retries...).
+- set_gauge(name, value, **labels): giá trị tức thời (peak RSS...).
+- snapshot(): tóm tắt dạng dict để trả về trong body của Lambda.
+- render_prometheus(): text exposition format cho endpoint /metrics.
+
+Chỉ dùng thư viện chuẩn để không làm tăng cold start. Mỗi service giữ một
+bản copy giống hệt file này vì mỗi image Docker được build từ thư mục riêng.
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+METRIC_PREFIX = "electricity"
+TRACE = os.getenv("TELEMETRY_TRACE", "false").lower() == "true"
+
+_lock = threading.Lock()
+_spans = {}     # (name, labels) -> [count, total_s, max_s]
+_counters = {}  # (name, labels) -> value
+_gauges = {}    # (name, labels) -> value
+
+
+def _key(name, labels):
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_key(key):
+    name, labels = key
+    if not labels:
+        return name
+    return name + "{" + ",".join(f"{k}={v}" for k, v in labels) + "}"
+
+
+def reset():
+    """Xoá toàn bộ số liệu (gọi ở đầu mỗi lần chạy job)."""
+    with _lock:
+        _spans.clear()
+        _counters.clear()
+        _gauges.clear()
+
+
+@contextmanager
+def span(name, **labels):
+    """Đo thời gian một stage. Dùng: `with telemetry.span("read_sql"): ...`"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        observe(name, elapsed, **labels)
+        if TRACE:
+            print(f"[TRACE] {_format_key(_key(name, labels))} {elapsed * 1000:.1f}ms")
+
+
+def observe(name, seconds, **labels):
+    """Ghi nhận thời gian đã đo sẵn (không in log, dùng cho request path của API)."""
+    key = _key(name, labels)
+    with _lock:
+        stat = _spans.setdefault(key, [0, 0.0, 0.0])
+        stat[0] += 1
+        stat[1] += seconds
+        stat[2] = max(stat[2], seconds)
+
+
+def incr(name, value=1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def set_gauge(name, value, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _gauges[key] = value
+
+
+def snapshot():
+    """Tóm tắt các span/counter/gauge hiện tại (JSON-serializable)."""
+    with _lock:
+        return {
+            "spans": {
+                _format_key(k): {
+                    "count": c,
+                    "total_ms": round(total * 1000, 2),
+                    "max_ms": round(mx * 1000, 2),
+                }
+                for k, (c, total, mx) in _spans.items()
+            },
+            "counters": {_format_key(k): v for k, v in _counters.items()},
+            "gauges": {_format_key(k): v for k, v in _gauges.items()},
+        }
+
+
+def _prom_labels(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    def esc(v):
+        return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in items) + "}"
+
+
+def render_prometheus():
+    """Xuất số liệu theo Prometheus text format (version 0.0.4)."""
+    lines = []
+    with _lock:
+        spans = sorted(_spans.items())
+        counters = sorted(_counters.items())
+        gauges = sorted(_gauges.items())
+
+    if spans:
+        lines.append(f"# TYPE {METRIC_PREFIX}_stage_seconds summary")
+        for (name, labels), (count, total, _) in spans:
+            lbl = _prom_labels(labels, [("stage", name)])
+            lines.append(f"{METRIC_PREFIX}_stage_seconds_sum{lbl} {total:.6f}")
+            lines.append(f"{METRIC_PREFIX}_stage_seconds_count{lbl} {count}")
+        lines.append(f"# TYPE {METRIC_PREFIX}_stage_seconds_max gauge")
+        for (name, labels), (_, _, mx) in spans:
+            lbl = _prom_labels(labels, [("stage", name)])
+            lines.append(f"{METRIC_PREFIX}_stage_seconds_max{lbl} {mx:.6f}")
+
+    seen = set()
+    for (name, labels), value in counters:
+        metric = f"{METRIC_PREFIX}_{name}_total"
+        if metric not in seen:
+            lines.append(f"# TYPE {metric} counter")
+            seen.add(metric)
+        lines.append(f"{metric}{_prom_labels(labels)} {value}")
+
+    for (name, labels), value in gauges:
+        metric = f"{METRIC_PREFIX}_{name}"
+        if metric not in seen:
+            lines.append(f"# TYPE {metric} gauge")
+            seen.add(metric)
+        lines.append(f"{metric}{_prom_labels(labels)} {value}")
+
+    return "\n".join(lines) + "\n"
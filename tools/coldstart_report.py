@@ -0,0 +1,165 @@
+"""
+Đo cold start (thời gian import + RSS) của 4 Lambda handler và so với baseline.
+
+Mỗi handler được import trong một process Python mới, cwd = thư mục service
+(giống LAMBDA_TASK_ROOT trong image):
+- init : `import lambda_function` -> chi phí Lambda trả trong init phase.
+- path : init + các module import muộn trên nhánh chính (TensorFlow, sklearn...)
+         -> chi phí thực của lần invoke đầu tiên.
+
+    python tools/coldstart_report.py                    # in report, so với baseline
+    python tools/coldstart_report.py --update-baseline  # ghi lại baseline mới
+    python tools/coldstart_report.py --only prediction --repeat 5
+
+Exit code 1 nếu handler nào vượt baseline quá --tolerance, hoặc import lỗi.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_PATH = os.path.join(ROOT, "tools", "coldstart_baseline.json")
+
+# handler -> (thư mục service, các module được import muộn trên nhánh chính)
+HANDLERS = {
+    "ingestion": ("ingestion", ["requests", "snapshots"]),
+    "analysis": ("backend/data_analysis", []),
+    "clustering": ("backend/clustering", ["joblib", "sklearn.cluster", "sklearn.metrics", "sklearn.preprocessing"]),
+    "prediction": ("backend/prediction", ["joblib", "tensorflow"]),
+}
+
+CHILD = """
+import importlib, json, resource, sys, time
+t0 = time.perf_counter()
+import lambda_function
+init_s = time.perf_counter() - t0
+init_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+for name in sys.argv[1:]:
+    importlib.import_module(name)
+path_s = time.perf_counter() - t0
+path_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({"init_ms": init_s * 1000, "init_rss_mb": init_rss / 1024,
+                  "path_ms": path_s * 1000, "path_rss_mb": path_rss / 1024}))
+"""
+
+METRICS = ("init_ms", "init_rss_mb", "path_ms", "path_rss_mb")
+
+
+def run_child(service_dir, deferred, importtime=False):
+    env = dict(os.environ, LAMBDA_TASK_ROOT=service_dir, PYTHONDONTWRITEBYTECODE="1")
+    cmd = [sys.executable] + (["-X", "importtime"] if importtime else []) + ["-c", CHILD] + deferred
+    proc = subprocess.run(cmd, cwd=service_dir, env=env, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "import failed")
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    return result, proc.stderr
+
+
+def top_imports(importtime_stderr, limit, local_modules=()):
+    """Các package tốn thời gian nhất (cumulative) từ output của -X importtime."""
+    packages = {}
+    for line in importtime_stderr.splitlines():
+        if not line.startswith("import time:") or line.count("|") != 2:
+            continue
+        _, cumulative, name = line.split("|")
+        name = name.strip()
+        # Chỉ lấy dòng import chính package (không phải submodule), bỏ qua module của service
+        if "." in name or name in local_modules:
+            continue
+        try:
+            packages[name] = max(packages.get(name, 0), int(cumulative))
+        except ValueError:
+            continue
+    ranked = sorted(packages.items(), key=lambda kv: kv[1], reverse=True)
+    return [(name, us / 1000) for name, us in ranked[:limit]]
+
+
+def profile(name, repeat, top):
+    rel_dir, deferred = HANDLERS[name]
+    service_dir = os.path.join(ROOT, rel_dir)
+    samples = []
+    for _ in range(repeat):
+        result, _ = run_child(service_dir, deferred)
+        samples.append(result)
+    _, stderr = run_child(service_dir, deferred, importtime=True)
+    local_modules = {f[:-3] for f in os.listdir(service_dir) if f.endswith(".py")}
+    report = {m: round(statistics.median(s[m] for s in samples), 1) for m in METRICS}
+    report["top_imports"] = [[mod, round(ms, 1)] for mod, ms in top_imports(stderr, top, local_modules)]
+    return report
+
+
+def compare(report, baseline, tolerance, slack_ms):
+    """Trả về danh sách regression (metric, giá trị hiện tại, baseline)."""
+    regressions = []
+    for metric in METRICS:
+        base = baseline.get(metric)
+        if base is None:
+            continue
+        limit = base * (1 + tolerance)
+        if metric.endswith("_ms"):
+            limit += slack_ms
+        if report[metric] > limit:
+            regressions.append((metric, report[metric], base))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--only", choices=sorted(HANDLERS), action="append")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--top", type=int, default=5, help="Số import nặng nhất hiển thị")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Cho phép vượt baseline bao nhiêu (0.2 = 20%%)")
+    parser.add_argument("--slack-ms", type=float, default=25.0, help="Sai số tuyệt đối cho metric thời gian")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--json", help="Ghi report ra file JSON")
+    args = parser.parse_args()
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    reports, failed = {}, False
+    print(f"{'handler':<11} {'init ms':>9} {'init MB':>8} {'path ms':>9} {'path MB':>8}  status")
+    for name in args.only or list(HANDLERS):
+        try:
+            report = profile(name, args.repeat, args.top)
+        except Exception as e:
+            print(f"{name:<11} {'-':>9} {'-':>8} {'-':>9} {'-':>8}  ERROR: {e}")
+            reports[name] = {"error": str(e)}
+            failed = True
+            continue
+        reports[name] = report
+        regressions = compare(report, baseline.get(name, {}), args.tolerance, args.slack_ms)
+        if regressions:
+            failed = True
+            status = "REGRESSION " + ", ".join(f"{m} {cur} > {base}" for m, cur, base in regressions)
+        else:
+            status = "ok" if name in baseline else "no baseline"
+        print(f"{name:<11} {report['init_ms']:>9.1f} {report['init_rss_mb']:>8.1f} "
+              f"{report['path_ms']:>9.1f} {report['path_rss_mb']:>8.1f}  {status}")
+        for mod, ms in report["top_imports"]:
+            print(f"{'':<11}   {ms:>8.1f} ms  {mod}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(reports, f, indent=2)
+
+    if args.update_baseline:
+        ok = {k: {m: v[m] for m in METRICS} for k, v in reports.items() if "error" not in v}
+        baseline.update(ok)
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Baseline updated: {args.baseline}")
+        return 0
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())